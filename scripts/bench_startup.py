@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Startup-time budget per pmsf subcommand.
+
+Each case runs in a fresh interpreter against an empty store and universe (so the
+command returns at once and what's timed is mostly imports + setup), N times; the
+fastest run minus the fastest bare interpreter startup is compared with the case's
+budget (the minimum is the least noisy estimate of a cold start: scheduler hiccups and
+first-run disk cache misses only ever add time). Commands
+that run forever (price / alerts / serve) are timed as the imports they pull in.
+Exit status 1 if any case is over budget.
+
+  python scripts/bench_startup.py
+  python scripts/bench_startup.py --runs 15 --scale 2  # slower machine: double budgets
+  python scripts/bench_startup.py --importtime score   # where the time goes
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+RUN_CLI = "from pmsf.cli import main; main()"
+
+# name -> (kind, args, budget ms over bare `python -c pass`); budgets are about twice a
+# typical fastest run, so machine noise doesn't trip them but pulling httpx or the alert
+# pipeline into score/rank does
+#   kind "cli": pmsf args;  kind "import": modules imported after pmsf.cli
+CASES: Dict[str, Tuple[str, List[str], float]] = {
+    "help": ("cli", ["--help"], 60.0),
+    "score": ("cli", ["score", "--universe", "{uni}"], 220.0),
+    "reindex": ("cli", ["reindex", "--universe", "{uni}"], 200.0),
+    "rank": ("cli", ["rank", "--top", "1"], 180.0),
+    "positions": ("cli", ["positions", "--wallet", "0x0"], 180.0),
+    "replicate": ("cli", ["replicate", "--to", "{tmp}/replica.lmdb", "--once", "--quiet"], 180.0),
+    "collect": ("cli", ["collect", "--universe", "{uni}", "--replay"], 600.0),
+    "price": ("import", ["pmsf.dirty", "pmsf.pricer", "pmsf.sharding", "pmsf.storage_lmdb"], 160.0),
+    "alerts": ("import", ["pmsf.alerts", "pmsf.dirty", "pmsf.sharding", "rich.console"], 220.0),
+    "serve": ("import", ["pmsf.server", "pmsf.sharding", "rich.console"], 240.0),
+}
+
+
+def _argv(kind: str, args: List[str], tmp: Path) -> List[str]:
+    if kind == "cli":
+        return [sys.executable, "-c", RUN_CLI, *(a.format(tmp=tmp, uni=tmp / "universe.json") for a in args)]
+    return [sys.executable, "-c", "import pmsf.cli, " + ", ".join(args)]
+
+
+def _time(argv: List[str], env: Dict[str, str], cwd: Path, runs: int) -> float:
+    ts = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        r = subprocess.run(argv, env=env, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        ts.append(time.perf_counter() - t0)
+        if r.returncode != 0:
+            raise SystemExit(f"{' '.join(argv[3:] or argv[2:])} failed:\n{r.stderr.decode(errors='replace')}")
+    return min(ts) * 1000.0
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("cases", nargs="*", help=f"subset of: {', '.join(CASES)}")
+    ap.add_argument("--runs", type=int, default=9)
+    ap.add_argument("--scale", type=float, default=1.0, help="multiply every budget")
+    ap.add_argument("--importtime", action="store_true", help="print python -X importtime output instead")
+    args = ap.parse_args()
+    names = args.cases or list(CASES)
+    unknown = [n for n in names if n not in CASES]
+    if unknown:
+        raise SystemExit(f"unknown case(s): {', '.join(unknown)}")
+
+    with tempfile.TemporaryDirectory(prefix="pmsf-bench-") as d:
+        tmp = Path(d)
+        (tmp / "universe.json").write_bytes(b'{"markets": []}')
+        env = dict(os.environ)
+        env.update(
+            PMSF_LMDB_PATH=str(tmp / "polymarket.lmdb"),
+            PMSF_LOG_DIR=str(tmp / "logs"),
+            PMSF_HTTP_CACHE_DIR=str(tmp / "http-cache.lmdb"),
+            PMSF_SHARDS="1",
+        )
+        # create the store once, so read-only commands have one to open
+        _time(_argv(*CASES["score"][:2], tmp), env, tmp, 1)
+
+        if args.importtime:
+            for n in names:
+                kind, a, _ = CASES[n]
+                argv = _argv(kind, a, tmp)
+                subprocess.run([argv[0], "-X", "importtime", *argv[1:]], env=env, cwd=tmp, stdout=subprocess.DEVNULL)
+            return 0
+
+        base = _time([sys.executable, "-c", "pass"], env, tmp, args.runs)
+        print(f"{'case':<10} {'ms':>8} {'budget':>8}   (interpreter startup {base:.0f}ms subtracted)")
+        over = 0
+        for n in names:
+            kind, a, budget = CASES[n]
+            argv = _argv(kind, a, tmp)
+            _time(argv, env, tmp, 1)  # warm-up: the case's first run pays for cold bytecode/disk caches
+            ms = _time(argv, env, tmp, args.runs) - base
+            budget *= args.scale
+            flag = "" if ms <= budget else "  OVER"
+            over += bool(flag)
+            print(f"{n:<10} {ms:8.1f} {budget:8.0f}{flag}")
+        return 1 if over else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Local fake trade feed for exercising `pmsf collect --mode stream` end to end.
+
+    python scripts/fake_trade_feed.py --universe ./data/universe.json --rate 20
+    pmsf collect --universe ./data/universe.json --mode stream \
+        --feed-url ws://127.0.0.1:8765 --no-gap-fill
+
+Trades are emitted in the RTDS envelope shape ({"topic", "type", "payload"}).
+--drop-after N closes each connection after N messages to exercise reconnects.
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import secrets
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import orjson
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.server import serve
+
+
+def fake_trade(condition_id: str, wallets: List[str]) -> Dict[str, Any]:
+    return {
+        "conditionId": condition_id,
+        "proxyWallet": random.choice(wallets),
+        "side": random.choice(["BUY", "SELL"]),
+        "outcome": random.choice(["Yes", "No"]),
+        "size": round(random.uniform(1, 2000), 2),
+        "price": round(random.uniform(0.02, 0.98), 3),
+        "timestamp": int(time.time()),
+        "transactionHash": "0x" + secrets.token_hex(32),
+    }
+
+
+def main() -> int:
+    p = argparse.ArgumentParser()
+    g = p.add_mutually_exclusive_group(required=True)
+    g.add_argument("--universe")
+    g.add_argument("--condition-id", action="append")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--rate", type=float, default=10.0, help="trades per second per connection")
+    p.add_argument("--wallets", type=int, default=50)
+    p.add_argument("--drop-after", type=int, default=0)
+    args = p.parse_args()
+
+    if args.universe:
+        cids = [m["conditionId"] for m in orjson.loads(Path(args.universe).read_bytes())["markets"]]
+    else:
+        cids = args.condition_id
+    wallets = ["0x" + secrets.token_hex(20) for _ in range(args.wallets)]
+
+    def handler(ws: Any) -> None:
+        sent = 0
+        try:
+            while True:
+                msg = {"topic": "activity", "type": "trades", "payload": fake_trade(random.choice(cids), wallets)}
+                ws.send(orjson.dumps(msg).decode("utf-8"))
+                sent += 1
+                if args.drop_after and sent >= args.drop_after:
+                    ws.close()
+                    return
+                time.sleep(1.0 / args.rate)
+        except ConnectionClosed:
+            return
+
+    with serve(handler, args.host, args.port) as server:
+        print(f"fake trade feed on ws://{args.host}:{args.port} ({len(cids)} markets)")
+        server.serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,10 +1,19 @@
 from __future__ import annotations
 
-from typing import Any, Dict
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence
 
+import orjson
 from rich.console import Console
 
-from .flow import smart_flow_market
+from .flow import NO_WID, _SmartTest, smart_flow_multi, smart_flow_universe, unpack_trade_index, write_flow_snap
+from .sketches import distinct_wallets, load_quantile_sketch
+from .wallet_ids import WalletBitmap, wallet_ids
 
 console = Console()
 
@@ -13,6 +22,276 @@ def check_alert(flow: Dict[str, Any], threshold_usd: float) -> bool:
     return abs(float(flow.get("smart_net_usd", 0.0))) >= float(threshold_usd)
 
 
+class AlertGate:
+    """
+    Per-market cooldown + hysteresis.
+
+    A market fires when |net| >= threshold, then is disarmed until |net| drops below
+    threshold * rearm_ratio. Even when armed, it can't fire again within cooldown_sec.
+    A sign flip (smart money reversing) fires through a disarmed gate, cooldown permitting.
+    """
+
+    def __init__(self, threshold_usd: float, cooldown_sec: float = 900.0, rearm_ratio: float = 0.5) -> None:
+        self.threshold_usd = float(threshold_usd)
+        self.cooldown_sec = float(cooldown_sec)
+        self.rearm_ratio = float(rearm_ratio)
+        self._armed: Dict[str, bool] = {}
+        self._last_fire: Dict[str, float] = {}
+        self._last_sign: Dict[str, int] = {}
+        self.suppressed = 0
+
+    def should_fire(self, condition_id: str, net_usd: float, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        level = abs(float(net_usd))
+        sign = 1 if net_usd >= 0 else -1
+
+        if level < self.threshold_usd * self.rearm_ratio:
+            self._armed[condition_id] = True
+        if level < self.threshold_usd:
+            return False
+
+        armed = self._armed.get(condition_id, True)
+        flipped = self._last_sign.get(condition_id, sign) != sign
+        if not (armed or flipped) or now - self._last_fire.get(condition_id, float("-inf")) < self.cooldown_sec:
+            self.suppressed += 1
+            return False
+
+        self._armed[condition_id] = False
+        self._last_fire[condition_id] = now
+        self._last_sign[condition_id] = sign
+        return True
+
+
+def alert_event(flow: Dict[str, Any], threshold_usd: float) -> Dict[str, Any]:
+    net = float(flow.get("smart_net_usd", 0.0))
+    ev = {
+        "type": "smart_flow",
+        "conditionId": flow["conditionId"],
+        "ts": flow["ts"],
+        "window_sec": flow["window_sec"],
+        "direction": "YES" if net >= 0 else "NO",
+        "smart_net_usd": net,
+        "smart_vol_usd": float(flow.get("smart_vol_usd", 0.0)),
+        "smart_trades": int(flow.get("smart_trades", 0)),
+        "smart_wallets": int(flow.get("smart_wallets", 0)),
+        "threshold_usd": float(threshold_usd),
+    }
+    if "windows" in flow:
+        ev["windows"] = flow["windows"]
+    return ev
+
+
+# -------- Sinks --------
+class AlertSink(ABC):
+    """
+    Receives batches of alert events from a dispatcher worker thread.
+    """
+
+    name = "sink"
+
+    @abstractmethod
+    def emit(self, batch: List[Dict[str, Any]]) -> None:
+        """
+        Deliver one batch; an exception is counted by the dispatcher, not retried.
+        """
+
+    def close(self) -> None:
+        pass
+
+
+class ConsoleSink(AlertSink):
+    name = "console"
+
+    def __init__(self, out: Optional[Console] = None) -> None:
+        self.out = out or console
+
+    def emit(self, batch: List[Dict[str, Any]]) -> None:
+        for a in batch:
+            if a.get("type") == "whale_trade":
+                self.out.print(
+                    f"[bold yellow]WHALE[/bold yellow] market={a['conditionId']} wallet={a['wallet']} "
+                    f"{a['direction']} usd={a['usd']:.2f} >= p{a['pct'] * 100:g}={a['threshold_usd']:.2f} "
+                    f"wallets_24h~{a['distinct_wallets_24h']}"
+                )
+                continue
+            self.out.print(
+                f"[bold yellow]ALERT[/bold yellow] market={a['conditionId']} "
+                f"smart_net_usd={a['smart_net_usd']:.2f} "
+                f"smart_vol_usd={a['smart_vol_usd']:.2f} "
+                f"wallets={a['smart_wallets']} trades={a['smart_trades']} "
+                f"window={a['window_sec']}s"
+            )
+
+
+class JsonlSink(AlertSink):
+    name = "jsonl"
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.f = path.open("ab")
+
+    def emit(self, batch: List[Dict[str, Any]]) -> None:
+        self.f.write(b"".join(orjson.dumps(a) + b"\n" for a in batch))
+        self.f.flush()
+
+    def close(self) -> None:
+        self.f.close()
+
+
+class WebhookSink(AlertSink):
+    """
+    POSTs {"alerts": [...]} to a local/remote HTTP endpoint, one request per batch.
+    """
+
+    name = "webhook"
+
+    def __init__(self, url: str, timeout_sec: float = 5.0) -> None:
+        import httpx  # only webhook users pay for it
+
+        self.url = url
+        self.client = httpx.Client(headers={"User-Agent": "pmsf/0.1"}, timeout=timeout_sec)
+
+    def emit(self, batch: List[Dict[str, Any]]) -> None:
+        r = self.client.post(
+            self.url, content=orjson.dumps({"alerts": batch}), headers={"Content-Type": "application/json"}
+        )
+        r.raise_for_status()
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class AlertDispatcher:
+    """
+    Non-blocking, batched fan-out of alert events to sinks.
+
+    Each sink gets its own bounded queue and worker thread, so a slow or failing sink
+    only ever delays (or drops) its own deliveries. publish() never blocks: when a
+    sink's queue is full the event is dropped for that sink and counted in `dropped`.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        sinks: Iterable[AlertSink],
+        max_queue: int = 10_000,
+        batch_max: int = 100,
+        flush_sec: float = 0.5,
+    ) -> None:
+        self.sinks = list(sinks)
+        self.batch_max = batch_max
+        self.flush_sec = flush_sec
+        self.dropped: Dict[str, int] = {s.name: 0 for s in self.sinks}
+        self.errors: Dict[str, int] = {s.name: 0 for s in self.sinks}
+        self._queues: List[queue.Queue] = []
+        self._threads: List[threading.Thread] = []
+        for s in self.sinks:
+            q: queue.Queue = queue.Queue(maxsize=max_queue)
+            t = threading.Thread(target=self._worker, args=(s, q), name=f"pmsf-alert-{s.name}", daemon=True)
+            self._queues.append(q)
+            self._threads.append(t)
+            t.start()
+
+    def publish(self, alert: Dict[str, Any]) -> None:
+        for s, q in zip(self.sinks, self._queues):
+            try:
+                q.put_nowait(alert)
+            except queue.Full:
+                self.dropped[s.name] += 1
+
+    def _worker(self, sink: AlertSink, q: queue.Queue) -> None:
+        stopping = False
+        while not stopping:
+            try:
+                first = q.get(timeout=self.flush_sec)
+            except queue.Empty:
+                continue
+            batch: List[Dict[str, Any]] = []
+            item = first
+            while True:
+                if item is self._STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_max:
+                    break
+                try:
+                    item = q.get_nowait()
+                except queue.Empty:
+                    break
+            if not batch:
+                continue
+            try:
+                sink.emit(batch)
+            except Exception:
+                self.errors[sink.name] += 1
+
+    def close(self, timeout_sec: float = 5.0) -> None:
+        """
+        Deliver what is queued (within timeout_sec per sink), then stop workers and close sinks.
+        """
+        for q in self._queues:
+            try:
+                q.put(self._STOP, timeout=timeout_sec)
+            except queue.Full:
+                pass
+        for t in self._threads:
+            t.join(timeout=timeout_sec)
+        for s in self.sinks:
+            try:
+                s.close()
+            except Exception:
+                pass
+
+
+def alert_on_flow(
+    store,
+    multi: Dict[str, Any],
+    threshold_usd: float,
+    gate: Optional[AlertGate] = None,
+    dispatcher: Optional[AlertDispatcher] = None,
+    persist_flow: bool = False,
+    pending: Optional[List[Future]] = None,
+) -> bool:
+    """
+    Alert decision for one market's multi-window flow (smart_flow_multi format); the first
+    window is the alert window, the others are attached to the alert as report windows.
+    Fires (returns True) when it crosses the threshold and the gate (if any) lets it through.
+    Alerts go to the dispatcher, or straight to the console when there is none.
+    With persist_flow, the snapshot write's Future goes to pending when given, else it is
+    awaited here.
+    """
+    if persist_flow:
+        fut = write_flow_snap(store, multi)
+        if pending is None:
+            fut.result()
+        else:
+            pending.append(fut)
+    condition_id = multi["conditionId"]
+    flow = {"conditionId": condition_id, "ts": multi["ts"], **multi["windows"][0]}
+    if len(multi["windows"]) > 1:
+        flow["windows"] = multi["windows"]
+
+    if gate is not None:
+        fire = gate.should_fire(condition_id, float(flow.get("smart_net_usd", 0.0)), now=flow["ts"])
+    else:
+        fire = check_alert(flow, threshold_usd)
+    if not fire:
+        return False
+
+    event = alert_event(flow, threshold_usd)
+    if dispatcher is not None:
+        dispatcher.publish(event)
+    else:
+        ConsoleSink().emit([event])
+    return True
+
+
+def alert_windows(window_sec: int, report_windows: Sequence[int] = ()) -> List[int]:
+    return [int(window_sec)] + [int(w) for w in report_windows if int(w) != int(window_sec)]
+
+
 def run_alert_once(
     store,
     condition_id: str,
@@ -21,27 +300,155 @@ def run_alert_once(
     smart_min_trades: int,
     smart_min_volume_usd: float,
     smart_score_threshold: float,
+    gate: Optional[AlertGate] = None,
+    dispatcher: Optional[AlertDispatcher] = None,
+    report_windows: Sequence[int] = (),
+    persist_flow: bool = False,
+    smart_wallets: Optional[WalletBitmap] = None,
 ) -> bool:
-    flow = smart_flow_market(
+    """
+    Evaluate one market. Fires (returns True) when the flow over window_sec crosses the
+    threshold and the gate (if any) lets it through. Alerts go to the dispatcher, or straight
+    to the console when there is none. Nothing is printed for markets that don't alert.
+
+    report_windows are extra horizons computed in the same scan and attached to the alert
+    (and to the stored flow snapshot when persist_flow is set). smart_wallets, when given,
+    replaces per-wallet stats lookups (e.g. a bitmap of smart ids of this store, from
+    stats merged across shards once per tick).
+    """
+    multi = smart_flow_multi(
         store,
         condition_id,
-        window_sec=window_sec,
+        alert_windows(window_sec, report_windows),
         smart_min_trades=smart_min_trades,
         smart_min_volume_usd=smart_min_volume_usd,
         smart_score_threshold=smart_score_threshold,
+        smart_wallets=smart_wallets,
     )
+    return alert_on_flow(store, multi, threshold_usd, gate, dispatcher, persist_flow)
 
-    if check_alert(flow, threshold_usd):
-        console.print(
-            f"[bold yellow]ALERT[/bold yellow] market={condition_id} "
-            f"smart_net_usd={flow['smart_net_usd']:.2f} "
-            f"smart_vol_usd={flow['smart_vol_usd']:.2f} "
-            f"wallets={flow['smart_wallets']} trades={flow['smart_trades']} "
-            f"window={window_sec}s"
-        )
-        return True
 
-    console.print(
-        f"[dim]no alert[/dim] market={condition_id} net={flow['smart_net_usd']:.2f} vol={flow['smart_vol_usd']:.2f}"
+def run_alert_universe(
+    store,
+    condition_ids: Sequence[str],
+    window_sec: int,
+    threshold_usd: float,
+    smart_min_trades: int,
+    smart_min_volume_usd: float,
+    smart_score_threshold: float,
+    gate: Optional[AlertGate] = None,
+    dispatcher: Optional[AlertDispatcher] = None,
+    report_windows: Sequence[int] = (),
+    persist_flow: bool = False,
+    smart_wallets: Optional[WalletBitmap] = None,
+) -> int:
+    """
+    run_alert_once for all the store's markets in condition_ids, with their flows computed
+    together in one pass over the global trade index (smart_flow_universe).
+    Returns the number of alerts fired.
+    """
+    flows = smart_flow_universe(
+        store,
+        alert_windows(window_sec, report_windows),
+        smart_min_trades=smart_min_trades,
+        smart_min_volume_usd=smart_min_volume_usd,
+        smart_score_threshold=smart_score_threshold,
+        smart_wallets=smart_wallets,
+        condition_ids=condition_ids,
     )
-    return False
+    fired = 0
+    pending: List[Future] = []
+    for cid in condition_ids:
+        fired += alert_on_flow(store, flows[cid], threshold_usd, gate, dispatcher, persist_flow, pending)
+    for fut in pending:
+        fut.result()  # the pass's snapshots share one group commit; a failed one raises
+    return fired
+
+
+class WhaleWatch:
+    """
+    Alert rule: a smart wallet's trade whose notional is at or above the market's pct
+    quantile (from its ingest-time KLL sketch, so no trade history is read).
+
+    Each run walks the global trade index over the last lookback_sec and fires once per
+    trade key (keys seen are remembered until they leave the lookback), so trades that
+    arrive late, by exchange timestamp, are still caught. Markets with fewer than
+    min_trades sketched trades are skipped: their tail quantiles mean little.
+    The seen keys live in memory, so with seed (the default) the first run only records
+    the lookback's trades: a restarted watcher doesn't fire again for the last hour.
+    """
+
+    def __init__(self, pct: float = 0.99, lookback_sec: int = 3600, min_trades: int = 200, seed: bool = True) -> None:
+        self.pct = float(pct)
+        self.lookback_sec = int(lookback_sec)
+        self.min_trades = int(min_trades)
+        self._seen: Dict[bytes, int] = {}
+        self._seeding = seed
+
+    def run(
+        self,
+        store,
+        condition_ids: Sequence[str],
+        smart_min_trades: int,
+        smart_min_volume_usd: float,
+        smart_score_threshold: float,
+        dispatcher: Optional[AlertDispatcher] = None,
+        smart_wallets: Optional[WalletBitmap] = None,
+        now: Optional[int] = None,
+    ) -> int:
+        """
+        Fire for new qualifying trades of condition_ids. Returns the number of alerts.
+        """
+        seeding, self._seeding = self._seeding, False
+        now = int(time.time()) if now is None else int(now)
+        start = now - self.lookback_sec
+        wanted = set(condition_ids)
+        thresholds: Dict[str, Optional[float]] = {}
+        events: List[Dict[str, Any]] = []
+        with store.txn() as tx:
+            smart = _SmartTest(tx, smart_wallets, smart_min_trades, smart_min_volume_usd, smart_score_threshold)
+            for k, v in tx.scan("tidx:", start=f"tidx:{start:010d}"):
+                ts = int(bytes(k[5:15]))
+                if ts > now:
+                    break
+                key = bytes(k)
+                if key in self._seen:
+                    continue
+                cid = bytes(k[16:-7]).decode("utf-8")
+                if cid not in wanted:
+                    continue
+                self._seen[key] = ts
+                if seeding:
+                    continue
+                wid, signed, usd = unpack_trade_index(v)
+                if wid == NO_WID or not smart(wid):
+                    continue
+                if cid not in thresholds:
+                    sk = load_quantile_sketch(tx, cid, "usd")
+                    thresholds[cid] = sk.quantile(self.pct) if sk is not None and sk.n >= self.min_trades else None
+                limit = thresholds[cid]
+                if limit is None or usd < limit:
+                    continue
+                events.append(
+                    {
+                        "type": "whale_trade",
+                        "conditionId": cid,
+                        "ts": ts,
+                        "wallet_id": wid,
+                        "direction": "YES" if signed >= 0 else "NO",
+                        "usd": usd,
+                        "pct": self.pct,
+                        "threshold_usd": limit,
+                        "distinct_wallets_24h": distinct_wallets(tx, cid, 86400, now),
+                    }
+                )
+        for key in [key for key, ts in self._seen.items() if ts < start]:
+            del self._seen[key]
+        ids = wallet_ids(store)
+        for ev in events:
+            ev["wallet"] = ids.address(ev["wallet_id"]) or ""
+            if dispatcher is not None:
+                dispatcher.publish(ev)
+            else:
+                ConsoleSink().emit([ev])
+        return len(events)
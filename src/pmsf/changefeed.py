@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from .storage_lmdb import (
+    CLOG_PREFIX,
+    K_CLOG_SEQ,
+    OP_DEL,
+    OP_PUT,
+    ChangeOp,
+    LMDBStore,
+    Reader,
+    decode_changes,
+    k_changelog,
+)
+
+# Consumers of the change log written by LMDBStore(changelog=True).
+# A consumer keeps the sequence number it has applied and reads the records after it;
+# a replica stores that offset under repl:offset in the same txn as the changes, so a
+# crash never applies a record twice or skips one.
+K_REPL_OFFSET = "repl:offset"
+Change = Tuple[int, float, List[ChangeOp]]  # seq, committed_at, ops
+
+
+class ReplicationGap(RuntimeError):
+    """
+    The records after a consumer's offset were trimmed from the log: resync from a snapshot.
+    """
+
+
+def last_seq(store: Reader) -> int:
+    b = store.get(K_CLOG_SEQ.decode("ascii"))
+    return int.from_bytes(bytes(b), "little") if b is not None else 0
+
+
+def read_changes(store: Reader, after: int, limit: int = 1000) -> List[Change]:
+    """
+    Up to limit records with seq > after, in order. Raises ReplicationGap when the
+    record right after `after` is gone while later ones exist.
+    """
+    out: List[Change] = []
+    with store.txn() as tx:
+        for k, v in tx.scan(CLOG_PREFIX.decode("ascii"), start=k_changelog(after + 1).decode("ascii"), limit=limit):
+            if bytes(k) == K_CLOG_SEQ:
+                break
+            seq = int(bytes(k[len(CLOG_PREFIX) :]), 16)
+            if not out and seq != after + 1:
+                raise ReplicationGap(f"change log resumes at {seq}, consumer is at {after}")
+            ts, ops = decode_changes(v)
+            out.append((seq, ts, ops))
+    return out
+
+
+def tail_changes(
+    store: Reader,
+    after: int,
+    poll_sec: float = 1.0,
+    batch: int = 1000,
+    stop: Optional[threading.Event] = None,
+) -> Iterator[Change]:
+    """
+    Follow the log from offset `after`, polling every poll_sec when caught up.
+    """
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        changes = read_changes(store, after, batch)
+        for ch in changes:
+            yield ch
+            after = ch[0]
+        if len(changes) < batch:
+            stop.wait(poll_sec)
+
+
+def replica_offset(replica: LMDBStore) -> Optional[int]:
+    b = replica.get(K_REPL_OFFSET)
+    return int(b) if b is not None else None
+
+
+def bootstrap_replica(src: Reader, replica: LMDBStore, batch: int = 10_000) -> int:
+    """
+    Replace the replica's contents with a snapshot of src (every key but the change log)
+    and set its offset to the log position of that snapshot. Returns that offset.
+    """
+    with replica.write_txn() as txn:
+        txn.drop(replica.env.open_db(), delete=False)
+    with src.txn() as tx:
+        seq = last_seq(tx)
+        items: List[Tuple[bytes, bytes]] = []
+        for k, v in tx.scan(""):
+            if bytes(k[: len(CLOG_PREFIX)]) == CLOG_PREFIX:
+                continue
+            items.append((bytes(k), bytes(v)))
+            if len(items) >= batch:
+                _put_raw(replica, items)
+                items = []
+        _put_raw(replica, items)
+    replica.put(K_REPL_OFFSET, str(seq).encode("ascii"))
+    return seq
+
+
+def _put_raw(replica: LMDBStore, items: List[Tuple[bytes, bytes]]) -> None:
+    with replica.write_txn() as txn:
+        for k, v in items:
+            txn.put(k, v)
+
+
+def apply_changes(replica: LMDBStore, changes: List[Change]) -> int:
+    """
+    Apply records to the replica and advance its offset, in one txn. Returns ops applied.
+    """
+    if not changes:
+        return 0
+    n = 0
+    with replica.write_txn() as txn:
+        for _, _, ops in changes:
+            for op, k, v in ops:
+                if op == OP_PUT:
+                    txn.put(k, v)
+                elif op == OP_DEL:
+                    txn.delete(k)
+                n += 1
+        txn.put(K_REPL_OFFSET.encode("utf-8"), str(changes[-1][0]).encode("ascii"))
+    return n
+
+
+def replicate_once(src: Reader, replica: LMDBStore, batch: int = 1000) -> Tuple[int, int]:
+    """
+    Bring the replica up to date with src: a snapshot the first time, then the log
+    records after its offset. Returns (records applied, seconds behind the newest one).
+    """
+    off = replica_offset(replica)
+    if off is None:
+        bootstrap_replica(src, replica)
+        return 0, 0
+    records = 0
+    lag = 0
+    while True:
+        changes = read_changes(src, off, batch)
+        apply_changes(replica, changes)
+        records += len(changes)
+        if changes:
+            off = changes[-1][0]
+            lag = max(0, int(time.time() - changes[-1][1]))
+        if len(changes) < batch:
+            return records, lag
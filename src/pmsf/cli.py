@@ -3,118 +3,539 @@ from __future__ import annotations
 import argparse
 import time
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
-import orjson
-from rich.console import Console
+from .config import Settings, load_settings
 
-from .config import load_settings
-from .storage_lmdb import LMDBStore
-from .universe import select_universe
-from .collector import backfill_market, poll_live_once
-from .pricer import price_tick
-from .scorer import score_market
-from .alerts import run_alert_once
+if TYPE_CHECKING:
+    from .polymarket_client import PolymarketClient
+    from .storage_lmdb import LMDBStore
 
-console = Console()
+# Subcommands import what they use inside their cmd_* function: `pmsf score` from cron
+# shouldn't pay for httpx, websockets or the alert pipeline. scripts/bench_startup.py
+# checks the per-subcommand startup budget.
+
+
+class _LazyConsole:
+    """
+    rich Console created on first print (rich is slow to import, --help never needs it).
+    """
+
+    _console: Any = None
+
+    def __getattr__(self, name: str) -> Any:
+        if self._console is None:
+            from rich.console import Console
+
+            self._console = Console()
+        return getattr(self._console, name)
+
+
+console = _LazyConsole()
 
 
 def _load_universe(path: Path) -> List[Dict[str, Any]]:
+    import orjson
+
     obj = orjson.loads(path.read_bytes())
     return obj["markets"]
 
 
+def _writer_store(s: Settings, path: Path) -> LMDBStore:
+    from .storage_lmdb import LMDBStore
+    from .tradecache import attach_trade_cache
+
+    # long-running writers (ingest / price / score / alerts) honour the durability profile
+    store = LMDBStore(
+        path,
+        durability=s.durability,
+        sync_interval_sec=s.sync_interval_sec,
+        group_commit_sec=s.group_commit_ms / 1000.0,
+        changelog=s.changelog,
+        changelog_keep=s.changelog_keep,
+    )
+    if s.trade_cache_mb > 0:
+        # decoded recent trades per market, in memory (written through by ingest)
+        attach_trade_cache(store, int(s.trade_cache_mb * (1 << 20)), s.trade_cache_tail_sec)
+    return store
+
+
+def _client(s: Settings, args: argparse.Namespace) -> PolymarketClient:
+    from .polymarket_client import CACHE_MODES, PolymarketClient, ResponseCache
+
+    # PMSF_HTTP_CACHE=on: serve fresh recorded responses; replay: offline, recorded only
+    mode = "replay" if getattr(args, "replay", False) else s.http_cache
+    if mode not in CACHE_MODES:
+        raise SystemExit(f"PMSF_HTTP_CACHE must be one of {', '.join(CACHE_MODES)}")
+    if mode == "off":
+        return PolymarketClient()
+    return PolymarketClient(cache=ResponseCache(s.http_cache_dir, ttl_sec=s.http_cache_ttl_sec, replay=mode == "replay"))
+
+
+def _open_shard(
+    s: Settings, shard: Optional[int], uni: List[Dict[str, Any]]
+) -> Tuple[LMDBStore, List[Dict[str, Any]]]:
+    """
+    Store + markets this worker owns. Unsharded (PMSF_SHARDS=1): the whole universe.
+    """
+    from .sharding import HashRing, shard_markets, shard_path
+
+    if s.shards <= 1:
+        return _writer_store(s, s.lmdb_path), uni
+    if shard is None or not 0 <= shard < s.shards:
+        raise SystemExit(f"PMSF_SHARDS={s.shards}: pass --shard 0..{s.shards - 1}")
+    mine = shard_markets(uni, HashRing(s.shards), shard)
+    console.print(f"[dim]shard {shard}/{s.shards}[/dim] {len(mine)} of {len(uni)} markets")
+    return _writer_store(s, shard_path(s.lmdb_path, shard, s.shards)), mine
+
+
 def cmd_universe(args: argparse.Namespace) -> int:
+    from .universe import select_universe
+
     s = load_settings()
     out = Path(args.out or s.universe_out)
-    uni = select_universe(size=int(args.size or s.universe_size), out_path=out)
+    client = _client(s, args)
+    try:
+        uni = select_universe(size=int(args.size or s.universe_size), out_path=out, client=client)
+    finally:
+        client.close()
     console.print(f"[green]Universe written[/green] {out} ({len(uni)} markets)")
     return 0
 
 
 def cmd_collect(args: argparse.Namespace) -> int:
+    from .collector import backfill_market
+    from .maturity import set_maturity_horizons
+    from .sources import RestPollSource, WebSocketTradeSource
+
     s = load_settings()
-    store = LMDBStore(s.lmdb_path)
+    store, uni = _open_shard(s, args.shard, _load_universe(Path(args.universe)))
+    client = _client(s, args)
     try:
-        uni = _load_universe(Path(args.universe))
         pages = int(args.pages or s.backfill_pages)
         limit = int(args.limit or s.trade_limit)
+        # new trades are queued for the scorer at these horizons
+        set_maturity_horizons(store, s.score_windows)
 
         if args.mode == "backfill":
             for m in uni:
                 cid = m["conditionId"]
                 console.print(f"[cyan]backfill[/cyan] {cid} {m.get('slug','')}")
-                backfill_market(store, cid, pages=pages, limit=limit)
+                backfill_market(store, cid, pages=pages, limit=limit, client=client)
             return 0
 
-        # live polling
-        interval = float(args.interval or 20.0)
-        while True:
-            for m in uni:
-                cid = m["conditionId"]
-                poll_live_once(store, cid, limit=limit)
-            time.sleep(interval)
+        cids = [m["conditionId"] for m in uni]
+        if args.mode == "stream":
+            url = args.feed_url or s.feed_url
+            console.print(f"[cyan]stream[/cyan] {url} ({len(cids)} markets)")
+            source = WebSocketTradeSource(
+                store,
+                cids,
+                url=url,
+                limit=limit,
+                flush_sec=float(args.flush or s.stream_flush_sec),
+                gap_fill=not args.no_gap_fill,
+                max_pages=s.poll_max_pages,
+                client=client,
+            )
+        else:
+            # live polling, adaptive per-market schedule unless --fixed
+            source = RestPollSource(
+                store,
+                cids,
+                limit=limit,
+                interval_sec=float(args.interval or 20.0),
+                adaptive=not args.fixed,
+                min_interval_sec=s.poll_min_interval_sec,
+                max_interval_sec=s.poll_max_interval_sec,
+                max_pages=s.poll_max_pages,
+                client=client,
+            )
+        source.run()
+        return 0
     finally:
+        client.close()
         store.close()
 
 
 def cmd_price(args: argparse.Namespace) -> int:
+    from .dirty import DirtyTracker
+    from .pricer import price_tick
+    from .tradecache import trade_cache
+
     s = load_settings()
-    store = LMDBStore(s.lmdb_path)
+    store, uni = _open_shard(s, args.shard, _load_universe(Path(args.universe)))
     try:
-        uni = _load_universe(Path(args.universe))
         interval = int(args.interval or s.price_interval_sec)
+        # snapshot markets with new trades, and keep snapshotting them until their
+        # trades' scoring horizons have a price after them
+        tracker = DirtyTracker(store, "price", linger_sec=max(s.score_windows, default=0))
+        cids = [m["conditionId"] for m in uni]
 
         while True:
-            for m in uni:
-                cid = m["conditionId"]
-                p = price_tick(store, cid)
+            due = tracker.due(cids)
+            writes: List[Any] = []
+            for cid in due:
+                p = price_tick(store, cid, writes)
                 if p is not None:
                     console.print(f"[dim]price[/dim] {cid} yes_price~{p:.4f}")
+            for w in writes:
+                w.result()  # a failed snapshot commit raises before the tracker moves past it
+            tracker.save()
+            cache = trade_cache(store)
+            if cache is not None and due:
+                st = cache.stats()
+                console.print(
+                    f"[dim]trade cache[/dim] hits={st['hits']} misses={st['misses']} "
+                    f"markets={st['markets']} mb={st['bytes'] / (1 << 20):.1f}"
+                )
             time.sleep(interval)
     finally:
         store.close()
 
 
 def cmd_score(args: argparse.Namespace) -> int:
+    from .maturity import drain_due, pending_count, set_maturity_horizons
+    from .scorer import migrate_legacy_wallet_stats, score_market
+
     s = load_settings()
-    store = LMDBStore(s.lmdb_path)
+    store, uni = _open_shard(s, args.shard, _load_universe(Path(args.universe)))
     try:
-        uni = _load_universe(Path(args.universe))
         windows = [int(x) for x in (args.windows.split(",") if args.windows else s.score_windows)]
+        migrated = migrate_legacy_wallet_stats(store, windows, s.score_weights, s.score_ewm_alpha > 0.0)
+        if migrated:
+            console.print(f"[dim]migrated {migrated} address-keyed wallet stats to wallet ids[/dim]")
+
+        price_mode = args.price_mode or s.score_price_mode
+        set_maturity_horizons(store, windows)
+        if args.all:
+            # full rescan: counts every stored trade again (trades ingested before the queue)
+            for m in uni:
+                cid = m["conditionId"]
+                seen, edges = score_market(
+                    store,
+                    cid,
+                    windows=windows,
+                    weights=s.score_weights,
+                    ewm_alpha=s.score_ewm_alpha,
+                    price_mode=price_mode,
+                    vwap_window_sec=s.score_vwap_window_sec,
+                )
+                console.print(f"[magenta]score[/magenta] {cid} trades_seen={seen} edges={edges}")
+            return 0
 
+        # only the queued (trade, horizon) items that came due since the last run
+        res = drain_due(
+            store,
+            windows,
+            weights=s.score_weights,
+            ewm_alpha=s.score_ewm_alpha,
+            price_mode=price_mode,
+            vwap_window_sec=s.score_vwap_window_sec,
+            max_wait_sec=s.score_max_wait_sec,
+        )
+        console.print(
+            f"[magenta]score[/magenta] trades={res['trades']} edges={res['edges']} "
+            f"expired={res['expired']} waiting={res['waiting']} queued={pending_count(store)}"
+        )
+        return 0
+    finally:
+        store.close()
+
+
+def cmd_reindex(args: argparse.Namespace) -> int:
+    from .cum_index import rebuild_cum_index
+    from .flow import rebuild_flow_buckets, rebuild_trade_index
+    from .positions import rebuild_positions
+    from .sketches import rebuild_sketches
+
+    s = load_settings()
+    store, uni = _open_shard(s, args.shard, _load_universe(Path(args.universe)))
+    try:
         for m in uni:
             cid = m["conditionId"]
-            seen, edges = score_market(store, cid, windows=windows)
-            console.print(f"[magenta]score[/magenta] {cid} trades_seen={seen} edges={edges}")
+            n = rebuild_cum_index(store, cid)
+            rebuild_flow_buckets(store, cid)
+            rebuild_trade_index(store, cid)
+            rebuild_positions(store, cid)
+            rebuild_sketches(store, cid)
+            console.print(
+                f"[cyan]reindex[/cyan] {cid} cum_index+flow_buckets+trade_index+positions+sketches trades={n}"
+            )
         return 0
     finally:
         store.close()
 
 
 def cmd_alerts(args: argparse.Namespace) -> int:
+    from .alerts import (
+        AlertDispatcher,
+        AlertGate,
+        ConsoleSink,
+        JsonlSink,
+        WebhookSink,
+        WhaleWatch,
+        alert_windows,
+        run_alert_universe,
+    )
+    from .dirty import DirtyTracker
+    from .sharding import ShardedReader
+
     s = load_settings()
-    store = LMDBStore(s.lmdb_path)
+    reader = ShardedReader.open(
+        s.lmdb_path,
+        s.shards,
+        s.score_windows,
+        s.score_weights,
+        use_ewm=s.score_ewm_alpha > 0.0,
+        # --store-flows writes flow snapshots: open the shards as their writers do (change log included)
+        opener=(lambda p: _writer_store(s, p)) if args.store_flows else None,
+    )
+    dispatcher = None
     try:
         uni = _load_universe(Path(args.universe))
         window_sec = int(args.window or s.alert_window_sec)
         threshold = float(args.threshold or s.alert_threshold_usd)
+        interval = float(args.interval or 60.0)
+        report_windows = [int(x) for x in args.windows.split(",")] if args.windows else s.alert_report_windows
+
+        gate = AlertGate(
+            threshold,
+            cooldown_sec=float(args.cooldown if args.cooldown is not None else s.alert_cooldown_sec),
+            rearm_ratio=s.alert_rearm_ratio,
+        )
+        sinks = [] if args.no_console else [ConsoleSink(console)]
+        jsonl = args.jsonl or s.alert_jsonl_path
+        if jsonl:
+            sinks.append(JsonlSink(Path(jsonl)))
+        webhook = args.webhook or s.alert_webhook_url
+        if webhook:
+            sinks.append(WebhookSink(webhook))
+        dispatcher = AlertDispatcher(sinks)
+        by_shard: List[List[str]] = [[] for _ in reader.stores]
+        for m in uni:
+            by_shard[reader.shard_index(m["conditionId"])].append(m["conditionId"])
+        # per shard: markets with new trades, or with trades still inside a flow window
+        # (they must be re-evaluated as those trades age out, to re-arm the gate)
+        trackers = [
+            DirtyTracker(store, "alerts", linger_sec=max(alert_windows(window_sec, report_windows)), persist=False)
+            for store in reader.stores
+        ]
+        # smart-wallet trades above the market's notional quantile (0 disables)
+        whale_pct = float(args.whale_pct if args.whale_pct is not None else s.alert_whale_pct)
+        whales = [
+            WhaleWatch(whale_pct, lookback_sec=window_sec, min_trades=s.alert_whale_min_trades) for _ in reader.stores
+        ]
 
         while True:
-            for m in uni:
-                cid = m["conditionId"]
-                run_alert_once(
+            t0 = time.monotonic()
+            fired = 0
+            # sharded: wallet stats are partial per shard, so merge the smart set once per tick
+            smart = (
+                reader.smart_bitmaps(s.smart_min_trades, s.smart_min_volume_usd, s.smart_score_threshold)
+                if s.shards > 1
+                else None
+            )
+            # one pass over each shard's recent trade index covers all of its markets
+            evaluated = 0
+            for i, store in enumerate(reader.stores):
+                due = trackers[i].due(by_shard[i])
+                if not due:
+                    continue
+                evaluated += len(due)
+                fired += run_alert_universe(
                     store,
-                    condition_id=cid,
+                    due,
                     window_sec=window_sec,
                     threshold_usd=threshold,
                     smart_min_trades=s.smart_min_trades,
                     smart_min_volume_usd=s.smart_min_volume_usd,
                     smart_score_threshold=s.smart_score_threshold,
+                    gate=gate,
+                    dispatcher=dispatcher,
+                    report_windows=report_windows,
+                    persist_flow=args.store_flows,
+                    smart_wallets=smart[i] if smart is not None else None,
                 )
-            time.sleep(float(args.interval or 60.0))
+                if whale_pct > 0:
+                    fired += whales[i].run(
+                        store,
+                        due,
+                        smart_min_trades=s.smart_min_trades,
+                        smart_min_volume_usd=s.smart_min_volume_usd,
+                        smart_score_threshold=s.smart_score_threshold,
+                        dispatcher=dispatcher,
+                        smart_wallets=smart[i] if smart is not None else None,
+                    )
+            elapsed = time.monotonic() - t0
+            if not args.no_console:
+                console.print(
+                    f"[dim]tick[/dim] markets={evaluated}/{len(uni)} alerts={fired} took={elapsed * 1000:.0f}ms"
+                )
+            time.sleep(max(0.0, interval - elapsed))
     finally:
-        store.close()
+        if dispatcher is not None:
+            dispatcher.close()
+        reader.close()
+
+
+def cmd_serve(args: argparse.Namespace) -> int:
+    import threading
+
+    from .server import WarmCache, make_server
+    from .sharding import ShardedReader
+
+    s = load_settings()
+    reader = ShardedReader.open(s.lmdb_path, s.shards, s.score_windows, s.score_weights, s.score_ewm_alpha > 0.0)
+    stop = threading.Event()
+    try:
+        uni = _load_universe(Path(args.universe))
+        windows = [int(x) for x in args.windows.split(",")] if args.windows else [s.alert_window_sec]
+        cache = WarmCache(
+            reader,
+            [m["conditionId"] for m in uni],
+            windows,
+            smart_min_trades=s.smart_min_trades,
+            smart_min_volume_usd=s.smart_min_volume_usd,
+            smart_score_threshold=s.smart_score_threshold,
+        )
+        cache.refresh()
+        threading.Thread(target=cache.run_refresher, args=(float(args.refresh), stop), daemon=True).start()
+
+        server = make_server(cache, host=args.host, port=int(args.port), unix_socket=args.unix_socket)
+        where = args.unix_socket or f"http://{args.host}:{args.port}"
+        console.print(
+            f"[green]serving[/green] {where} markets={len(uni)} smart_wallets={len(cache.smart)} "
+            f"warmup={cache.refresh_ms:.0f}ms"
+        )
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        return 0
+    finally:
+        stop.set()
+        reader.close()
+
+
+def cmd_export(args: argparse.Namespace) -> int:
+    from .export import export_store
+    from .sharding import ShardedReader
+
+    s = load_settings()
+    reader = ShardedReader.open(s.lmdb_path, s.shards, s.score_windows, s.score_weights, s.score_ewm_alpha > 0.0)
+    try:
+        counts = export_store(
+            reader,
+            Path(args.out),
+            datasets=[d.strip() for d in args.datasets.split(",") if d.strip()],
+            fmt=args.format,
+            batch_rows=int(args.batch_rows),
+            incremental=not args.full,
+        )
+        for name, n in counts.items():
+            console.print(f"[green]export[/green] {name} rows={n} -> {Path(args.out) / name}")
+        return 0
+    finally:
+        reader.close()
+
+
+def cmd_rank(args: argparse.Namespace) -> int:
+    from .sharding import ShardedReader
+
+    s = load_settings()
+    reader = ShardedReader.open(s.lmdb_path, s.shards, s.score_windows, s.score_weights, s.score_ewm_alpha > 0.0)
+    try:
+        min_trades = s.smart_min_trades if args.smart_only else 0
+        min_vol = s.smart_min_volume_usd if args.smart_only else 0.0
+        thr = s.smart_score_threshold if args.smart_only else float("-inf")
+        for i, ws in enumerate(reader.top_wallets(int(args.top), min_trades, min_vol, thr), 1):
+            console.print(
+                f"{i:4d} {ws.wallet} score={ws.score:.5f} trades={ws.n_trades} vol_usd={ws.volume_usd:.2f}"
+            )
+        return 0
+    finally:
+        reader.close()
+
+
+def cmd_positions(args: argparse.Namespace) -> int:
+    from .positions import RANKINGS, top_holders, wallet_positions
+    from .sharding import ShardedReader
+
+    s = load_settings()
+    reader = ShardedReader.open(s.lmdb_path, s.shards, s.score_windows, s.score_weights, s.score_ewm_alpha > 0.0)
+    try:
+        if args.market:
+            rows = top_holders(reader.store_for(args.market), args.market, int(args.top), by=args.by)
+        else:
+            # a wallet's markets are spread over shards; each shard holds its own markets' rows
+            wallet = args.wallet.lower()
+            rows = [p for st in reader.stores for p in wallet_positions(st, wallet)]
+            rows = sorted(rows, key=RANKINGS[args.by], reverse=True)[: int(args.top)]
+        for i, p in enumerate(rows, 1):
+            who = p.condition_id if args.wallet else p.wallet
+            console.print(
+                f"{i:4d} {who} net_yes={p.net_yes:.2f} net_no={p.net_no:.2f} "
+                f"cost_usd={p.cost_usd:.2f} vol_usd={p.volume_usd:.2f} n={p.n_trades}"
+            )
+        return 0
+    finally:
+        reader.close()
+
+
+def cmd_rebalance(args: argparse.Namespace) -> int:
+    from .sharding import rebalance
+
+    s = load_settings()
+    res = rebalance(
+        s.lmdb_path,
+        old_shards=int(args.from_shards),
+        new_shards=int(args.to_shards),
+        windows=s.score_windows,
+        weights=s.score_weights,
+        use_ewm=s.score_ewm_alpha > 0.0,
+        changelog=s.changelog,
+        changelog_keep=s.changelog_keep,
+    )
+    console.print(
+        f"[green]rebalanced[/green] {args.from_shards} -> {args.to_shards} shards: "
+        f"markets_moved={res['markets_moved']} keys_moved={res['keys_moved']} wallets_merged={res['wallets_merged']}"
+    )
+    console.print(f"[dim]set PMSF_SHARDS={args.to_shards}[/dim]")
+    return 0
+
+
+def cmd_replicate(args: argparse.Namespace) -> int:
+    from .changefeed import ReplicationGap, bootstrap_replica, replica_offset, replicate_once
+    from .sharding import shard_path
+    from .storage_lmdb import LMDBStore
+
+    s = load_settings()
+    if s.shards > 1 and (args.shard is None or not 0 <= args.shard < s.shards):
+        raise SystemExit(f"PMSF_SHARDS={s.shards}: pass --shard 0..{s.shards - 1}")
+    shard = args.shard if s.shards > 1 else 0
+    src_path = shard_path(s.lmdb_path, shard, s.shards)
+    dst_path = shard_path(Path(args.to), shard, s.shards)
+    dst_path.parent.mkdir(parents=True, exist_ok=True)
+    src = LMDBStore(src_path, readonly=True)
+    replica = LMDBStore(dst_path)
+    try:
+        if args.resync or replica_offset(replica) is None:
+            seq = bootstrap_replica(src, replica)
+            console.print(f"[green]replica snapshot[/green] {src_path} -> {dst_path} at seq={seq}")
+        while True:
+            try:
+                records, lag = replicate_once(src, replica)
+            except ReplicationGap as e:
+                raise SystemExit(f"{e}; rerun with --resync (or raise PMSF_CHANGELOG_KEEP)")
+            if records and not args.quiet:
+                console.print(f"[dim]replicate[/dim] records={records} seq={replica_offset(replica)} lag={lag}s")
+            if args.once:
+                return 0
+            time.sleep(float(args.interval))
+    finally:
+        replica.close()
+        src.close()
 
 
 def build_parser() -> argparse.ArgumentParser:
@@ -124,33 +545,109 @@ def build_parser() -> argparse.ArgumentParser:
     p_u = sub.add_parser("universe", help="Build a universe (top N markets) and write data/universe.json")
     p_u.add_argument("--size", type=int, default=None)
     p_u.add_argument("--out", type=str, default=None)
+    p_u.add_argument("--replay", action="store_true", help="offline: serve only recorded responses (PMSF_HTTP_CACHE_DIR)")
     p_u.set_defaults(fn=cmd_universe)
 
     p_c = sub.add_parser("collect", help="Collect trades into LMDB (backfill or live polling)")
     p_c.add_argument("--universe", type=str, required=True)
-    p_c.add_argument("--mode", choices=["backfill", "live"], default="backfill")
+    p_c.add_argument("--shard", type=int, default=None, help="shard index when PMSF_SHARDS > 1")
+    p_c.add_argument("--mode", choices=["backfill", "live", "stream"], default="backfill")
     p_c.add_argument("--pages", type=int, default=None)
     p_c.add_argument("--limit", type=int, default=None)
-    p_c.add_argument("--interval", type=float, default=20.0, help="live polling interval seconds")
+    p_c.add_argument(
+        "--interval", type=float, default=20.0, help="live polling interval seconds (initial interval when adaptive)"
+    )
+    p_c.add_argument("--fixed", action="store_true", help="live mode: poll every market every --interval")
+    p_c.add_argument("--feed-url", type=str, default=None, help="stream mode WebSocket url")
+    p_c.add_argument("--flush", type=float, default=None, help="stream mode micro-batch flush seconds")
+    p_c.add_argument("--no-gap-fill", action="store_true", help="stream mode: skip REST catch-up on (re)connect")
+    p_c.add_argument("--replay", action="store_true", help="offline: serve only recorded responses (PMSF_HTTP_CACHE_DIR)")
     p_c.set_defaults(fn=cmd_collect)
 
     p_p = sub.add_parser("price", help="Write proxy yes-price snapshots into LMDB")
     p_p.add_argument("--universe", type=str, required=True)
+    p_p.add_argument("--shard", type=int, default=None, help="shard index when PMSF_SHARDS > 1")
     p_p.add_argument("--interval", type=int, default=None)
     p_p.set_defaults(fn=cmd_price)
 
     p_s = sub.add_parser("score", help="Compute wallet scores from stored trades + price snaps")
     p_s.add_argument("--universe", type=str, required=True)
+    p_s.add_argument("--shard", type=int, default=None, help="shard index when PMSF_SHARDS > 1")
     p_s.add_argument("--windows", type=str, default=None, help="comma list seconds e.g. 3600,14400")
+    p_s.add_argument(
+        "--price-mode", choices=["snap", "vwap"], default=None, help="horizon price: snapshot or VWAP window"
+    )
+    p_s.add_argument("--all", action="store_true", help="rescan every stored trade instead of draining the maturity queue (counts trades again)")
     p_s.set_defaults(fn=cmd_score)
 
+    p_i = sub.add_parser("reindex", help="Rebuild derived per-market indexes from stored trades")
+    p_i.add_argument("--universe", type=str, required=True)
+    p_i.add_argument("--shard", type=int, default=None, help="shard index when PMSF_SHARDS > 1")
+    p_i.set_defaults(fn=cmd_reindex)
+
     p_a = sub.add_parser("alerts", help="Compute smart flow and alert on threshold")
     p_a.add_argument("--universe", type=str, required=True)
     p_a.add_argument("--window", type=int, default=None)
     p_a.add_argument("--threshold", type=float, default=None)
+    p_a.add_argument(
+        "--windows", type=str, default=None, help="extra horizons computed in the same scan, e.g. 900,14400,86400"
+    )
+    p_a.add_argument("--store-flows", action="store_true", help="persist each market's latest multi-window flow")
     p_a.add_argument("--interval", type=float, default=60.0)
+    p_a.add_argument("--cooldown", type=float, default=None, help="per-market re-alert cooldown seconds")
+    p_a.add_argument(
+        "--whale-pct", type=float, default=None, help="alert on smart trades above this notional quantile (0 = off)"
+    )
+    p_a.add_argument("--jsonl", type=str, default=None, help="append alerts to this JSONL file")
+    p_a.add_argument("--webhook", type=str, default=None, help="POST alert batches to this url")
+    p_a.add_argument("--no-console", action="store_true", help="don't print alerts or tick summaries")
     p_a.set_defaults(fn=cmd_alerts)
 
+    p_v = sub.add_parser("serve", help="Serve flows, wallets and prices from a warm in-memory cache")
+    p_v.add_argument("--universe", type=str, required=True)
+    p_v.add_argument("--host", type=str, default="127.0.0.1")
+    p_v.add_argument("--port", type=int, default=8787)
+    p_v.add_argument("--unix-socket", type=str, default=None, help="listen on a Unix socket instead of TCP")
+    p_v.add_argument("--windows", type=str, default=None, help="flow windows, comma list seconds")
+    p_v.add_argument("--refresh", type=float, default=10.0, help="cache refresh interval seconds")
+    p_v.set_defaults(fn=cmd_serve)
+
+    p_x = sub.add_parser("export", help="Export trades, prices and wallet stats to Parquet / Arrow IPC")
+    p_x.add_argument("--out", type=str, default="./data/export")
+    p_x.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    p_x.add_argument("--datasets", type=str, default="trades,prices,wallets")
+    p_x.add_argument("--batch-rows", type=int, default=50_000, help="rows per record batch (bounds memory)")
+    p_x.add_argument("--full", action="store_true", help="ignore the previous export watermark")
+    p_x.set_defaults(fn=cmd_export)
+
+    p_p = sub.add_parser("positions", help="Top holders of a market, or a wallet's positions, from the ledger")
+    g = p_p.add_mutually_exclusive_group(required=True)
+    g.add_argument("--market", type=str, default=None, help="conditionId")
+    g.add_argument("--wallet", type=str, default=None, help="wallet address")
+    p_p.add_argument("--top", type=int, default=20)
+    # positions.RANKINGS, spelled out so building the parser imports nothing
+    p_p.add_argument("--by", choices=["cost", "net", "no", "volume", "yes"], default="net")
+    p_p.set_defaults(fn=cmd_positions)
+
+    p_r = sub.add_parser("rank", help="Global wallet ranking by score (merged across shards)")
+    p_r.add_argument("--top", type=int, default=25)
+    p_r.add_argument("--smart-only", action="store_true", help="only wallets passing the smart filters")
+    p_r.set_defaults(fn=cmd_rank)
+
+    p_b = sub.add_parser("rebalance", help="Move markets between shards after changing the shard count")
+    p_b.add_argument("--from", dest="from_shards", type=int, required=True)
+    p_b.add_argument("--to", dest="to_shards", type=int, required=True)
+    p_b.set_defaults(fn=cmd_rebalance)
+
+    p_r = sub.add_parser("replicate", help="Keep a read-only replica LMDB in sync from the change log")
+    p_r.add_argument("--to", type=str, required=True, help="replica path (same layout as PMSF_LMDB_PATH)")
+    p_r.add_argument("--shard", type=int, default=None, help="shard index when PMSF_SHARDS > 1")
+    p_r.add_argument("--interval", type=float, default=1.0, help="poll interval seconds when caught up")
+    p_r.add_argument("--once", action="store_true", help="catch up once and exit")
+    p_r.add_argument("--resync", action="store_true", help="start over from a snapshot of the source")
+    p_r.add_argument("--quiet", action="store_true", help="don't print progress")
+    p_r.set_defaults(fn=cmd_replicate)
+
     return p
 
 
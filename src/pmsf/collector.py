@@ -1,12 +1,23 @@
 from __future__ import annotations
 
 import time
-from typing import Any, Dict, Iterable, List, Tuple
+from concurrent.futures import Future
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
+import lmdb
 import orjson
 
+from .cum_index import CumDelta
+from .dirty import mark_dirty, market_gen_in_txn
+from .maturity import enqueue_trade, maturity_horizons
+from .features import trade_wallet
+from .flow import FlowDelta, k_trade_index, trade_index_value
 from .storage_lmdb import LMDBStore
-from .polymarket_client import PolymarketClient
+from .polymarket_client import PolymarketClient, ReplayMiss
+from .positions import PositionDelta
+from .sketches import SketchDelta
+from .tradecache import TailRow, last_trade_key, mark_tail_reset, tail_row, trade_cache
+from .wallet_ids import wallet_ids
 
 
 def _to_int_ts(ts: Any) -> int:
@@ -23,23 +34,166 @@ def _trade_key(condition_id: str, ts: int, seq: int) -> str:
     return f"trade:{condition_id}:{ts:010d}:{seq:06d}"
 
 
-def ingest_trades(store: LMDBStore, condition_id: str, trades: List[Dict[str, Any]]) -> int:
+def ingest_trades(
+    store: LMDBStore,
+    condition_id: str,
+    trades: List[Dict[str, Any]],
+    seq_start: int = 0,
+    dedupe: bool = False,
+) -> "Future[int]":
     """
-    Append trades to LMDB. Returns max timestamp ingested.
+    Append trades to LMDB. Returns the write's Future: its result is the max timestamp
+    ingested, and it raises the commit's error if the write failed.
+    seq_start offsets the per-batch sequence used in trade keys, so callers that
+    ingest many small batches (streaming) don't overwrite each other's keys.
+    With dedupe, trades already stored in their second (same _trade_identity, whichever
+    source wrote them) are dropped, and the rest are keyed after the second's highest
+    stored seq at or above seq_start, decided in the write txn: keys then never collide
+    with stored trades, across batches, sources or process restarts.
+    Wallet addresses are interned and each record carries its wallet id ("wid").
+    Trades, their global time-ordered index entries, the market's cumulative-notional
+    index, its per-minute flow buckets, the wallets' position ledger and the market's
+    sketches are written in one txn; a re-ingested key swaps its old contribution for
+    the new one (sketches are insert-only: it is not counted again). The market is
+    marked changed (dirty.mark_dirty) and new trades are queued for scoring
+    (maturity.enqueue_trade) in the same txn. After the commit, the batch is written
+    through to the store's trade tail cache, if one is attached.
+    The write is submitted to the store: with group commit enabled it lands in the next
+    group's commit (visible to readers within the group interval) and this returns early:
+    callers that read what they wrote, or must not lose a failure, wait on the Future.
     """
-    items: List[Tuple[str, bytes]] = []
+    rows: List[Tuple[bytes, bytes, int, int, Dict[str, Any]]] = []
     max_ts = 0
     for i, t in enumerate(trades):
         ts = _to_int_ts(t.get("timestamp"))
         if ts <= 0:
             continue
         max_ts = max(max_ts, ts)
-        key = _trade_key(condition_id, ts, i)
-        items.append((key, orjson.dumps(t)))
-    if items:
-        store.write_batch(items)
-        store.put_json(LMDBStore.k_last_trade_ts(condition_id), max_ts)
-    return max_ts
+        key = _trade_key(condition_id, ts, seq_start + i)
+        ikey = k_trade_index(ts, condition_id, seq_start + i)
+        rows.append((key.encode("utf-8"), ikey.encode("utf-8"), ts, seq_start + i, t))
+    done: "Future[int]" = Future()
+    if not rows:
+        done.set_result(max_ts)
+        return done
+    ids = wallet_ids(store)
+    cache = trade_cache(store)
+
+    def job(txn: lmdb.Transaction) -> Tuple[Dict[str, int], Any]:
+        wids = ids.intern_in_txn(txn, (w for w in (trade_wallet(t) for *_, t in rows) if w))
+        todo = _unstored_rows(txn, condition_id, rows, seq_start) if dedupe else rows
+        if not todo:
+            prev = market_gen_in_txn(txn, condition_id)
+            gen = prev[0] if prev is not None else 0
+            return wids, ([], gen, gen)
+        horizons = maturity_horizons(txn)
+        cum = CumDelta()
+        flow = FlowDelta()
+        pos = PositionDelta()
+        sketch = SketchDelta()
+        tail: List[TailRow] = []
+        # a trade added or rewritten at or before the newest key invalidates cached tails
+        newest = last_trade_key(txn, condition_id)
+        reset = False
+        for key, ikey, ts, seq, t in todo:
+            wid = wids.get(trade_wallet(t))
+            if wid is not None:
+                t = {**t, "wid": wid}
+            old = txn.get(key)
+            if old is not None:
+                prev = orjson.loads(old)
+                cum.add(prev, ts, -1.0)
+                flow.add(prev, ts, -1.0)
+                pos.add(prev, -1.0)
+            else:
+                sketch.add(t, ts)
+                if horizons is not None:
+                    enqueue_trade(txn, horizons, condition_id, ts, seq)
+            v = orjson.dumps(t)
+            if newest is not None and key <= newest and (old is None or bytes(old) != v):
+                reset = True
+            txn.put(key, v)
+            txn.put(ikey, trade_index_value(t))
+            cum.add(t, ts)
+            flow.add(t, ts)
+            pos.add(t)
+            tail.append(tail_row(t, ts, seq))
+        cum.apply(txn, condition_id)
+        flow.apply(txn, condition_id)
+        pos.apply(txn, condition_id)
+        sketch.apply(txn, condition_id)
+        # an older page (backfill) must not move the market's newest trade ts backwards
+        klast = LMDBStore.k_last_trade_ts(condition_id).encode("utf-8")
+        stored = txn.get(klast)
+        txn.put(klast, orjson.dumps(max(max_ts, int(orjson.loads(stored)) if stored is not None else 0)))
+        prev = market_gen_in_txn(txn, condition_id)
+        gen = mark_dirty(txn, condition_id, max_ts)
+        if reset:
+            mark_tail_reset(txn, condition_id, gen)
+        return wids, (tail, prev[0] if prev is not None else 0, gen)
+
+    def committed(fut: Future) -> None:
+        # a failed job is rolled back alone; its error goes to the caller's Future
+        exc = fut.exception()
+        if exc is not None:
+            done.set_exception(exc)
+            return
+        wids, through = fut.result()
+        ids.remember(wids)
+        if cache is not None:
+            cache.ingest(condition_id, *through)
+        done.set_result(max_ts)
+
+    store.submit(job).add_done_callback(committed)
+    return done
+
+
+def _unstored_rows(
+    txn: lmdb.Transaction,
+    condition_id: str,
+    rows: List[Tuple[bytes, bytes, int, int, Dict[str, Any]]],
+    seq_start: int,
+) -> List[Tuple[bytes, bytes, int, int, Dict[str, Any]]]:
+    # rows minus trades stored (or earlier in the batch) in the same second, rekeyed
+    # after that second's highest seq >= seq_start
+    seconds: Dict[int, Tuple[set, List[int]]] = {}
+    out = []
+    for _, _, ts, _, t in rows:
+        known = seconds.get(ts)
+        if known is None:
+            known = seconds[ts] = _stored_second(txn, condition_id, ts, seq_start)
+        idents, nxt = known
+        ident = _trade_identity(t)
+        if ident in idents:
+            continue
+        idents.add(ident)
+        seq = nxt[0]
+        nxt[0] += 1
+        out.append(
+            (
+                _trade_key(condition_id, ts, seq).encode("utf-8"),
+                k_trade_index(ts, condition_id, seq).encode("utf-8"),
+                ts,
+                seq,
+                t,
+            )
+        )
+    return out
+
+
+def _stored_second(txn: lmdb.Transaction, condition_id: str, ts: int, seq_start: int) -> Tuple[set, List[int]]:
+    # identities of the market's trades stored at ts, and the next free seq >= seq_start
+    prefix = f"trade:{condition_id}:{ts:010d}:".encode("utf-8")
+    idents = set()
+    nxt = seq_start
+    cur = txn.cursor()
+    if cur.set_range(prefix):
+        for k, v in cur:
+            if not k.startswith(prefix):
+                break
+            idents.add(_trade_identity(orjson.loads(v)))
+            nxt = max(nxt, int(k[len(prefix) :]) + 1)
+    return idents, [nxt]
 
 
 def backfill_market(
@@ -48,37 +202,157 @@ def backfill_market(
     pages: int,
     limit: int,
     sleep_sec: float = 0.2,
+    client: Optional[PolymarketClient] = None,
 ) -> None:
-    client = PolymarketClient()
+    own_client = client is None
+    if client is None:
+        client = PolymarketClient()
+    writes: List["Future[int]"] = []
     try:
         for page in range(pages):
             offset = page * limit
-            trades = client.fetch_trades(condition_id, limit=limit, offset=offset)
+            try:
+                trades = client.fetch_trades(condition_id, limit=limit, offset=offset)
+            except ReplayMiss:
+                # replaying a backfill that was recorded with fewer pages: the recording ends here
+                break
             if not trades:
                 break
-            ingest_trades(store, condition_id, trades)
-            time.sleep(sleep_sec)
+            # pages shift as trades land and overlap what polls stored: skip known trades
+            writes.append(ingest_trades(store, condition_id, trades, dedupe=True))
+            if not client.from_cache:
+                time.sleep(sleep_sec)
+        for w in writes:
+            w.result()  # raise a failed commit
     finally:
-        client.close()
+        if own_client:
+            client.close()
+
+
+def _trade_identity(t: Dict[str, Any]) -> Tuple[Any, ...]:
+    return (
+        t.get("transactionHash"),
+        t.get("proxyWallet") or t.get("user"),
+        t.get("side"),
+        t.get("outcome"),
+        t.get("size"),
+        t.get("price"),
+        t.get("timestamp"),
+    )
+
+
+def poll_market(
+    store: LMDBStore,
+    condition_id: str,
+    limit: int,
+    client: PolymarketClient,
+    max_pages: int = 1,
+) -> Tuple[int, int]:
+    """
+    Fetch trades since the market's last stored timestamp, newest page first.
+    While a page is entirely new (and full), keep paginating until it overlaps stored
+    data, so bursts larger than one page between polls aren't lost (up to max_pages).
+    Trades of the newest stored second are fetched again and dropped by ingest's dedupe,
+    like trades repeated across pages (offsets shift as new trades land).
+    When max_pages run out inside a burst, the older end is saved as a resume cursor
+    (poll_gap): the next poll continues from that page, shifted by the trades that
+    landed since, once it has caught up with the head.
+    Returns (trades newer than the last stored timestamp, last trade ts).
+    """
+    last_ts = int(store.get_json(LMDBStore.k_last_trade_ts(condition_id)) or 0)
+    gap = poll_gap(store, condition_id)
+    budget = max(1, max_pages)
+    batch: List[Dict[str, Any]] = []
+    seen = set()
+    newer = 0
+    max_ts = last_ts
+
+    def take(trades: List[Dict[str, Any]], floor: int) -> bool:
+        # keep trades at or after floor; True once the page reaches older ones
+        nonlocal newer, max_ts
+        overlap = False
+        for t in trades:
+            ts = _to_int_ts(t.get("timestamp"))
+            if ts < floor:
+                overlap = True
+                continue
+            ident = _trade_identity(t)
+            if ident in seen:
+                continue
+            seen.add(ident)
+            batch.append(t)
+            if ts > last_ts:
+                newer += 1
+                max_ts = max(max_ts, ts)
+        return overlap or len(trades) < limit
+
+    def fetch(offset: int) -> Optional[List[Dict[str, Any]]]:
+        try:
+            return client.fetch_trades(condition_id, limit=limit, offset=offset)
+        except ReplayMiss:
+            if offset == 0:
+                raise
+            return None  # the recording ends before the overlap: replay what it holds
+
+    # head: what landed since the last poll
+    page = 0
+    done = False
+    while page < budget and not done:
+        trades = fetch(page * limit)
+        page += 1
+        done = trades is None or take(trades, last_ts)
+    resume: Optional[List[int]] = None
+    if not done:
+        # still inside the burst: resume below this page (down to the older floor, if any)
+        resume = [gap[0] if gap is not None else last_ts, page * limit]
+    elif gap is not None:
+        # an earlier poll stopped mid-burst: walk on from its page, shifted by `newer`
+        floor, offset = gap[0], gap[1] + newer
+        done = False
+        while page < budget and not done:
+            trades = fetch(offset)
+            page += 1
+            offset += limit
+            done = trades is None or take(trades, floor)
+        resume = None if done else [floor, offset]
+    if resume != gap:
+        if resume is None:
+            store.delete(LMDBStore.k_poll_gap(condition_id))
+        else:
+            store.put_json(LMDBStore.k_poll_gap(condition_id), resume)
+    if batch:
+        # wait for the commit: the next poll reads last_trade_ts back, and a failure must surface
+        ingest_trades(store, condition_id, batch, dedupe=True).result()
+    return newer, max_ts
+
+
+def poll_gap(store: LMDBStore, condition_id: str) -> Optional[List[int]]:
+    """
+    The market's resume cursor [floor ts, offset] when its last poll ran out of pages
+    inside a burst, else None.
+    """
+    gap = store.get_json(LMDBStore.k_poll_gap(condition_id))
+    return [int(gap[0]), int(gap[1])] if gap else None
 
 
 def poll_live_once(
     store: LMDBStore,
     condition_id: str,
     limit: int,
+    client: Optional[PolymarketClient] = None,
+    max_pages: int = 1,
 ) -> int:
     """
     Simple live mode (polling): fetch latest trades page and store only new ones by timestamp.
     This is not perfect but good enough to start.
+    Pass a shared client to reuse its connection pool across calls; max_pages > 1
+    paginates forward until the fetched pages overlap stored trades (see poll_market).
     """
-    last_ts = store.get_json(LMDBStore.k_last_trade_ts(condition_id)) or 0
-    client = PolymarketClient()
+    own_client = client is None
+    if client is None:
+        client = PolymarketClient()
     try:
-        trades = client.fetch_trades(condition_id, limit=limit, offset=0)
-        # Keep only trades newer than last_ts
-        new_trades = [t for t in trades if _to_int_ts(t.get("timestamp")) > int(last_ts)]
-        if new_trades:
-            return ingest_trades(store, condition_id, new_trades)
-        return int(last_ts)
+        return poll_market(store, condition_id, limit, client, max_pages=max_pages)[1]
     finally:
-        client.close()
+        if own_client:
+            client.close()
@@ -5,9 +5,17 @@ from dataclasses import dataclass
 from pathlib import Path
 from typing import List
 
-from dotenv import load_dotenv
+_dotenv_loaded = False
 
-load_dotenv()
+
+def _load_dotenv() -> None:
+    # read .env on first load_settings(), not at import (keeps `pmsf --help` and imports cheap)
+    global _dotenv_loaded
+    if not _dotenv_loaded:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        _dotenv_loaded = True
 
 
 def _get_env(name: str, default: str) -> str:
@@ -31,19 +39,49 @@ def _get_list_int(name: str, default: str) -> List[int]:
     return [int(p) for p in parts]
 
 
+def _get_list_float(name: str, default: str) -> List[float]:
+    v = _get_env(name, default)
+    parts = [p.strip() for p in v.split(",") if p.strip()]
+    return [float(p) for p in parts]
+
+
 @dataclass(frozen=True)
 class Settings:
     lmdb_path: Path
     log_dir: Path
+    shards: int
+    durability: str
+    sync_interval_sec: float
+    group_commit_ms: float
+    changelog: bool
+    changelog_keep: int
+    trade_cache_mb: float
+    trade_cache_tail_sec: int
 
     universe_size: int
     universe_out: Path
 
+    http_cache: str
+    http_cache_dir: Path
+    http_cache_ttl_sec: float
+
     trade_limit: int
     backfill_pages: int
 
+    poll_min_interval_sec: float
+    poll_max_interval_sec: float
+    poll_max_pages: int
+
+    feed_url: str
+    stream_flush_sec: float
+
     price_interval_sec: int
     score_windows: List[int]
+    score_weights: List[float]
+    score_ewm_alpha: float
+    score_price_mode: str
+    score_vwap_window_sec: int
+    score_max_wait_sec: int
 
     smart_min_trades: int
     smart_min_volume_usd: float
@@ -51,9 +89,17 @@ class Settings:
 
     alert_window_sec: int
     alert_threshold_usd: float
+    alert_report_windows: List[int]
+    alert_cooldown_sec: float
+    alert_rearm_ratio: float
+    alert_whale_pct: float
+    alert_whale_min_trades: int
+    alert_jsonl_path: str
+    alert_webhook_url: str
 
 
 def load_settings() -> Settings:
+    _load_dotenv()
     lmdb_path = Path(_get_env("PMSF_LMDB_PATH", "./data/polymarket.lmdb"))
     log_dir = Path(_get_env("PMSF_LOG_DIR", "./data/logs"))
     log_dir.mkdir(parents=True, exist_ok=True)
@@ -62,15 +108,43 @@ def load_settings() -> Settings:
     return Settings(
         lmdb_path=lmdb_path,
         log_dir=log_dir,
+        shards=_get_int("PMSF_SHARDS", 1),
+        durability=_get_env("PMSF_DURABILITY", "full"),
+        sync_interval_sec=_get_float("PMSF_SYNC_INTERVAL_SEC", 1.0),
+        group_commit_ms=_get_float("PMSF_GROUP_COMMIT_MS", 0.0),
+        changelog=_get_int("PMSF_CHANGELOG", 0) > 0,
+        changelog_keep=_get_int("PMSF_CHANGELOG_KEEP", 1_000_000),
+        trade_cache_mb=_get_float("PMSF_TRADE_CACHE_MB", 64.0),
+        trade_cache_tail_sec=_get_int("PMSF_TRADE_CACHE_TAIL_SEC", 21600),
         universe_size=_get_int("PMSF_UNIVERSE_SIZE", 100),
         universe_out=Path(_get_env("PMSF_UNIVERSE_OUT", "./data/universe.json")),
+        http_cache=_get_env("PMSF_HTTP_CACHE", "off"),
+        http_cache_dir=Path(_get_env("PMSF_HTTP_CACHE_DIR", "./data/http-cache.lmdb")),
+        http_cache_ttl_sec=_get_float("PMSF_HTTP_CACHE_TTL_SEC", 3600.0),
         trade_limit=_get_int("PMSF_TRADE_LIMIT", 200),
         backfill_pages=_get_int("PMSF_BACKFILL_PAGES", 10),
+        poll_min_interval_sec=_get_float("PMSF_POLL_MIN_INTERVAL_SEC", 5.0),
+        poll_max_interval_sec=_get_float("PMSF_POLL_MAX_INTERVAL_SEC", 600.0),
+        poll_max_pages=_get_int("PMSF_POLL_MAX_PAGES", 10),
+        feed_url=_get_env("PMSF_FEED_URL", "wss://ws-live-data.polymarket.com"),
+        stream_flush_sec=_get_float("PMSF_STREAM_FLUSH_SEC", 1.0),
         price_interval_sec=_get_int("PMSF_PRICE_INTERVAL_SEC", 60),
         score_windows=_get_list_int("PMSF_SCORE_WINDOWS", "3600,14400"),
+        score_weights=_get_list_float("PMSF_SCORE_WEIGHTS", ""),
+        score_ewm_alpha=_get_float("PMSF_SCORE_EWM_ALPHA", 0.0),
+        score_price_mode=_get_env("PMSF_SCORE_PRICE_MODE", "snap"),
+        score_vwap_window_sec=_get_int("PMSF_SCORE_VWAP_WINDOW_SEC", 600),
+        score_max_wait_sec=_get_int("PMSF_SCORE_MAX_WAIT_SEC", 21600),
         smart_min_trades=_get_int("PMSF_SMART_MIN_TRADES", 25),
         smart_min_volume_usd=_get_float("PMSF_SMART_MIN_VOLUME_USD", 2000.0),
         smart_score_threshold=_get_float("PMSF_SMART_SCORE_THRESHOLD", 0.002),
         alert_window_sec=_get_int("PMSF_ALERT_WINDOW_SEC", 3600),
         alert_threshold_usd=_get_float("PMSF_ALERT_THRESHOLD_USD", 20000.0),
+        alert_report_windows=_get_list_int("PMSF_ALERT_REPORT_WINDOWS", ""),
+        alert_cooldown_sec=_get_float("PMSF_ALERT_COOLDOWN_SEC", 900.0),
+        alert_rearm_ratio=_get_float("PMSF_ALERT_REARM_RATIO", 0.5),
+        alert_whale_pct=_get_float("PMSF_ALERT_WHALE_PCT", 0.99),
+        alert_whale_min_trades=_get_int("PMSF_ALERT_WHALE_MIN_TRADES", 200),
+        alert_jsonl_path=_get_env("PMSF_ALERT_JSONL", ""),
+        alert_webhook_url=_get_env("PMSF_ALERT_WEBHOOK_URL", ""),
     )
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+import lmdb
+import orjson
+
+from .storage_lmdb import LMDBStore, Reader, StoreTxn
+
+# Per-market cumulative yes-notional / size / trade count over time, so VWAP over any
+# interval costs two prefix queries instead of a scan of the interval's trades.
+#
+# Trades land in one-minute buckets. Buckets are the leaves of a Fenwick (binary indexed)
+# tree stored as cum:{cid}:{node:08x} -> (yes_notional f64, size f64, trades f64). A prefix
+# sum reads at most log2(CUM_SIZE) nodes, and out-of-order ingest (backfill walks
+# backwards in time) is an O(log n) update rather than a rewrite of every later prefix.
+CUM_BUCKET_SEC = 60
+CUM_BASE_TS = 1_577_836_800  # 2020-01-01 UTC
+CUM_SIZE = 1 << 24  # buckets: ~32 years of minutes
+_NODE = struct.Struct("<ddd")
+
+
+def k_cum(condition_id: str, node: int) -> str:
+    return f"cum:{condition_id}:{node:08x}"
+
+
+def cum_bucket(ts: int) -> int:
+    """
+    1-based Fenwick index of the bucket holding ts.
+    """
+    return min(CUM_SIZE, max(1, (int(ts) - CUM_BASE_TS) // CUM_BUCKET_SEC + 1))
+
+
+def trade_yes_notional(trade: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    """
+    (yes_price * size, size) of a trade, or None if it can't be priced in YES space.
+    """
+    outcome = trade.get("outcome")
+    if outcome not in ("Yes", "No"):
+        return None
+    try:
+        price = float(trade.get("price"))
+        size = abs(float(trade.get("size")))
+    except (TypeError, ValueError):
+        return None
+    yes_price = price if outcome == "Yes" else 1.0 - price
+    return yes_price * size, size
+
+
+class CumDelta:
+    """
+    Per-bucket deltas of one market, accumulated over a batch and applied in the
+    caller's write txn (so the index moves together with the trades it covers).
+    """
+
+    def __init__(self) -> None:
+        self.buckets: Dict[int, List[float]] = {}
+
+    def add(self, trade: Dict[str, Any], ts: int, sign: float = 1.0) -> None:
+        ns = trade_yes_notional(trade)
+        if ns is None or ts <= 0:
+            return
+        b = self.buckets.setdefault(cum_bucket(ts), [0.0, 0.0, 0.0])
+        b[0] += sign * ns[0]
+        b[1] += sign * ns[1]
+        b[2] += sign
+
+    def apply(self, txn: lmdb.Transaction, condition_id: str) -> int:
+        """
+        Fold the deltas into the tree. Returns the number of nodes written.
+        """
+        nodes: Dict[int, List[float]] = {}
+        for i, d in self.buckets.items():
+            while i <= CUM_SIZE:
+                n = nodes.setdefault(i, [0.0, 0.0, 0.0])
+                n[0] += d[0]
+                n[1] += d[1]
+                n[2] += d[2]
+                i += i & -i
+        for i, d in nodes.items():
+            k = k_cum(condition_id, i).encode("utf-8")
+            cur = txn.get(k)
+            a, s, c = _NODE.unpack(cur) if cur is not None else (0.0, 0.0, 0.0)
+            txn.put(k, _NODE.pack(a + d[0], s + d[1], c + d[2]))
+        self.buckets.clear()
+        return len(nodes)
+
+
+def _prefix(tx: StoreTxn, condition_id: str, i: int) -> Tuple[float, float, float]:
+    a = s = c = 0.0
+    while i > 0:
+        v = tx.get(k_cum(condition_id, i))
+        if v is not None:
+            da, ds, dc = _NODE.unpack(v)
+            a += da
+            s += ds
+            c += dc
+        i -= i & -i
+    return a, s, c
+
+
+def interval_sums(store: Reader, condition_id: str, t_from: int, t_to: int) -> Tuple[float, float, int]:
+    """
+    (yes_notional, size, trades) of the market over [t_from, t_to), at bucket resolution.
+    """
+    lo, hi = cum_bucket(t_from), cum_bucket(t_to)
+    if hi <= lo:
+        return 0.0, 0.0, 0
+    with store.txn() as tx:
+        a1, s1, c1 = _prefix(tx, condition_id, hi - 1)
+        a0, s0, c0 = _prefix(tx, condition_id, lo - 1)
+    return a1 - a0, s1 - s0, int(round(c1 - c0))
+
+
+def vwap(store: Reader, condition_id: str, t_from: int, t_to: int) -> Optional[float]:
+    """
+    Size-weighted average yes price over [t_from, t_to); None without trades.
+    """
+    notional, size, n = interval_sums(store, condition_id, t_from, t_to)
+    if n <= 0 or size <= 1e-12:
+        return None
+    return min(1.0, max(0.0, notional / size))
+
+
+def rebuild_cum_index(store: LMDBStore, condition_id: str, batch: int = 50_000) -> int:
+    """
+    Recompute a market's index from its stored trades (stores that predate it).
+    Returns the number of trades indexed.
+    """
+    store.delete_batch([k for k, _ in store.scan_prefix(f"cum:{condition_id}:")])
+    n = 0
+    delta = CumDelta()
+    for k, v in store.scan_prefix(f"trade:{condition_id}:"):
+        delta.add(orjson.loads(v), int(k.split(":")[2]))
+        n += 1
+        if n % batch == 0:
+            with store.write_txn() as txn:
+                delta.apply(txn, condition_id)
+    with store.write_txn() as txn:
+        delta.apply(txn, condition_id)
+    return n
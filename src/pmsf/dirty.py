@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import struct
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import lmdb
+import orjson
+
+from .storage_lmdb import LMDBStore, Reader
+
+# Change tracking: which markets got trades since a consumer last looked.
+#   gen:next           -> last generation handed out (u64 LE)
+#   mgen:{cid}         -> (generation of its last change u64, newest trade ts i64)
+#   gdirty:{gen:016x}  -> cid, one entry per market at its latest generation
+# Ingest bumps the generation of the market in its write txn. A consumer remembers the
+# generation it has seen and scans gdirty: from there, so a cycle over a mostly idle
+# universe reads only the markets that changed.
+_U64 = struct.Struct("<Q")
+_MGEN = struct.Struct("<Qq")
+K_GEN = "gen:next"
+
+
+def k_market_gen(condition_id: str) -> str:
+    return f"mgen:{condition_id}"
+
+
+def k_dirty(gen: int) -> str:
+    return f"gdirty:{gen:016x}"
+
+
+def k_dirty_cursor(name: str) -> str:
+    return f"dcur:{name}"
+
+
+def mark_dirty(txn: lmdb.Transaction, condition_id: str, max_ts: int) -> int:
+    """
+    Record a change of the market inside the caller's write txn. Returns its new generation.
+    """
+    kg = K_GEN.encode("utf-8")
+    b = txn.get(kg)
+    gen = (_U64.unpack(b)[0] if b is not None else 0) + 1
+    txn.put(kg, _U64.pack(gen))
+    km = k_market_gen(condition_id).encode("utf-8")
+    cur = txn.get(km)
+    if cur is not None:
+        old_gen, old_ts = _MGEN.unpack(cur)
+        txn.delete(k_dirty(old_gen).encode("utf-8"))
+        max_ts = max(max_ts, old_ts)
+    txn.put(km, _MGEN.pack(gen, max_ts))
+    txn.put(k_dirty(gen).encode("utf-8"), condition_id.encode("utf-8"))
+    return gen
+
+
+def market_gen_in_txn(txn: lmdb.Transaction, condition_id: str) -> Optional[Tuple[int, int]]:
+    """
+    market_gen inside a caller's raw write txn (before mark_dirty bumps it).
+    """
+    b = txn.get(k_market_gen(condition_id).encode("utf-8"))
+    return _MGEN.unpack(b) if b is not None else None
+
+
+def forget_market(txn: lmdb.Transaction, condition_id: str) -> Optional[int]:
+    """
+    Drop the market's change record (it moved to another store). Returns its newest trade ts.
+    """
+    km = k_market_gen(condition_id).encode("utf-8")
+    cur = txn.get(km)
+    if cur is None:
+        return None
+    gen, max_ts = _MGEN.unpack(cur)
+    txn.delete(k_dirty(gen).encode("utf-8"))
+    txn.delete(km)
+    return max_ts
+
+
+def market_gen(store: Reader, condition_id: str) -> Optional[Tuple[int, int]]:
+    """
+    (generation, newest trade ts) of the market's last change, or None if never marked.
+    """
+    b = store.get(k_market_gen(condition_id))
+    return _MGEN.unpack(b) if b is not None else None
+
+
+def changed_since(store: Reader, gen: int) -> Tuple[Dict[str, int], int]:
+    """
+    Markets changed after generation gen, as {cid: newest trade ts}, and the generation
+    to resume from.
+    """
+    out: Dict[str, int] = {}
+    top = gen
+    with store.txn() as tx:
+        for k, v in tx.scan("gdirty:", start=k_dirty(gen + 1)):
+            cid = bytes(v).decode("utf-8")
+            m = tx.get(k_market_gen(cid))
+            out[cid] = _MGEN.unpack(m)[1] if m is not None else 0
+            top = max(top, int(bytes(k)[len("gdirty:") :], 16))
+    return out, top
+
+
+class DirtyTracker:
+    """
+    One consumer's view of the change feed (scorer, pricer, alerts each keep their own).
+
+    due() returns the markets to re-evaluate: those changed since the last call, plus
+    those still lingering: a market stays due for linger_sec after its newest trade,
+    which covers what changes without new trades (horizons maturing for the scorer,
+    trades leaving the flow windows for alerts) and is then evaluated one last time
+    and dropped. Without a saved cursor the first call returns every market.
+    persist=False keeps the cursor in memory only (read-only stores).
+    """
+
+    def __init__(self, store: LMDBStore, name: str, linger_sec: float = 0.0, persist: bool = True) -> None:
+        self.store = store
+        self.name = name
+        self.linger_sec = float(linger_sec)
+        self.persist = persist
+        self.gen: Optional[int] = None
+        self.pending: Dict[str, float] = {}  # cid -> time until which it stays due
+        if persist:
+            state = store.get_json(k_dirty_cursor(name))
+            if state is not None:
+                self.gen = int(state["gen"])
+                self.pending = {k: float(v) for k, v in state["pending"].items()}
+
+    def due(self, condition_ids: Sequence[str], now: Optional[float] = None) -> List[str]:
+        now = time.time() if now is None else now
+        wanted = set(condition_ids)
+        if self.gen is None:
+            # first run: everything, lingering from each market's newest trade if known
+            changed, self.gen = changed_since(self.store, 0)
+            for cid in wanted:
+                if cid not in changed:
+                    mg = market_gen(self.store, cid)
+                    last = mg[1] if mg is not None else self.store.get_json(LMDBStore.k_last_trade_ts(cid))
+                    changed[cid] = int(last or 0)
+            out = list(wanted)
+        else:
+            changed, self.gen = changed_since(self.store, self.gen)
+            out = [cid for cid in changed if cid in wanted]
+            out += [cid for cid in self.pending if cid in wanted and cid not in changed]
+        for cid, last_ts in changed.items():
+            if cid in wanted:
+                self.pending[cid] = max(self.pending.get(cid, 0.0), last_ts + self.linger_sec)
+        # past their linger time: this is their last evaluation
+        for cid in [c for c, until in self.pending.items() if until <= now or c not in wanted]:
+            del self.pending[cid]
+        return out
+
+    def save(self) -> None:
+        if self.persist and self.gen is not None:
+            self.store.put(k_dirty_cursor(self.name), orjson.dumps({"gen": self.gen, "pending": self.pending}))
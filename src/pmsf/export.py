@@ -0,0 +1,347 @@
+from __future__ import annotations
+
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from itertools import chain
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import orjson
+
+from .features import trade_direction, trade_ts, trade_usd_abs, trade_wallet
+from .scorer import iter_wallet_stats
+from .sharding import ShardedReader
+from .storage_lmdb import LMDBStore
+from .types import WalletStats
+
+# Columnar export (Parquet / Arrow IPC) of trades, price snapshots and wallet stats.
+# pyarrow is optional: `pip install "pmsf[export]"`.
+
+WATERMARK_FILE = "_watermark.json"
+FORMATS = {"parquet": "parquet", "arrow": "arrow"}
+
+
+def _require_pyarrow() -> Any:
+    try:
+        import pyarrow as pa
+    except ImportError as e:
+        raise RuntimeError('pmsf export needs pyarrow: pip install "pmsf[export]"') from e
+    return pa
+
+
+def _schemas(pa: Any) -> Dict[str, Any]:
+    horizon = pa.struct(
+        [
+            ("horizon_sec", pa.int32()),
+            ("count", pa.int64()),
+            ("mean", pa.float64()),
+            ("variance", pa.float64()),
+            ("ewm", pa.float64()),
+        ]
+    )
+    return {
+        "trades": pa.schema(
+            [
+                ("condition_id", pa.string()),
+                ("ts", pa.int64()),
+                ("seq", pa.int32()),
+                ("wallet", pa.string()),
+                ("wallet_id", pa.int64()),
+                ("side", pa.string()),
+                ("outcome", pa.string()),
+                ("size", pa.float64()),
+                ("price", pa.float64()),
+                ("usd", pa.float64()),
+                ("direction", pa.int8()),
+                ("tx", pa.string()),
+            ]
+        ),
+        "prices": pa.schema(
+            [
+                ("condition_id", pa.string()),
+                ("ts", pa.int64()),
+                ("yes_price", pa.float64()),
+            ]
+        ),
+        "wallets": pa.schema(
+            [
+                ("wallet", pa.string()),
+                ("wallet_id", pa.int64()),
+                ("n_trades", pa.int64()),
+                ("volume_usd", pa.float64()),
+                ("score", pa.float64()),
+                ("horizons", pa.list_(horizon)),
+            ]
+        ),
+    }
+
+
+def _float_or_none(x: Any) -> Optional[float]:
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return None
+
+
+def _trade_row(key: str, v: bytes) -> Dict[str, Any]:
+    _, cid, _, seq = key.split(":")
+    t = orjson.loads(v)
+    return {
+        "condition_id": cid,
+        "ts": trade_ts(t),
+        "seq": int(seq),
+        "wallet": trade_wallet(t) or None,
+        "wallet_id": t.get("wid"),
+        "side": t.get("side"),
+        "outcome": t.get("outcome"),
+        "size": _float_or_none(t.get("size")),
+        "price": _float_or_none(t.get("price")),
+        "usd": trade_usd_abs(t),
+        "direction": trade_direction(t),
+        "tx": t.get("transactionHash"),
+    }
+
+
+def _price_row(key: str, v: bytes) -> Dict[str, Any]:
+    _, cid, ts = key.split(":")
+    obj = orjson.loads(v)
+    return {"condition_id": cid, "ts": int(ts), "yes_price": _float_or_none(obj.get("yes_price"))}
+
+
+def _wallet_row(wid: Optional[int], ws: WalletStats) -> Dict[str, Any]:
+    return {
+        "wallet": ws.wallet,
+        "wallet_id": wid,
+        "n_trades": ws.n_trades,
+        "volume_usd": ws.volume_usd,
+        "score": ws.score,
+        "horizons": [
+            {"horizon_sec": h.horizon_sec, "count": h.count, "mean": h.mean, "variance": h.variance, "ewm": h.ewm}
+            for h in ws.horizons
+        ],
+    }
+
+
+def scan_after_watermarks(
+    store: LMDBStore, prefix: str, watermarks: Dict[str, str]
+) -> Iterator[Tuple[str, bytes]]:
+    """
+    Walk a per-market key family ("trade:" / "price:") in key order, skipping each
+    market's keys up to and including its watermark key. Markets with a watermark are
+    jumped over with a cursor seek rather than read and discarded.
+    """
+    start: Optional[str] = None
+    while True:
+        jumped = False
+        for k, v in store.scan_prefix(prefix, start=start):
+            cid = k.split(":", 2)[1]
+            wm = watermarks.get(cid)
+            if wm is not None and k <= wm:
+                start = wm + "\x00"
+                jumped = True
+                break
+            yield k, v
+        if not jumped:
+            return
+
+
+class _PartitionWriter:
+    """
+    Streams record batches to one file at a time; a new file is opened whenever the
+    partition changes. Keys are market-ordered, so each partition is visited once.
+    """
+
+    def __init__(self, pa: Any, schema: Any, fmt: str, root: Path, run_id: str) -> None:
+        self.pa = pa
+        self.schema = schema
+        self.fmt = fmt
+        self.root = root
+        self.run_id = run_id
+        self.partition: Optional[str] = None
+        self._writer: Any = None
+        self._sink: Any = None
+        self.files: List[Path] = []
+
+    def _open(self, partition: Optional[str]) -> None:
+        d = self.root / partition if partition else self.root
+        d.mkdir(parents=True, exist_ok=True)
+        path = d / f"part-{self.run_id}.{FORMATS[self.fmt]}"
+        if self.fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            self._writer = pq.ParquetWriter(str(path), self.schema, compression="zstd")
+        else:
+            self._sink = self.pa.OSFile(str(path), "wb")
+            self._writer = self.pa.ipc.new_file(self._sink, self.schema)
+        self.partition = partition
+        self.files.append(path)
+
+    def write(self, partition: Optional[str], rows: Dict[str, List[Any]]) -> None:
+        if self._writer is None or partition != self.partition:
+            self.close()
+            self._open(partition)
+        batch = self.pa.RecordBatch.from_pydict(rows, schema=self.schema)
+        if self.fmt == "parquet":
+            self._writer.write_batch(batch)
+        else:
+            self._writer.write(batch)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+
+def _export_family(
+    pa: Any,
+    schema: Any,
+    rows: Iterator[Tuple[Optional[str], str, Dict[str, Any]]],
+    fmt: str,
+    root: Path,
+    run_id: str,
+    batch_rows: int,
+) -> Tuple[int, Dict[str, str]]:
+    """
+    rows yields (partition, key, row). Buffers at most batch_rows rows, and never mixes
+    partitions in one batch. Returns (rows written, last key per partition).
+    """
+    writer = _PartitionWriter(pa, schema, fmt, root, run_id)
+    names = schema.names
+    cols: Dict[str, List[Any]] = {n: [] for n in names}
+    buffered = 0
+    part: Optional[str] = None
+    last_keys: Dict[str, str] = {}
+    total = 0
+
+    def flush() -> None:
+        nonlocal cols, buffered
+        if buffered:
+            writer.write(part, cols)
+            cols = {n: [] for n in names}
+            buffered = 0
+
+    try:
+        for p, key, row in rows:
+            if p != part:
+                flush()
+                part = p
+            for n in names:
+                cols[n].append(row.get(n))
+            buffered += 1
+            total += 1
+            if p is not None:
+                last_keys[p] = key
+            if buffered >= batch_rows:
+                flush()
+        flush()
+    finally:
+        writer.close()
+    return total, last_keys
+
+
+def load_watermark(out_dir: Path) -> Dict[str, Any]:
+    p = out_dir / WATERMARK_FILE
+    if not p.exists():
+        return {}
+    return orjson.loads(p.read_bytes())
+
+
+def save_watermark(out_dir: Path, wm: Dict[str, Any]) -> None:
+    p = out_dir / WATERMARK_FILE
+    tmp = p.with_suffix(".tmp")
+    tmp.write_bytes(orjson.dumps(wm, option=orjson.OPT_INDENT_2))
+    os.replace(tmp, p)
+
+
+def _iter_wallets(source: Union[LMDBStore, ShardedReader]) -> Iterator[Tuple[Optional[int], WalletStats]]:
+    # wallet ids are per store: stats merged across shards have none
+    if isinstance(source, LMDBStore):
+        yield from iter_wallet_stats(source)
+    elif len(source.stores) == 1:
+        yield from iter_wallet_stats(source.stores[0])
+    else:
+        for ws in source.iter_wallet_stats():
+            yield None, ws
+
+
+def _swap_in(tmp: Path, dest: Path) -> None:
+    # replace dest by tmp with two renames, so a reader sees the old dataset or the new one
+    old = dest.with_name(f".{dest.name}.old")
+    if old.exists():
+        shutil.rmtree(old)
+    if dest.exists():
+        os.replace(dest, old)
+    os.replace(tmp, dest)
+    if old.exists():
+        shutil.rmtree(old)
+
+
+def export_store(
+    source: Union[LMDBStore, ShardedReader],
+    out_dir: Path,
+    datasets: Sequence[str] = ("trades", "prices", "wallets"),
+    fmt: str = "parquet",
+    batch_rows: int = 50_000,
+    incremental: bool = True,
+) -> Dict[str, int]:
+    """
+    Export LMDB data to out_dir/{dataset}/... in fixed-size record batches.
+
+    trades and prices are partitioned by market (market={conditionId}) and, when
+    incremental, only keys past the per-market watermark of the previous export are
+    written (as new part files). A full export (incremental=False) and the wallets
+    snapshot are written to a temporary directory that then replaces the dataset's.
+    From a ShardedReader, trades and prices are read from every shard (each market
+    lives in one) and wallet stats are merged across shards (wallet_id is then null).
+    Returns rows written per dataset.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    pa = _require_pyarrow()
+    schemas = _schemas(pa)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # part files of two runs in the same second must not collide
+    run_id = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime()) + "-" + uuid.uuid4().hex[:8]
+    wm = load_watermark(out_dir) if incremental else {}
+    counts: Dict[str, int] = {}
+    stores = [source] if isinstance(source, LMDBStore) else source.stores
+
+    row_fns: Dict[str, Tuple[str, Callable[[str, bytes], Optional[Dict[str, Any]]]]] = {
+        "trades": ("trade:", _trade_row),
+        "prices": ("price:", _price_row),
+    }
+    for name in datasets:
+        if name not in row_fns and name != "wallets":
+            raise ValueError(f"Unknown dataset: {name}")
+        snapshot = name == "wallets" or not incremental
+        root = out_dir / (f".{name}.tmp-{run_id}" if snapshot else name)
+        root.mkdir(parents=True, exist_ok=True)
+        try:
+            if name in row_fns:
+                prefix, fn = row_fns[name]
+                marks: Dict[str, str] = dict(wm.get(name, {}))
+                rows = (
+                    (f"market={k.split(':', 2)[1]}", k, fn(k, v))
+                    for k, v in chain.from_iterable(scan_after_watermarks(st, prefix, marks) for st in stores)
+                )
+                n, last = _export_family(pa, schemas[name], rows, fmt, root, run_id, batch_rows)
+                marks.update({p[len("market=") :]: k for p, k in last.items()})
+                wm[name] = marks
+            else:
+                wrows = ((None, "", _wallet_row(wid, ws)) for wid, ws in _iter_wallets(source))
+                n, _ = _export_family(pa, schemas["wallets"], wrows, fmt, root, run_id, batch_rows)
+        except BaseException:
+            if snapshot:
+                shutil.rmtree(root, ignore_errors=True)
+            raise
+        if snapshot:
+            _swap_in(root, out_dir / name)
+        counts[name] = n
+        wm["last_run"] = run_id
+        save_watermark(out_dir, wm)
+    return counts
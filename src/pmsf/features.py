@@ -1,10 +1,12 @@
 from __future__ import annotations
 
+import time
 from typing import Any, Dict, Optional, Tuple
 
 import orjson
 
-from .storage_lmdb import LMDBStore
+from .cum_index import vwap
+from .storage_lmdb import Reader
 
 
 def trade_direction(trade: Dict[str, Any]) -> int:
@@ -34,6 +36,30 @@ def trade_usd_abs(trade: Dict[str, Any]) -> float:
         return 0.0
 
 
+def trade_wallet(trade: Dict[str, Any]) -> str:
+    """
+    Lowercased wallet address of a trade ("" when missing or not an 0x address).
+    """
+    w = (trade.get("proxyWallet") or trade.get("user") or "").lower()
+    return w if w.startswith("0x") else ""
+
+
+def trade_yes_price(trade: Dict[str, Any]) -> Optional[float]:
+    """
+    Trade price in yes-price space (price for Yes, 1 - price for No), or None.
+    """
+    try:
+        price = float(trade.get("price"))
+    except Exception:
+        return None
+    outcome = trade.get("outcome")
+    if outcome == "Yes":
+        return price
+    if outcome == "No":
+        return 1.0 - price
+    return None
+
+
 def trade_ts(trade: Dict[str, Any]) -> int:
     ts = int(trade.get("timestamp") or 0)
     if ts > 10_000_000_000:
@@ -41,47 +67,84 @@ def trade_ts(trade: Dict[str, Any]) -> int:
     return ts
 
 
-def get_yes_price_at_or_after(store: LMDBStore, condition_id: str, target_ts: int) -> Optional[float]:
+def get_yes_price_at_or_after(store: Reader, condition_id: str, target_ts: int) -> Optional[float]:
     """
     Find the first price snapshot at or after target_ts.
     Keys: price:{cid}:{ts:010d}
     """
     prefix = f"price:{condition_id}:"
-    # start from "price:cid:target_ts"
+    # seek straight to "price:cid:target_ts"
     start_key = f"{prefix}{target_ts:010d}"
-    for k, v in store.scan_prefix(prefix):
-        if k < start_key:
-            continue
-        obj = orjson.loads(v)
-        try:
-            return float(obj["yes_price"])
-        except Exception:
-            return None
+    with store.txn() as tx:
+        for _, v in tx.scan(prefix, start=start_key, limit=1):
+            obj = orjson.loads(v)
+            try:
+                return float(obj["yes_price"])
+            except Exception:
+                return None
     return None
 
 
-def edge_for_trade(store: LMDBStore, condition_id: str, trade: Dict[str, Any], horizon_sec: int) -> Optional[float]:
-    t0 = trade_ts(trade)
-    p0_yes = None
-    # p0 computed from trade itself
-    try:
-        price = float(trade.get("price"))
-        outcome = trade.get("outcome")
-        if outcome == "Yes":
-            p0_yes = price
-        elif outcome == "No":
-            p0_yes = 1.0 - price
-    except Exception:
-        return None
+def horizon_yes_price(
+    store: Reader,
+    condition_id: str,
+    target_ts: int,
+    price_mode: str = "snap",
+    vwap_window_sec: int = 600,
+    now: Optional[int] = None,
+) -> Optional[float]:
+    """
+    Yes price at target_ts: the first snapshot at/after it ("snap"), or the VWAP of
+    trades in a vwap_window_sec window centered on it ("vwap", from the cumulative-notional
+    index; None until the window has fully elapsed).
+    """
+    if price_mode == "snap":
+        return get_yes_price_at_or_after(store, condition_id, target_ts)
+    if price_mode == "vwap":
+        half = max(1, int(vwap_window_sec)) // 2
+        now = int(time.time()) if now is None else int(now)
+        if target_ts + half > now:
+            return None
+        return vwap(store, condition_id, target_ts - half, target_ts + half)
+    raise ValueError(f"Unknown price mode: {price_mode}")
+
+
+def edge_for_trade(
+    store: Reader,
+    condition_id: str,
+    trade: Dict[str, Any],
+    horizon_sec: int,
+    price_mode: str = "snap",
+    vwap_window_sec: int = 600,
+    now: Optional[int] = None,
+) -> Optional[float]:
+    p0_yes = trade_yes_price(trade)
     if p0_yes is None:
         return None
-
-    p1_yes = get_yes_price_at_or_after(store, condition_id, t0 + horizon_sec)
-    if p1_yes is None:
+    return edge_at_horizon(
+        store, condition_id, trade_ts(trade), p0_yes, trade_direction(trade), horizon_sec, price_mode, vwap_window_sec, now
+    )
+
+
+def edge_at_horizon(
+    store: Reader,
+    condition_id: str,
+    t0: int,
+    p0_yes: float,
+    direction: int,
+    horizon_sec: int,
+    price_mode: str = "snap",
+    vwap_window_sec: int = 600,
+    now: Optional[int] = None,
+) -> Optional[float]:
+    """
+    Edge of a trade already reduced to (t0, yes-space price, direction), e.g. from the
+    trade tail cache: yes-price move from p0 to the horizon price, signed by direction.
+    """
+    if p0_yes != p0_yes or direction == 0:  # nan: no yes-space price
         return None
-
-    d = trade_direction(trade)
-    if d == 0:
+    p1_yes = horizon_yes_price(store, condition_id, t0 + horizon_sec, price_mode, vwap_window_sec, now)
+    if p1_yes is None:
         return None
-
+    d = direction
     return (p1_yes - p0_yes) * float(d)
@@ -1,69 +1,457 @@
 from __future__ import annotations
 
+import struct
 import time
-from typing import Any, Dict, List, Tuple
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
+import lmdb
 import orjson
 
-from .features import trade_direction, trade_ts, trade_usd_abs
+from .features import trade_direction, trade_ts, trade_usd_abs, trade_wallet
 from .scorer import is_smart, wallet_key_stats
-from .storage_lmdb import LMDBStore
+from .storage_lmdb import LMDBStore, Reader, StoreTxn
+from .tradecache import TradeTail, trade_cache
+from .wallet_ids import WalletBitmap, decode_wid, k_wid_addr, wallet_ids
+from .wallet_stats import decode_wallet_stats
 
 
-def smart_flow_market(
-    store: LMDBStore,
+# Per-minute flow buckets, maintained at ingest in the trades' write txn:
+#   mflow:{cid}:{minute:08d}:{wid:08x} -> signed_usd f64, abs_usd f64, trades u32
+# (minute = unix ts // 60). Smart flow over a window sums at most window/60 minutes of
+# small records, reading the wallet id from the key and decoding only smart wallets' values.
+FLOW_BUCKET_SEC = 60
+_BUCKET = struct.Struct("<ddI")
+
+
+def k_flow_bucket(condition_id: str, minute: int, wid: int) -> str:
+    return f"mflow:{condition_id}:{minute:08d}:{wid:08x}"
+
+
+class FlowDelta:
+    """
+    Bucket deltas of one market, accumulated over a batch and applied in the caller's write txn.
+    """
+
+    def __init__(self) -> None:
+        self.buckets: Dict[Tuple[int, int], List[float]] = {}
+
+    def add(self, trade: Dict[str, Any], ts: int, sign: float = 1.0) -> None:
+        wid = trade.get("wid")
+        if wid is None or ts <= 0:
+            return
+        usd = trade_usd_abs(trade)
+        b = self.buckets.setdefault((ts // FLOW_BUCKET_SEC, int(wid)), [0.0, 0.0, 0.0])
+        b[0] += sign * float(trade_direction(trade)) * usd
+        b[1] += sign * usd
+        b[2] += sign
+
+    def apply(self, txn: lmdb.Transaction, condition_id: str) -> int:
+        for (minute, wid), d in self.buckets.items():
+            k = k_flow_bucket(condition_id, minute, wid).encode("utf-8")
+            cur = txn.get(k)
+            net, vol, n = _BUCKET.unpack(cur) if cur is not None else (0.0, 0.0, 0)
+            n = max(0, n + int(d[2]))
+            if n == 0:
+                txn.delete(k)
+            else:
+                txn.put(k, _BUCKET.pack(net + d[0], vol + d[1], n))
+        written = len(self.buckets)
+        self.buckets.clear()
+        return written
+
+
+def rebuild_flow_buckets(store: LMDBStore, condition_id: str, batch: int = 50_000) -> int:
+    """
+    Recompute a market's flow buckets from its stored trades. Returns trades indexed.
+    """
+    store.delete_batch([k for k, _ in store.scan_prefix(f"mflow:{condition_id}:")])
+    ids = wallet_ids(store)
+    n = 0
+    delta = FlowDelta()
+    for k, v in store.scan_prefix(f"trade:{condition_id}:"):
+        t = orjson.loads(v)
+        if "wid" not in t:
+            wallet = trade_wallet(t)
+            if not wallet:
+                continue
+            t["wid"] = ids.intern(wallet)
+        delta.add(t, int(k.split(":")[2]))
+        n += 1
+        if n % batch == 0:
+            with store.write_txn() as txn:
+                delta.apply(txn, condition_id)
+    with store.write_txn() as txn:
+        delta.apply(txn, condition_id)
+    return n
+
+
+# Global time-ordered trade index across markets, written with the trades:
+#   tidx:{ts:010d}:{cid}:{seq:06d} -> wid u32 (NO_WID if none), signed_usd f64, abs_usd f64
+# The recent tail of every market sits in one contiguous key range, so a universe-wide
+# flow pass seeks once and reads only the last window's trades.
+NO_WID = 0xFFFFFFFF
+_TIDX = struct.Struct("<Idd")
+
+
+def k_trade_index(ts: int, condition_id: str, seq: int) -> str:
+    return f"tidx:{ts:010d}:{condition_id}:{seq:06d}"
+
+
+def pack_trade_index(wid: int, signed_usd: float, abs_usd: float) -> bytes:
+    return _TIDX.pack(wid, signed_usd, abs_usd)
+
+
+def unpack_trade_index(b: bytes) -> Tuple[int, float, float]:
+    return _TIDX.unpack(b)
+
+
+def trade_index_value(trade: Dict[str, Any]) -> bytes:
+    usd = trade_usd_abs(trade)
+    wid = trade.get("wid")
+    return pack_trade_index(NO_WID if wid is None else int(wid), float(trade_direction(trade)) * usd, usd)
+
+
+def rebuild_trade_index(store: LMDBStore, condition_id: str, batch: int = 50_000) -> int:
+    """
+    (Re)write a market's entries in the global trade index from its stored trades.
+    Returns trades indexed.
+    """
+    items: List[Tuple[str, bytes]] = []
+    n = 0
+    for k, v in store.scan_prefix(f"trade:{condition_id}:"):
+        _, _, ts, seq = k.split(":")
+        items.append((k_trade_index(int(ts), condition_id, int(seq)), trade_index_value(orjson.loads(v))))
+        n += 1
+        if len(items) >= batch:
+            store.write_batch(items)
+            items = []
+    store.write_batch(items)
+    return n
+
+
+class _SmartTest:
+    """
+    Smartness of a wallet id: from a precomputed bitmap, or from its stats (cached per call).
+    """
+
+    def __init__(
+        self,
+        store: Reader,
+        smart_wallets: Optional[WalletBitmap],
+        min_trades: int,
+        min_vol_usd: float,
+        score_threshold: float,
+    ) -> None:
+        self.store = store
+        self.bitmap = smart_wallets
+        self.min_trades = min_trades
+        self.min_vol_usd = min_vol_usd
+        self.score_threshold = score_threshold
+        self.cache: Dict[int, bool] = {}
+
+    def __call__(self, wid: int) -> bool:
+        if self.bitmap is not None:
+            return wid in self.bitmap
+        smart = self.cache.get(wid)
+        if smart is None:
+            stats = decode_wallet_stats("", self.store.get(wallet_key_stats(wid)))
+            smart = stats is not None and is_smart(stats, self.min_trades, self.min_vol_usd, self.score_threshold)
+            self.cache[wid] = smart
+        return smart
+
+
+def _flow_result(
     condition_id: str,
-    window_sec: int,
+    now: int,
+    wins: List[int],
+    net: List[float],
+    vol: List[float],
+    cnt: List[int],
+    wallet_last_ts: Dict[int, int],
+) -> Dict[str, Any]:
+    out: List[Dict[str, Any]] = []
+    for i, w in enumerate(wins):
+        out.append(
+            {
+                "window_sec": w,
+                "smart_net_usd": net[i],
+                "smart_vol_usd": vol[i],
+                "smart_trades": cnt[i],
+                "smart_wallets": sum(1 for ts in wallet_last_ts.values() if now - ts <= w),
+            }
+        )
+    return {"conditionId": condition_id, "ts": now, "windows": out}
+
+
+def smart_flow_multi(
+    store: Reader,
+    condition_id: str,
+    windows: Sequence[int],
     smart_min_trades: int,
     smart_min_volume_usd: float,
     smart_score_threshold: float,
+    now: Optional[int] = None,
+    smart_wallets: Optional[WalletBitmap] = None,
+    source: str = "buckets",
 ) -> Dict[str, Any]:
     """
-    Compute smart wallets net flow (USD proxy) over last window_sec.
-    For each trade in window:
-      signed = direction_in_yes_space * (size*price)
-    Also compute absolute smart volume.
+    Smart wallets net flow (USD proxy) over several trailing windows, in one scan.
+
+    source="buckets" sums the per-minute flow buckets of the minutes that lie wholly in
+    a window, and reads the trades of its partial edge minutes (the one holding its start,
+    and the one holding now), so windows stay exact to the second; source="trades" walks
+    the raw trades instead (from the store's trade tail cache when one is attached).
+    Either way keys are time-ordered, so we seek to the
+    start and walk forward once, adding each record to every window that still contains it.
+    Wallets are handled by their interned id. Smartness is looked up once per wallet
+    per call, or taken from smart_wallets (a precomputed bitmap of smart ids of this
+    store) when the caller already has one.
+    Returns {"conditionId", "ts", "windows": [per-window flow, in the order given]}.
     """
-    now = int(time.time())
-    start = now - window_sec
+    now = int(time.time()) if now is None else int(now)
+    wins = [int(w) for w in windows]
+    if source not in ("buckets", "trades"):
+        raise ValueError(f"Unknown flow source: {source}")
+    cache = trade_cache(store)
+    # one read txn for the scan and every stats lookup; rows are zero-copy views
+    with store.txn() as tx:
+        smart = _SmartTest(tx, smart_wallets, smart_min_trades, smart_min_volume_usd, smart_score_threshold)
+        if source == "buckets":
+            return _flow_from_buckets(tx, condition_id, wins, now, smart)
+        if cache is not None:
+            tail = cache.get(tx, condition_id, now - max(wins))
+            # trades without a wallet id need an address lookup: take the LMDB path
+            if tail is not None and not tail.no_wid:
+                return _flow_from_tail(tail, condition_id, wins, now, smart)
+        return _flow_from_trades(tx, condition_id, wins, now, smart)
 
-    prefix = f"trade:{condition_id}:"
-    net_usd = 0.0
-    vol_usd = 0.0
-    smart_trades = 0
-    smart_wallets_seen = set()
 
-    for _, v in store.scan_prefix(prefix):
+def _flow_from_buckets(
+    tx: StoreTxn, condition_id: str, wins: List[int], now: int, smart: _SmartTest
+) -> Dict[str, Any]:
+    starts = [now - w for w in wins]
+    first_minute = min(starts) // FLOW_BUCKET_SEC
+    last_minute = now // FLOW_BUCKET_SEC
+    net = [0.0] * len(wins)
+    vol = [0.0] * len(wins)
+    cnt = [0] * len(wins)
+    wallet_last_ts: Dict[int, int] = {}
+
+    def whole(minute: int) -> List[bool]:
+        # per window: does the minute lie entirely inside it
+        t0 = minute * FLOW_BUCKET_SEC
+        return [t0 >= s and t0 + FLOW_BUCKET_SEC - 1 <= now for s in starts]
+
+    inside: Dict[int, List[bool]] = {}
+    prefix = f"mflow:{condition_id}:"
+    for k, v in tx.scan(prefix, start=f"{prefix}{first_minute:08d}"):
+        minute = int(bytes(k[-17:-9]))
+        if minute > last_minute:
+            break
+        flags = inside.get(minute)
+        if flags is None:
+            flags = inside[minute] = whole(minute)
+        if not any(flags):
+            continue
+        wid = int(bytes(k[-8:]), 16)
+        if not smart(wid):
+            continue
+        b_net, b_vol, b_n = _BUCKET.unpack(v)
+        for i, ok in enumerate(flags):
+            if ok:
+                net[i] += b_net
+                vol[i] += b_vol
+                cnt[i] += b_n
+        # the minute's start is inside every window that counts the bucket, and no other
+        ts = minute * FLOW_BUCKET_SEC
+        wallet_last_ts[wid] = max(ts, wallet_last_ts.get(wid, 0))
+
+    # a window's partial edge minutes come from the trades, to the second
+    edges = {s // FLOW_BUCKET_SEC for s in starts} | {last_minute}
+    tprefix = f"trade:{condition_id}:"
+    for minute in sorted(edges):
+        flags = whole(minute)
+        if all(flags):
+            continue
+        t0 = minute * FLOW_BUCKET_SEC
+        for _, v in tx.scan(tprefix, start=f"{tprefix}{t0:010d}"):
+            t = orjson.loads(v)
+            ts = trade_ts(t)
+            if ts > now or ts >= t0 + FLOW_BUCKET_SEC:
+                break
+            wid = _trade_wid(tx, t)
+            if wid is None or not smart(wid):
+                continue
+            usd = trade_usd_abs(t)
+            signed = float(trade_direction(t)) * usd
+            for i, s in enumerate(starts):
+                if not flags[i] and ts >= s:
+                    net[i] += signed
+                    vol[i] += usd
+                    cnt[i] += 1
+            wallet_last_ts[wid] = max(ts, wallet_last_ts.get(wid, 0))
+    return _flow_result(condition_id, now, wins, net, vol, cnt, wallet_last_ts)
+
+
+def _trade_wid(tx: StoreTxn, t: Dict[str, Any]) -> Optional[int]:
+    wid = t.get("wid")
+    if wid is None:
+        # ingested before wallet ids existed; a wallet without an id has no stats either
+        wallet = trade_wallet(t)
+        b = tx.get(k_wid_addr(wallet)) if wallet else None
+        return decode_wid(b) if b is not None else None
+    return int(wid)
+
+
+def _flow_from_trades(
+    tx: StoreTxn, condition_id: str, wins: List[int], now: int, smart: _SmartTest
+) -> Dict[str, Any]:
+    start = now - max(wins)
+    net = [0.0] * len(wins)
+    vol = [0.0] * len(wins)
+    cnt = [0] * len(wins)
+    wallet_last_ts: Dict[int, int] = {}
+
+    prefix = f"trade:{condition_id}:"
+    for _, v in tx.scan(prefix, start=f"{prefix}{start:010d}"):
         t = orjson.loads(v)
         ts = trade_ts(t)
         if ts < start:
             continue
         if ts > now:
-            continue
+            break
 
-        wallet = (t.get("proxyWallet") or t.get("user") or "").lower()
-        if not wallet.startswith("0x"):
+        wid = _trade_wid(tx, t)
+        if wid is None or not smart(wid):
             continue
 
-        stats = store.get_json(wallet_key_stats(wallet))
-        if not isinstance(stats, dict):
-            continue
-        if not is_smart(stats, smart_min_trades, smart_min_volume_usd, smart_score_threshold):
+        signed = float(trade_direction(t)) * trade_usd_abs(t)
+        usd = trade_usd_abs(t)
+        age = now - ts
+        for i, w in enumerate(wins):
+            if age <= w:
+                net[i] += signed
+                vol[i] += usd
+                cnt[i] += 1
+        wallet_last_ts[wid] = ts
+    return _flow_result(condition_id, now, wins, net, vol, cnt, wallet_last_ts)
+
+
+def _flow_from_tail(
+    tail: TradeTail, condition_id: str, wins: List[int], now: int, smart: _SmartTest
+) -> Dict[str, Any]:
+    # same walk as _flow_from_trades, over the cached columns
+    net = [0.0] * len(wins)
+    vol = [0.0] * len(wins)
+    cnt = [0] * len(wins)
+    wallet_last_ts: Dict[int, int] = {}
+
+    for i in range(tail.start(now - max(wins)), len(tail)):
+        ts = tail.ts(i)
+        if ts > now:
+            break
+        wid = tail.wid[i]
+        if not smart(wid):
             continue
+        usd = tail.usd[i]
+        signed = float(tail.dirn[i]) * usd
+        age = now - ts
+        for j, w in enumerate(wins):
+            if age <= w:
+                net[j] += signed
+                vol[j] += usd
+                cnt[j] += 1
+        wallet_last_ts[wid] = ts
+    return _flow_result(condition_id, now, wins, net, vol, cnt, wallet_last_ts)
 
-        d = trade_direction(t)
-        usd = trade_usd_abs(t)
-        net_usd += float(d) * float(usd)
-        vol_usd += float(usd)
-        smart_trades += 1
-        smart_wallets_seen.add(wallet)
-
-    return {
-        "conditionId": condition_id,
-        "ts": now,
-        "window_sec": window_sec,
-        "smart_net_usd": net_usd,
-        "smart_vol_usd": vol_usd,
-        "smart_trades": smart_trades,
-        "smart_wallets": len(smart_wallets_seen),
-    }
+
+def smart_flow_market(
+    store: LMDBStore,
+    condition_id: str,
+    window_sec: int,
+    smart_min_trades: int,
+    smart_min_volume_usd: float,
+    smart_score_threshold: float,
+) -> Dict[str, Any]:
+    """
+    Compute smart wallets net flow (USD proxy) over last window_sec.
+    For each trade in window:
+      signed = direction_in_yes_space * (size*price)
+    Also compute absolute smart volume.
+    """
+    res = smart_flow_multi(
+        store,
+        condition_id,
+        [window_sec],
+        smart_min_trades=smart_min_trades,
+        smart_min_volume_usd=smart_min_volume_usd,
+        smart_score_threshold=smart_score_threshold,
+    )
+    return {"conditionId": condition_id, "ts": res["ts"], **res["windows"][0]}
+
+
+def write_flow_snap(store: LMDBStore, flows: Dict[str, Any]) -> Future:
+    """
+    Keep the latest multi-window flow of a market, so readers don't have to recompute it.
+    Submitted without waiting, so a pass over many markets can share one group commit;
+    returns the write's Future for the caller to check.
+    """
+    k = LMDBStore.k_last_flow(flows["conditionId"]).encode("utf-8")
+    v = orjson.dumps(flows)
+    return store.submit(lambda txn: txn.put(k, v))
+
+
+def smart_flow_universe(
+    store: Reader,
+    windows: Sequence[int],
+    smart_min_trades: int,
+    smart_min_volume_usd: float,
+    smart_score_threshold: float,
+    now: Optional[int] = None,
+    smart_wallets: Optional[WalletBitmap] = None,
+    condition_ids: Optional[Sequence[str]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    smart_flow_multi for every market of the store at once, from the global trade index:
+    one seek to now - max(windows) and one forward walk, so the cost follows the number
+    of recent trades rather than markets x history. Values carry the wallet id and USD
+    amounts, so trade records are never read. condition_ids, when given, restricts the
+    output to those markets (each present, with zero flow if it had no smart trades).
+    Returns {conditionId: flow} in the smart_flow_multi format.
+    """
+    now = int(time.time()) if now is None else int(now)
+    wins = [int(w) for w in windows]
+    start = now - max(wins)
+    wanted = set(condition_ids) if condition_ids is not None else None
+
+    # per market: net, vol, trade counts per window and wallet -> last ts
+    acc: Dict[str, Tuple[List[float], List[float], List[int], Dict[int, int]]] = {}
+    if condition_ids is not None:
+        for cid in condition_ids:
+            acc[cid] = ([0.0] * len(wins), [0.0] * len(wins), [0] * len(wins), {})
+
+    with store.txn() as tx:
+        smart = _SmartTest(tx, smart_wallets, smart_min_trades, smart_min_volume_usd, smart_score_threshold)
+        for k, v in tx.scan("tidx:", start=f"tidx:{start:010d}"):
+            ts = int(bytes(k[5:15]))
+            if ts > now:
+                break
+            wid, signed, usd = _TIDX.unpack(v)
+            if wid == NO_WID or not smart(wid):
+                continue
+            cid = bytes(k[16:-7]).decode("utf-8")
+            a = acc.get(cid)
+            if a is None:
+                if wanted is not None:
+                    continue
+                a = acc[cid] = ([0.0] * len(wins), [0.0] * len(wins), [0] * len(wins), {})
+            net, vol, cnt, last = a
+            age = now - ts
+            for i, w in enumerate(wins):
+                if age <= w:
+                    net[i] += signed
+                    vol[i] += usd
+                    cnt[i] += 1
+            last[wid] = ts
+    return {cid: _flow_result(cid, now, wins, *a) for cid, a in acc.items()}
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import math
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import lmdb
+import orjson
+
+from .features import edge_at_horizon, trade_direction, trade_usd_abs, trade_wallet, trade_yes_price
+from .scorer import wallet_key_stats
+from .storage_lmdb import LMDBStore, Reader
+from .tradecache import NO_WID, trade_cache
+from .types import WalletStats
+from .wallet_ids import WalletIds, wallet_ids
+from .wallet_stats import apply_edges, apply_trade, decode_wallet_stats, empty_wallet_stats, encode_wallet_stats
+
+# Horizon-maturity queue: work items of the scorer, ordered by the time they come due.
+#   mq:{due:010d}:{cid}:{t0:010d}:{seq:06d}:{horizon:08d} -> b""
+# Ingest enqueues every new trade once per configured horizon (due = t0 + horizon), plus
+# a horizon-0 item (due = t0) that counts the trade's volume. The scorer drains the items
+# that are due and deletes each in the write txn that folds it into the wallet's stats, so
+# every (trade, horizon) is applied exactly once and a run costs what matured since the last.
+#   mqcfg:horizons -> JSON list of horizons to enqueue (set from the configured score windows)
+K_HORIZONS = "mqcfg:horizons"
+
+
+def k_due(due: int, condition_id: str, t0: int, seq: int, horizon: int) -> str:
+    return f"mq:{due:010d}:{condition_id}:{t0:010d}:{seq:06d}:{horizon:08d}"
+
+
+def set_maturity_horizons(store: LMDBStore, windows: Sequence[int]) -> None:
+    """
+    Horizons that ingest enqueues from now on (trades already queued keep theirs).
+    """
+    store.put_json(K_HORIZONS, sorted({int(w) for w in windows if int(w) > 0}))
+
+
+def maturity_horizons(txn: lmdb.Transaction) -> Optional[List[int]]:
+    b = txn.get(K_HORIZONS.encode("utf-8"))
+    return orjson.loads(b) if b is not None else None
+
+
+def enqueue_trade(txn: lmdb.Transaction, horizons: Sequence[int], condition_id: str, t0: int, seq: int) -> None:
+    """
+    Queue a new trade's work items in the caller's (ingest) write txn.
+    """
+    for h in (0, *horizons):
+        txn.put(k_due(t0 + h, condition_id, t0, seq, h).encode("utf-8"), b"")
+
+
+def pending_count(store: Reader, due_before: Optional[int] = None) -> int:
+    """
+    Queued items, or only those due before due_before.
+    """
+    if due_before is None:
+        return store.count("mq:")
+    n = 0
+    stop = f"mq:{int(due_before):010d}".encode("utf-8")
+    with store.txn() as tx:
+        for k in tx.keys("mq:"):
+            if bytes(k) >= stop:
+                break
+            n += 1
+    return n
+
+
+def drain_due(
+    store: LMDBStore,
+    windows: Sequence[int],
+    weights: Sequence[float] = (),
+    ewm_alpha: float = 0.0,
+    price_mode: str = "snap",
+    vwap_window_sec: int = 600,
+    max_wait_sec: int = 6 * 3600,
+    now: Optional[int] = None,
+    batch: int = 10_000,
+) -> Dict[str, int]:
+    """
+    Apply every queued item due by now to wallet stats.
+
+    Horizon-0 items add the trade's volume and count; horizon items add its edge. An
+    item whose horizon price isn't available yet (no snapshot after it, VWAP window not
+    over) stays queued until max_wait_sec past due, then is dropped without an edge.
+    Items are read in one read txn per batch; the batch's stats updates and the deletes
+    of its items commit together, and an item already deleted (a concurrent scorer) is
+    skipped. Trades are taken from the store's trade tail cache when it has them.
+    Returns counts: trades, edges, expired, waiting.
+    """
+    now = int(time.time()) if now is None else int(now)
+    stop = f"mq:{now + 1:010d}".encode("utf-8")
+    ids = wallet_ids(store)
+    cache = trade_cache(store)
+    out = {"trades": 0, "edges": 0, "expired": 0, "waiting": 0}
+    start: Optional[str] = None
+
+    while True:
+        # (item key, wid, wallet, usd, horizon, edge)
+        work: List[Tuple[bytes, Optional[int], str, float, int, Optional[float]]] = []
+        last = b""
+        with store.txn() as tx:
+            trades: Dict[str, Optional[Dict[str, Any]]] = {}
+            for k, _ in tx.scan("mq:", start=start):
+                key = bytes(k)
+                if key >= stop:
+                    break
+                last = key
+                _, due, cid, t0, seq, h = key.decode("utf-8").split(":")
+                horizon = int(h)
+                # the trade from the hot tail when cached (no decode), else from LMDB
+                tail = cache.get(tx, cid, int(t0), load=False) if cache is not None else None
+                i = tail.find(int(t0), int(seq)) if tail is not None else -1
+                if i >= 0 and tail.wid[i] != NO_WID:
+                    wid, wallet, usd = tail.wid[i], "", tail.usd[i]
+                    p0, dirn = tail.p0[i], tail.dirn[i]
+                else:
+                    tkey = f"trade:{cid}:{t0}:{seq}"
+                    if tkey not in trades:
+                        v = tx.get(tkey)
+                        trades[tkey] = orjson.loads(v) if v is not None else None
+                    trade = trades[tkey]
+                    if trade is None:
+                        # trade gone (moved or deleted): drop the item
+                        work.append((key, None, "", 0.0, -1, None))
+                        continue
+                    wid = trade.get("wid")
+                    wallet = "" if wid is not None else trade_wallet(trade)
+                    usd = trade_usd_abs(trade)
+                    p0 = trade_yes_price(trade)
+                    p0, dirn = (math.nan if p0 is None else p0), trade_direction(trade)
+                if horizon == 0:
+                    work.append((key, wid, wallet, usd, 0, None))
+                else:
+                    e = edge_at_horizon(tx, cid, int(t0), p0, dirn, horizon, price_mode, vwap_window_sec, now)
+                    if e is None and now - int(due) < max_wait_sec:
+                        out["waiting"] += 1
+                        continue
+                    work.append((key, wid, wallet, 0.0, horizon, e))
+                if len(work) >= batch:
+                    break
+        if work:
+            _apply_work(store, ids, work, windows, weights, ewm_alpha, out)
+        if len(work) < batch:
+            return out
+        start = (last + b"\x00").decode("utf-8")
+
+
+def _apply_work(
+    store: LMDBStore,
+    ids: WalletIds,
+    work: List[Tuple[bytes, Optional[int], str, float, int, Optional[float]]],
+    windows: Sequence[int],
+    weights: Sequence[float],
+    ewm_alpha: float,
+    out: Dict[str, int],
+) -> None:
+    def job(txn: lmdb.Transaction) -> Tuple[Dict[str, int], Dict[str, int]]:
+        new: Dict[str, int] = {}
+        counts = {"trades": 0, "edges": 0, "expired": 0}
+        touched: Dict[int, WalletStats] = {}
+        for key, wid, wallet, usd, horizon, edge in work:
+            if not txn.delete(key) or horizon < 0:
+                continue
+            if wid is None:
+                if not wallet:
+                    continue
+                wid = ids.intern_in_txn(txn, [wallet])[wallet]
+                new[wallet] = wid
+            cur = touched.get(wid)
+            if cur is None:
+                addr = ids.address(wid) or wallet
+                cur = decode_wallet_stats(addr, txn.get(wallet_key_stats(wid).encode("utf-8"))) or empty_wallet_stats(
+                    addr, windows
+                )
+            if horizon == 0:
+                cur = apply_trade(cur, usd, {}, windows, weights, ewm_alpha)
+                counts["trades"] += 1
+            elif edge is not None:
+                cur = apply_edges(cur, {horizon: edge}, windows, weights, ewm_alpha)
+                counts["edges"] += 1
+            else:
+                counts["expired"] += 1
+            touched[wid] = cur
+        for wid, ws in touched.items():
+            txn.put(wallet_key_stats(wid).encode("utf-8"), encode_wallet_stats(ws))
+        return new, counts
+
+    new, counts = store.write(job)
+    ids.remember(new)
+    for k, n in counts.items():
+        out[k] += n
+
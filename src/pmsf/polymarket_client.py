@@ -1,12 +1,25 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+import hashlib
+import math
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlencode
 
 import httpx
+import orjson
+
+from .storage_lmdb import LMDBStore
 
 DATA_API = "https://data-api.polymarket.com"
 GAMMA_API = "https://gamma-api.polymarket.com"
 
+CACHE_MODES = ("off", "on", "replay")
+_ENTRY = struct.Struct("<dd")  # stored_at, expires_at (inf = immutable)
+
 
 def is_condition_id(s: str) -> bool:
     s = s.strip()
@@ -16,27 +29,182 @@ def is_condition_id(s: str) -> bool:
     return all(c in "0123456789abcdefABCDEF" for c in hexpart)
 
 
+class ReplayMiss(LookupError):
+    """
+    Replay mode was asked for a response that was never recorded.
+    """
+
+
+class ResponseCache:
+    """
+    On-disk cache of successful GET responses, in its own LMDB.
+
+    Entries are keyed by a hash of the URL and its sorted query parameters and hold the
+    zlib-compressed body with its store and expiry times:
+      http:{sha1} -> (stored_at f64, expires_at f64) + zlib(body)
+      edge:{sha1} -> digest of the listing's head page the entry was stored under
+    Every response is recorded; the caller picks its TTL (0 = record only, never served
+    live; inf = immutable). An entry stored with an edge is served live only to a get
+    with the same edge. In replay mode entries are served regardless of expiry and edge
+    and nothing goes to the network.
+    """
+
+    def __init__(self, path: Path, ttl_sec: float = 3600.0, replay: bool = False, map_size: int = 1024**3) -> None:
+        path.mkdir(parents=True, exist_ok=True)
+        # a lost tail of the cache only costs re-downloads: skip fsync on every put
+        self.store = LMDBStore(path, map_size=map_size, durability="nosync")
+        self.ttl_sec = float(ttl_sec)
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def close(self) -> None:
+        self.store.close()
+
+    @staticmethod
+    def key(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+        canon = url + "?" + urlencode(sorted((params or {}).items()))
+        return "http:" + hashlib.sha1(canon.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, now: Optional[float] = None, edge: Optional[bytes] = None) -> Optional[bytes]:
+        b = self.store.get(key)
+        if b is not None:
+            _, expires_at = _ENTRY.unpack_from(b)
+            live = (time.time() if now is None else now) < expires_at
+            if live and edge is not None:
+                live = self.store.get(_edge_key(key)) == edge
+            if self.replay or live:
+                self.hits += 1
+                return zlib.decompress(b[_ENTRY.size :])
+        self.misses += 1
+        return None
+
+    def put(self, key: str, body: bytes, ttl_sec: float, edge: Optional[bytes] = None) -> None:
+        now = time.time()
+        items = [(key, _ENTRY.pack(now, now + ttl_sec) + zlib.compress(body, 6))]
+        if edge:
+            items.append((_edge_key(key), edge))
+        self.store.write_batch(items)
+        self.stores += 1
+
+
+def _edge_key(key: str) -> str:
+    return "edge:" + key[len("http:") :]
+
+
+def _head_edge(data: Any) -> bytes:
+    # offset pages are newest-first, so any trade landing at the head changes its first row
+    first = data[0] if isinstance(data, list) and data else None
+    return hashlib.sha1(orjson.dumps(first, option=orjson.OPT_SORT_KEYS)).digest()
+
+
+def _historical_trades_ttl(params: Dict[str, Any], data: Any, age_sec: float) -> Optional[float]:
+    # a trade page deep in the history (offset > 0, newest trade older than age_sec) no
+    # longer changes once the head is fixed: keep it for good, served only under the head
+    # edge it was stored with. Pages at the head stay record-only.
+    if int(params.get("offset") or 0) <= 0 or not isinstance(data, list) or not data:
+        return None
+    try:
+        newest = max(int(t.get("timestamp") or 0) for t in data)
+    except (TypeError, ValueError, AttributeError):
+        return None
+    if newest > 10_000_000_000:
+        newest //= 1000
+    return math.inf if time.time() - newest > age_sec else None
+
+
 class PolymarketClient:
-    def __init__(self, timeout_sec: float = 20.0) -> None:
+    """
+    Thin client over the Gamma and Data APIs. With a ResponseCache, GETs are served from
+    disk while fresh (market listings: the cache TTL; head trade pages: never, they are
+    only recorded), and replay mode serves only from the cache, raising ReplayMiss for
+    anything not recorded.
+
+    Trade pages are offset-paginated newest-first, so what sits at an offset shifts as
+    trades land. A historical page (offset > 0) is served from disk only while the head
+    page this client last fetched live for the same listing matches the head the page
+    was stored under; until the head has been fetched, every page goes to the network.
+    """
+
+    def __init__(
+        self,
+        timeout_sec: float = 20.0,
+        cache: Optional[ResponseCache] = None,
+        historical_age_sec: float = 3600.0,
+    ) -> None:
         self.client = httpx.Client(headers={"User-Agent": "pmsf/0.1"}, timeout=timeout_sec)
+        self.cache = cache
+        self.historical_age_sec = float(historical_age_sec)
+        self.from_cache = False  # whether the last response came from the cache (no need to throttle)
+        self._heads: Dict[str, bytes] = {}  # trade listing (params sans offset) -> head page edge
 
     def close(self) -> None:
         self.client.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def _get(
+        self,
+        url: str,
+        params: Optional[Dict[str, Any]] = None,
+        missing_ok: bool = False,
+        ttl: Optional[Callable[[Any], Optional[float]]] = None,
+        edge: Optional[bytes] = None,
+    ) -> Any:
+        """
+        GET and decode JSON. Non-200: None if missing_ok, else raise. ttl(data) picks the
+        cache TTL of the response (None: record only); default is the cache's TTL. With
+        an edge, a cached response is served only if it was stored under that edge.
+        """
+        c = self.cache
+        key = ""
+        self.from_cache = False
+        if c is not None:
+            key = ResponseCache.key(url, params)
+            body = c.get(key, edge=edge)
+            if body is not None:
+                self.from_cache = True
+                return orjson.loads(body)
+            if c.replay:
+                if missing_ok:
+                    return None
+                raise ReplayMiss(f"Not recorded: {url} {params or {}}")
+        r = self.client.get(url, params=params)
+        if r.status_code != 200 and missing_ok:
+            return None
+        r.raise_for_status()
+        data = r.json()
+        if c is not None:
+            t = c.ttl_sec if ttl is None else ttl(data)
+            c.put(key, r.content, 0.0 if t is None else t, edge)
+        return data
+
+    def _get_trades(self, params: Dict[str, Any]) -> Any:
+        listing = ResponseCache.key(f"{DATA_API}/trades", {k: v for k, v in params.items() if k != "offset"})
+        if int(params.get("offset") or 0) <= 0:
+            data = self._get(f"{DATA_API}/trades", params=params, ttl=lambda _: None)
+            self._heads[listing] = _head_edge(data)
+            return data
+        # no head seen yet: b"" matches no stored edge, so the page is fetched live
+        edge = self._heads.get(listing, b"")
+
+        def ttl(data: Any) -> Optional[float]:
+            return _historical_trades_ttl(params, data, self.historical_age_sec) if edge else None
+
+        return self._get(f"{DATA_API}/trades", params=params, ttl=ttl, edge=edge)
 
     # -------- Gamma API --------
     def market_by_slug(self, slug: str) -> Dict[str, Any]:
         # try /markets/slug/{slug}, fallback /markets?slug=
-        r = self.client.get(f"{GAMMA_API}/markets/slug/{slug}")
-        if r.status_code == 200:
-            data = r.json()
+        data = self._get(f"{GAMMA_API}/markets/slug/{slug}", missing_ok=True)
+        if data is not None:
             if isinstance(data, list):
                 return data[0]
             if isinstance(data, dict):
                 return data
         # fallback
-        r2 = self.client.get(f"{GAMMA_API}/markets", params={"slug": slug})
-        r2.raise_for_status()
-        data2 = r2.json()
+        data2 = self._get(f"{GAMMA_API}/markets", params={"slug": slug})
         if not isinstance(data2, list) or not data2:
             raise ValueError(f"Slug not found: {slug}")
         return data2[0]
@@ -51,9 +219,7 @@ class PolymarketClient:
     def list_markets(self, limit: int = 500, offset: int = 0) -> List[Dict[str, Any]]:
         # Gamma /markets returns a list; supports limit/offset on many deployments
         params = {"limit": limit, "offset": offset}
-        r = self.client.get(f"{GAMMA_API}/markets", params=params)
-        r.raise_for_status()
-        data = r.json()
+        data = self._get(f"{GAMMA_API}/markets", params=params)
         if not isinstance(data, list):
             raise ValueError(f"Unexpected /markets response type: {type(data)}")
         return data
@@ -66,9 +232,7 @@ class PolymarketClient:
             "offset": offset,
             "takerOnly": "true",
         }
-        r = self.client.get(f"{DATA_API}/trades", params=params)
-        r.raise_for_status()
-        data = r.json()
+        data = self._get_trades(params)
         if not isinstance(data, list):
             raise ValueError(f"Unexpected /trades response type: {type(data)}")
         return data
@@ -80,9 +244,7 @@ class PolymarketClient:
             "offset": offset,
             "takerOnly": "true",
         }
-        r = self.client.get(f"{DATA_API}/trades", params=params)
-        r.raise_for_status()
-        data = r.json()
+        data = self._get_trades(params)
         if not isinstance(data, list):
             raise ValueError(f"Unexpected /trades response type: {type(data)}")
         return data
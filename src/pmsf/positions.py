@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import heapq
+import struct
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import lmdb
+import orjson
+
+from .features import trade_wallet
+from .storage_lmdb import LMDBStore
+from .types import Position
+from .wallet_ids import wallet_ids
+
+# Position ledger, maintained by ingest in the trades' write txn. Same record under two keys:
+#   pos:{cid}:{wid:08x}   market -> holders
+#   wpos:{wid:08x}:{cid}  wallet -> markets
+# value: net_yes f64, net_no f64, cost_usd f64, volume_usd f64, n_trades u32
+_POS = struct.Struct("<ddddI")
+_ZERO = (0.0, 0.0, 0.0, 0.0, 0)
+
+# Orderings for top holders: key function over a Position, largest first.
+RANKINGS = {
+    "net": lambda p: abs(p.net_yes - p.net_no),
+    "yes": lambda p: p.net_yes,
+    "no": lambda p: p.net_no,
+    "volume": lambda p: p.volume_usd,
+    "cost": lambda p: abs(p.cost_usd),
+}
+
+
+def k_position(condition_id: str, wid: int) -> str:
+    return f"pos:{condition_id}:{wid:08x}"
+
+
+def k_wallet_position(wid: int, condition_id: str) -> str:
+    return f"wpos:{wid:08x}:{condition_id}"
+
+
+def _trade_legs(trade: Dict[str, Any]) -> Optional[Tuple[float, float, float, float]]:
+    """
+    (d_net_yes, d_net_no, d_cost_usd, usd) of one trade, or None if it can't be booked.
+    """
+    side = trade.get("side")
+    outcome = trade.get("outcome")
+    if side not in ("BUY", "SELL") or outcome not in ("Yes", "No"):
+        return None
+    try:
+        size = float(trade.get("size"))
+        price = float(trade.get("price"))
+    except (TypeError, ValueError):
+        return None
+    shares = size if side == "BUY" else -size
+    usd = abs(size * price)
+    cost = usd if side == "BUY" else -usd
+    if outcome == "Yes":
+        return shares, 0.0, cost, usd
+    return 0.0, shares, cost, usd
+
+
+class PositionDelta:
+    """
+    Ledger deltas of one market keyed by wallet id, applied in the caller's write txn.
+    """
+
+    def __init__(self) -> None:
+        self.wallets: Dict[int, List[float]] = {}
+
+    def add(self, trade: Dict[str, Any], sign: float = 1.0) -> None:
+        wid = trade.get("wid")
+        legs = _trade_legs(trade)
+        if wid is None or legs is None:
+            return
+        d = self.wallets.setdefault(int(wid), [0.0, 0.0, 0.0, 0.0, 0.0])
+        d[0] += sign * legs[0]
+        d[1] += sign * legs[1]
+        d[2] += sign * legs[2]
+        d[3] += sign * legs[3]
+        d[4] += sign
+
+    def apply(self, txn: lmdb.Transaction, condition_id: str) -> int:
+        for wid, d in self.wallets.items():
+            km = k_position(condition_id, wid).encode("utf-8")
+            kw = k_wallet_position(wid, condition_id).encode("utf-8")
+            cur = txn.get(km)
+            ny, nn, cost, vol, n = _POS.unpack(cur) if cur is not None else _ZERO
+            n = max(0, n + int(d[4]))
+            if n == 0:
+                txn.delete(km)
+                txn.delete(kw)
+                continue
+            v = _POS.pack(ny + d[0], nn + d[1], cost + d[2], vol + d[3], n)
+            txn.put(km, v)
+            txn.put(kw, v)
+        written = len(self.wallets)
+        self.wallets.clear()
+        return written
+
+
+def _position(wallet: str, condition_id: str, v: bytes) -> Position:
+    return Position(wallet, condition_id, *_POS.unpack(v))
+
+
+def market_positions(store: LMDBStore, condition_id: str) -> Iterator[Position]:
+    """
+    Every holder of a market (wallet addresses resolved through the store's dictionary).
+    """
+    ids = wallet_ids(store)
+    prefix = f"pos:{condition_id}:"
+    with store.txn() as tx:
+        for k, v in tx.scan(prefix):
+            wid = int(bytes(k[-8:]), 16)
+            yield _position(ids.address(wid) or f"#{wid}", condition_id, v)
+
+
+def wallet_positions(store: LMDBStore, wallet: str) -> List[Position]:
+    wid = wallet_ids(store).lookup(wallet)
+    if wid is None:
+        return []
+    prefix = f"wpos:{wid:08x}:"
+    return [_position(wallet, k[len(prefix) :], v) for k, v in store.scan_prefix(prefix)]
+
+
+def top_holders(store: LMDBStore, condition_id: str, n: int, by: str = "net") -> List[Position]:
+    if by not in RANKINGS:
+        raise ValueError(f"Unknown ranking: {by}")
+    return heapq.nlargest(n, market_positions(store, condition_id), key=RANKINGS[by])
+
+
+def rebuild_positions(store: LMDBStore, condition_id: str, batch: int = 50_000) -> int:
+    """
+    Recompute a market's ledger from its stored trades. Returns trades booked.
+    """
+    old = [k for k, _ in store.scan_prefix(f"pos:{condition_id}:")]
+    store.delete_batch(old + [k_wallet_position(int(k[-8:], 16), condition_id) for k in old])
+    ids = wallet_ids(store)
+    n = 0
+    delta = PositionDelta()
+    for _, v in store.scan_prefix(f"trade:{condition_id}:"):
+        t = orjson.loads(v)
+        if "wid" not in t:
+            wallet = trade_wallet(t)
+            if not wallet:
+                continue
+            t["wid"] = ids.intern(wallet)
+        delta.add(t)
+        n += 1
+        if n % batch == 0:
+            with store.write_txn() as txn:
+                delta.apply(txn, condition_id)
+    with store.write_txn() as txn:
+        delta.apply(txn, condition_id)
+    return n
@@ -1,11 +1,15 @@
 from __future__ import annotations
 
 import time
-from typing import Any, Dict, Optional
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
 
+import lmdb
 import orjson
 
-from .storage_lmdb import LMDBStore
+from .features import trade_yes_price
+from .storage_lmdb import LMDBStore, Reader, StoreTxn
+from .tradecache import trade_cache
 
 
 def _to_int_ts(ts: Any) -> int:
@@ -19,32 +23,31 @@ def _price_key(condition_id: str, ts: int) -> str:
     return f"price:{condition_id}:{ts:010d}"
 
 
-def compute_yes_price_proxy_from_recent_trades(store: LMDBStore, condition_id: str, lookback: int = 5000) -> Optional[float]:
+def compute_yes_price_proxy_from_recent_trades(store: Reader, condition_id: str) -> Optional[float]:
     """
-    Proxy yes_price computed from most recent trades:
+    Proxy yes_price computed from the most recent trade:
       - if last trade outcome == Yes => yes_price = price
       - if last trade outcome == No  => yes_price = 1 - price
     If we can't find any, return None.
     """
-    # Scan last trades by reading from end is hard in LMDB prefix scan; simplest:
-    # scan prefix with limit and take the last element (works for MVP).
-    # keys are time-sorted because timestamp is in key.
+    # keys are time-sorted because timestamp is in key, so the last key under the
+    # market's prefix is its latest trade: one reverse seek, no scan
     prefix = f"trade:{condition_id}:"
-    last_trade = None
-    for _, v in store.scan_prefix(prefix, limit=lookback):
-        last_trade = v
-    if last_trade is None:
-        return None
-    t = orjson.loads(last_trade)
-    outcome = t.get("outcome")
-    price = t.get("price")
-    if outcome not in ("Yes", "No"):
-        return None
-    try:
-        p = float(price)
-    except Exception:
+    cache = trade_cache(store)
+    with store.txn() as tx:
+        if cache is not None:
+            # the cached tail holds the latest trade when it holds any
+            tail = cache.get(tx, condition_id, int(time.time()) - cache.tail_sec)
+            if tail is not None and len(tail):
+                p0 = tail.p0[-1]
+                return None if p0 != p0 else min(1.0, max(0.0, p0))
+        last = tx.last(prefix)
+        if last is None:
+            return None
+        t = orjson.loads(last[1])
+    yes_price = trade_yes_price(t)
+    if yes_price is None:
         return None
-    yes_price = p if outcome == "Yes" else (1.0 - p)
     # clamp
     if yes_price < 0.0:
         yes_price = 0.0
@@ -53,15 +56,28 @@ def compute_yes_price_proxy_from_recent_trades(store: LMDBStore, condition_id: s
     return yes_price
 
 
-def write_price_snap(store: LMDBStore, condition_id: str, ts: int, yes_price: float) -> None:
-    store.put_json(_price_key(condition_id, ts), {"conditionId": condition_id, "ts": ts, "yes_price": yes_price})
-    store.put_json(LMDBStore.k_last_price_ts(condition_id), ts)
+def write_price_snap(store: LMDBStore, condition_id: str, ts: int, yes_price: float) -> Future:
+    # submitted, not awaited: with group commit, snapshots of many markets share one commit
+    def job(txn: lmdb.Transaction) -> None:
+        tx = StoreTxn(txn, write=True)
+        tx.put_json(_price_key(condition_id, ts), {"conditionId": condition_id, "ts": ts, "yes_price": yes_price})
+        tx.put_json(LMDBStore.k_last_price_ts(condition_id), ts)
 
+    return store.submit(job)
 
-def price_tick(store: LMDBStore, condition_id: str) -> Optional[float]:
+
+def price_tick(store: LMDBStore, condition_id: str, pending: Optional[List[Future]] = None) -> Optional[float]:
+    """
+    Snapshot the market's price. The write's Future goes to pending when given (the caller
+    checks the pass's writes together), else it is awaited here.
+    """
     yes_price = compute_yes_price_proxy_from_recent_trades(store, condition_id)
     if yes_price is None:
         return None
     ts = int(time.time())
-    write_price_snap(store, condition_id, ts, yes_price)
+    fut = write_price_snap(store, condition_id, ts, yes_price)
+    if pending is None:
+        fut.result()
+    else:
+        pending.append(fut)
     return yes_price
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import heapq
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+@dataclass
+class MarketActivity:
+    rate: float  # smoothed trade arrival rate, trades/sec
+    interval_sec: float  # current poll interval
+    last_poll: float  # monotonic time of the last poll (0 = never)
+    polls: int = 0
+    trades: int = 0
+
+
+class AdaptivePollScheduler:
+    """
+    Per-market poll schedule driven by observed trade arrival rates.
+
+    Each market's rate is an EWMA of (new trades / seconds since its last poll). Its next
+    interval is chosen so that about target_per_poll trades accumulate between polls,
+    clamped to [min_interval_sec, max_interval_sec]. Markets sit in a min-heap keyed by
+    next-due time, so picking the next market to poll is O(log n).
+    """
+
+    def __init__(
+        self,
+        condition_ids: Iterable[str],
+        target_per_poll: float = 50.0,
+        min_interval_sec: float = 5.0,
+        max_interval_sec: float = 600.0,
+        initial_interval_sec: float = 20.0,
+        alpha: float = 0.3,
+        now: Optional[float] = None,
+    ) -> None:
+        self.target_per_poll = float(target_per_poll)
+        self.min_interval_sec = float(min_interval_sec)
+        self.max_interval_sec = float(max_interval_sec)
+        self.alpha = float(alpha)
+        now = time.monotonic() if now is None else now
+        initial = self._clamp(initial_interval_sec)
+
+        self.markets: Dict[str, MarketActivity] = {}
+        self._heap: List[Tuple[float, str]] = []
+        for cid in condition_ids:
+            if cid in self.markets:
+                continue
+            self.markets[cid] = MarketActivity(rate=self.target_per_poll / initial, interval_sec=initial, last_poll=0.0)
+            # first round goes out immediately
+            self._heap.append((now, cid))
+        heapq.heapify(self._heap)
+
+    def _clamp(self, interval: float) -> float:
+        return min(self.max_interval_sec, max(self.min_interval_sec, interval))
+
+    def next_due(self) -> Optional[float]:
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: Optional[float] = None) -> Optional[str]:
+        """
+        Remove and return the most overdue market, or None if nothing is due yet.
+        The caller must report back with observe() to reschedule it.
+        """
+        now = time.monotonic() if now is None else now
+        if not self._heap or self._heap[0][0] > now:
+            return None
+        return heapq.heappop(self._heap)[1]
+
+    def observe(self, condition_id: str, n_new: int, now: Optional[float] = None) -> float:
+        """
+        Record a poll result and reschedule the market. Returns its new interval.
+        """
+        now = time.monotonic() if now is None else now
+        m = self.markets[condition_id]
+        if m.last_poll > 0.0:
+            elapsed = max(1e-3, now - m.last_poll)
+            m.rate = self.alpha * (n_new / elapsed) + (1.0 - self.alpha) * m.rate
+        m.last_poll = now
+        m.polls += 1
+        m.trades += n_new
+        m.interval_sec = self._clamp(self.target_per_poll / m.rate if m.rate > 0 else self.max_interval_sec)
+        heapq.heappush(self._heap, (now + m.interval_sec, condition_id))
+        return m.interval_sec
@@ -1,92 +1,169 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Tuple
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
+import lmdb
 import orjson
 
-from .features import edge_for_trade, trade_usd_abs
+from .features import edge_for_trade, trade_usd_abs, trade_wallet
 from .storage_lmdb import LMDBStore
+from .types import WalletStats
+from .wallet_ids import wallet_ids
+from .wallet_stats import (
+    apply_trade,
+    decode_wallet_stats,
+    empty_wallet_stats,
+    encode_wallet_stats,
+    merge_wallet_stats,
+)
 
 
-def wallet_key_stats(wallet: str) -> str:
-    return f"wallet:{wallet}:stats"
+def wallet_key_stats(wid: int) -> str:
+    return f"wstats:{wid:08x}"
 
 
-def is_smart(stats: Dict[str, Any], min_trades: int, min_vol_usd: float, score_threshold: float) -> bool:
-    return (
-        int(stats.get("n_trades", 0)) >= min_trades
-        and float(stats.get("volume_usd", 0.0)) >= min_vol_usd
-        and float(stats.get("score", 0.0)) >= score_threshold
-    )
+def legacy_wallet_key_stats(wallet: str) -> str:
+    # stats keyed by address, before wallet ids; see migrate_legacy_wallet_stats
+    return f"wallet:{wallet}:stats"
+
 
+def load_wallet_stats(store: LMDBStore, wallet: str) -> Optional[WalletStats]:
+    wid = wallet_ids(store).lookup(wallet)
+    if wid is None:
+        return None
+    return decode_wallet_stats(wallet, store.get(wallet_key_stats(wid)))
 
-def update_wallet_stats(store: LMDBStore, wallet: str, delta: Dict[str, Any]) -> Dict[str, Any]:
-    cur = store.get_json(wallet_key_stats(wallet)) or {
-        "wallet": wallet,
-        "n_trades": 0,
-        "volume_usd": 0.0,
-        "sum_edge_1h": 0.0,
-        "cnt_edge_1h": 0,
-        "sum_edge_4h": 0.0,
-        "cnt_edge_4h": 0,
-        "score_1h": 0.0,
-        "score_4h": 0.0,
-        "score": 0.0,
-    }
 
-    cur["n_trades"] = int(cur["n_trades"]) + int(delta.get("n_trades", 0))
-    cur["volume_usd"] = float(cur["volume_usd"]) + float(delta.get("volume_usd", 0.0))
+def iter_wallet_stats(store: LMDBStore) -> Iterator[Tuple[int, WalletStats]]:
+    """
+    (wallet id, stats) for every scored wallet of the store, in id order.
+    """
+    ids = wallet_ids(store)
+    n = len("wstats:")
+    for k, v in store.scan_prefix("wstats:"):
+        wid = int(k[n:], 16)
+        ws = decode_wallet_stats(ids.address(wid) or "", v)
+        if ws is not None:
+            yield wid, ws
+
+
+def migrate_legacy_wallet_stats(
+    store: LMDBStore, windows: Sequence[int], weights: Sequence[float] = (), use_ewm: bool = False
+) -> int:
+    """
+    Move address-keyed stats ("wallet:{addr}:stats") to id-keyed ones, merging with any
+    id-keyed stats already present. Returns the number of wallets migrated.
+    """
+    legacy = [(k, bytes(v)) for k, v in store.scan_prefix("wallet:") if k.endswith(":stats")]
+    if not legacy:
+        return 0
+    wids = wallet_ids(store).intern_many(k[len("wallet:") : -len(":stats")] for k, _ in legacy)
+    items = []
+    for k, v in legacy:
+        wallet = k[len("wallet:") : -len(":stats")]
+        ws = decode_wallet_stats(wallet, v)
+        if ws is None:
+            continue
+        key = wallet_key_stats(wids[wallet])
+        cur = decode_wallet_stats(wallet, store.get(key))
+        if cur is not None:
+            ws = merge_wallet_stats(cur, ws, windows, weights, use_ewm)
+        items.append((key, encode_wallet_stats(ws)))
+    store.write_batch(items)
+    store.delete_batch(k for k, _ in legacy)
+    return len(items)
 
-    cur["sum_edge_1h"] = float(cur["sum_edge_1h"]) + float(delta.get("sum_edge_1h", 0.0))
-    cur["cnt_edge_1h"] = int(cur["cnt_edge_1h"]) + int(delta.get("cnt_edge_1h", 0))
 
-    cur["sum_edge_4h"] = float(cur["sum_edge_4h"]) + float(delta.get("sum_edge_4h", 0.0))
-    cur["cnt_edge_4h"] = int(cur["cnt_edge_4h"]) + int(delta.get("cnt_edge_4h", 0))
+def is_smart(stats: WalletStats, min_trades: int, min_vol_usd: float, score_threshold: float) -> bool:
+    return (
+        stats.n_trades >= min_trades
+        and stats.volume_usd >= min_vol_usd
+        and stats.score >= score_threshold
+    )
 
-    cur["score_1h"] = (float(cur["sum_edge_1h"]) / max(1, int(cur["cnt_edge_1h"])))
-    cur["score_4h"] = (float(cur["sum_edge_4h"]) / max(1, int(cur["cnt_edge_4h"])))
-    cur["score"] = 0.6 * cur["score_1h"] + 0.4 * cur["score_4h"]
 
-    store.put_json(wallet_key_stats(wallet), cur)
+def update_wallet_stats(
+    store: LMDBStore,
+    wallet: str,
+    volume_usd: float,
+    edges: Dict[int, float],
+    windows: Sequence[int],
+    weights: Sequence[float] = (),
+    ewm_alpha: float = 0.0,
+) -> WalletStats:
+    """
+    Fold a single trade into a wallet's stored stats (read-modify-write, in one write txn).
+    """
+    ids = wallet_ids(store)
+
+    def job(txn: lmdb.Transaction) -> Tuple[Dict[str, int], WalletStats]:
+        new = ids.intern_in_txn(txn, [wallet])
+        k = wallet_key_stats(new[wallet]).encode("utf-8")
+        cur = decode_wallet_stats(wallet, txn.get(k)) or empty_wallet_stats(wallet, windows)
+        cur = apply_trade(cur, volume_usd, edges, windows, weights, ewm_alpha)
+        txn.put(k, encode_wallet_stats(cur))
+        return new, cur
+
+    new, cur = store.write(job)
+    ids.remember(new)
     return cur
 
 
-def score_market(store: LMDBStore, condition_id: str, windows: List[int]) -> Tuple[int, int]:
+def score_market(
+    store: LMDBStore,
+    condition_id: str,
+    windows: List[int],
+    weights: Sequence[float] = (),
+    ewm_alpha: float = 0.0,
+    price_mode: str = "snap",
+    vwap_window_sec: int = 600,
+) -> Tuple[int, int]:
     """
-    Iterate trades for the market and update wallet stats.
+    Iterate trades for the market and update wallet stats, for every horizon in windows.
     MVP behavior: processes ALL trades found (idempotency not perfect).
     We'll improve with per-market scoring cursor later.
+    Wallets touched by the market are updated in memory (keyed by wallet id) and
+    written in one batch. price_mode picks the horizon price: "snap" (first price
+    snapshot at/after t0+horizon) or "vwap" (VWAP around it, see horizon_yes_price).
     Returns: (trades_seen, edges_computed)
     """
     prefix = f"trade:{condition_id}:"
     trades_seen = 0
     edges_done = 0
-
-    for _, v in store.scan_prefix(prefix):
-        trade = orjson.loads(v)
-        trades_seen += 1
-        wallet = (trade.get("proxyWallet") or trade.get("user") or "").lower()
-        if not wallet.startswith("0x"):
-            continue
-
-        vol = trade_usd_abs(trade)
-        delta = {"n_trades": 1, "volume_usd": vol}
-
-        # compute edges for 1h/4h if possible (needs price snapshots after horizons)
-        # windows are seconds; we only use first two as 1h/4h in this MVP.
-        if len(windows) >= 1:
-            e1 = edge_for_trade(store, condition_id, trade, windows[0])
-            if e1 is not None:
-                delta["sum_edge_1h"] = float(delta.get("sum_edge_1h", 0.0)) + float(e1)
-                delta["cnt_edge_1h"] = int(delta.get("cnt_edge_1h", 0)) + 1
-                edges_done += 1
-        if len(windows) >= 2:
-            e4 = edge_for_trade(store, condition_id, trade, windows[1])
-            if e4 is not None:
-                delta["sum_edge_4h"] = float(delta.get("sum_edge_4h", 0.0)) + float(e4)
-                delta["cnt_edge_4h"] = int(delta.get("cnt_edge_4h", 0)) + 1
-                edges_done += 1
-
-        update_wallet_stats(store, wallet, delta)
-
+    ids = wallet_ids(store)
+    touched: Dict[int, WalletStats] = {}
+    now = int(time.time())
+
+    # one read txn for the trade scan, price lookups and stats reads; rows are zero-copy views
+    with store.txn() as tx:
+        for _, v in tx.scan(prefix):
+            trade = orjson.loads(v)
+            trades_seen += 1
+            wid = trade.get("wid")
+            if wid is None:
+                # ingested before wallet ids existed
+                wallet = trade_wallet(trade)
+                if not wallet:
+                    continue
+                wid = ids.intern(wallet)
+
+            # edges need a horizon price (snapshot or matured VWAP window); missing ones are skipped
+            edges: Dict[int, float] = {}
+            for w in windows:
+                e = edge_for_trade(tx, condition_id, trade, w, price_mode, vwap_window_sec, now)
+                if e is not None:
+                    edges[w] = e
+            edges_done += len(edges)
+
+            cur = touched.get(wid)
+            if cur is None:
+                wallet = ids.address(wid) or ""
+                cur = decode_wallet_stats(wallet, tx.get(wallet_key_stats(wid))) or empty_wallet_stats(
+                    wallet, windows
+                )
+            touched[wid] = apply_trade(cur, trade_usd_abs(trade), edges, windows, weights, ewm_alpha)
+
+    if touched:
+        store.write_batch((wallet_key_stats(w), encode_wallet_stats(ws)) for w, ws in touched.items())
     return trades_seen, edges_done
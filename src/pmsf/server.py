@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import os
+import socketserver
+import sys
+import threading
+import time
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import orjson
+
+from .flow import smart_flow_universe
+from .scorer import is_smart
+from .sharding import ShardedReader
+from .storage_lmdb import LMDBStore
+from .types import WalletStats
+
+
+class WarmCache:
+    """
+    In-memory view of what query clients ask for: smart wallets, latest prices and
+    multi-window flows per market. refresh() rebuilds everything from read-only LMDB
+    transactions and swaps the dicts in whole, so request threads never see a half update.
+    Reads go through a ShardedReader (a single shard when unsharded), so wallet stats
+    are merged across shards and market data comes from the owning shard.
+    """
+
+    def __init__(
+        self,
+        reader: ShardedReader,
+        condition_ids: Sequence[str],
+        windows: Sequence[int],
+        smart_min_trades: int,
+        smart_min_volume_usd: float,
+        smart_score_threshold: float,
+    ) -> None:
+        self.reader = reader
+        self.condition_ids = list(condition_ids)
+        self.windows = [int(w) for w in windows]
+        self.smart_min_trades = smart_min_trades
+        self.smart_min_volume_usd = smart_min_volume_usd
+        self.smart_score_threshold = smart_score_threshold
+
+        self.smart: Dict[str, WalletStats] = {}
+        self.prices: Dict[str, Dict[str, Any]] = {}
+        self.flows: Dict[str, Dict[str, Any]] = {}
+        self.refreshed_ts = 0
+        self.refresh_ms = 0.0
+        # background refresh failures: while last_error_ts > refreshed_ts the snapshot is stale
+        self.refresh_errors = 0
+        self.last_error: Optional[str] = None
+        self.last_error_ts = 0
+
+    def _load_smart(self) -> Dict[str, WalletStats]:
+        out: Dict[str, WalletStats] = {}
+        for ws in self.reader.iter_wallet_stats():
+            if is_smart(ws, self.smart_min_trades, self.smart_min_volume_usd, self.smart_score_threshold):
+                out[ws.wallet] = ws
+        return out
+
+    def _load_price(self, condition_id: str) -> Optional[Dict[str, Any]]:
+        store = self.reader.store_for(condition_id)
+        ts = store.get_json(LMDBStore.k_last_price_ts(condition_id))
+        if ts is None:
+            return None
+        return store.get_json(f"price:{condition_id}:{int(ts):010d}")
+
+    def refresh(self) -> None:
+        t0 = time.perf_counter()
+        smart = self._load_smart()
+        bitmaps = self.reader.bitmaps_for(smart)
+        prices: Dict[str, Dict[str, Any]] = {}
+        flows: Dict[str, Dict[str, Any]] = {}
+        now = int(time.time())
+        by_shard: List[List[str]] = [[] for _ in self.reader.stores]
+        for cid in self.condition_ids:
+            p = self._load_price(cid)
+            if p is not None:
+                prices[cid] = p
+            by_shard[self.reader.shard_index(cid)].append(cid)
+        # one pass over each shard's recent trade index yields every market's flow
+        for i, cids in enumerate(by_shard):
+            if not cids:
+                continue
+            part = smart_flow_universe(
+                self.reader.stores[i],
+                self.windows,
+                smart_min_trades=self.smart_min_trades,
+                smart_min_volume_usd=self.smart_min_volume_usd,
+                smart_score_threshold=self.smart_score_threshold,
+                now=now,
+                smart_wallets=bitmaps[i],
+                condition_ids=cids,
+            )
+            flows.update(part)
+        flows = {cid: flows[cid] for cid in self.condition_ids}
+        self.smart, self.prices, self.flows = smart, prices, flows
+        self.refreshed_ts = now
+        self.refresh_ms = (time.perf_counter() - t0) * 1000.0
+
+    def run_refresher(self, interval_sec: float, stop: threading.Event) -> None:
+        while not stop.wait(interval_sec):
+            try:
+                self.refresh()
+            except Exception as e:
+                # keep serving the previous snapshot (reported stale by /healthz); next tick retries
+                self.refresh_errors += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                self.last_error_ts = int(time.time())
+                print(f"pmsf serve: refresh failed: {self.last_error}", file=sys.stderr, flush=True)
+
+    @property
+    def stale(self) -> bool:
+        return self.last_error_ts > self.refreshed_ts
+
+    # -------- queries --------
+    def wallet(self, addr: str) -> Optional[Dict[str, Any]]:
+        addr = addr.lower()
+        ws = self.smart.get(addr)
+        smart = ws is not None
+        if ws is None:
+            ws = self.reader.wallet_stats(addr)
+        if ws is None:
+            return None
+        d = asdict(ws)
+        d["smart"] = smart
+        for h in d["horizons"]:
+            h["variance"] = h["m2"] / (h["count"] - 1) if h["count"] > 1 else 0.0
+        return d
+
+    def universe_flows(self) -> List[Dict[str, Any]]:
+        flows = list(self.flows.values())
+        flows.sort(key=lambda f: abs(f["windows"][0]["smart_net_usd"]) if f["windows"] else 0.0, reverse=True)
+        return flows
+
+
+def _route(cache: WarmCache, path: str) -> Tuple[int, Any]:
+    parts = [p for p in path.split("?", 1)[0].split("/") if p]
+    if parts == ["healthz"]:
+        # 503 while the background refresh keeps failing: the data served is stale
+        return 503 if cache.stale else 200, {
+            "ok": not cache.stale,
+            "refreshed_ts": cache.refreshed_ts,
+            "refresh_ms": cache.refresh_ms,
+            "refresh_errors": cache.refresh_errors,
+            "last_error": cache.last_error,
+            "last_error_ts": cache.last_error_ts,
+            "markets": len(cache.flows),
+            "smart_wallets": len(cache.smart),
+        }
+    if parts == ["universe", "flows"]:
+        return 200, cache.universe_flows()
+    if parts == ["smart"]:
+        return 200, sorted(cache.smart)
+    if len(parts) == 2:
+        kind, arg = parts
+        if kind == "flow":
+            obj = cache.flows.get(arg)
+        elif kind == "price":
+            obj = cache.prices.get(arg)
+        elif kind == "wallet":
+            obj = cache.wallet(arg)
+        else:
+            return 404, {"error": "unknown route"}
+        if obj is None:
+            return 404, {"error": f"{kind} not found: {arg}"}
+        return 200, obj
+    return 404, {"error": "unknown route"}
+
+
+def make_handler(cache: WarmCache) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # one buffered write per response; avoids Nagle/delayed-ACK stalls on keep-alive
+        wbufsize = 64 * 1024
+
+        def do_GET(self) -> None:
+            status, obj = _route(cache, self.path)
+            body = orjson.dumps(obj)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return Handler
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self) -> Tuple[Any, Any]:
+        # BaseHTTPRequestHandler expects an (host, port)-like client address
+        sock, _ = super().get_request()
+        return sock, ("unix", 0)
+
+
+def make_server(cache: WarmCache, host: str = "127.0.0.1", port: int = 8787, unix_socket: Optional[str] = None):
+    handler = make_handler(cache)
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        return UnixHTTPServer(unix_socket, handler)
+    return ThreadingHTTPServer((host, port), handler)
@@ -0,0 +1,383 @@
+from __future__ import annotations
+
+import bisect
+import hashlib
+import heapq
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import orjson
+
+from .dirty import forget_market, mark_dirty
+from .features import trade_wallet
+from .flow import NO_WID, pack_trade_index, smart_flow_multi, unpack_trade_index
+from .scorer import is_smart, migrate_legacy_wallet_stats, wallet_key_stats
+from .storage_lmdb import LMDBStore
+from .tradecache import mark_tail_reset
+from .types import WalletStats
+from .wallet_ids import WalletBitmap, WalletIds, wallet_ids
+from .wallet_stats import decode_wallet_stats, encode_wallet_stats, merge_wallet_stats
+
+# Key families owned by a market, as (prefix, index of the conditionId field when the key
+# is split on ":"). Everything here moves with the market when shards are rebalanced.
+# Wallet stats are not listed: each shard holds partial stats for its own markets and
+# readers merge them, so they only move when a shard is retired. Wallet ids are per
+# shard too; moved trades, flow buckets, trade index entries and positions are re-interned
+# in the destination.
+MARKET_KEY_FAMILIES: List[Tuple[str, int]] = [
+    ("trade:", 1),
+    ("price:", 1),
+    ("cum:", 1),
+    ("mflow:", 1),
+    ("tidx:", 2),
+    ("pos:", 1),
+    ("wpos:", 2),
+    ("qsk:", 1),
+    ("hll:", 1),
+    ("mq:", 2),
+    ("tailreset:", 1),
+    ("idx:market:", 2),
+]
+
+# Market families whose keys embed a shard-local wallet id, and the id's field index.
+WID_KEY_FIELD: Dict[str, int] = {"mflow:": 3, "pos:": 2, "wpos:": 1}
+
+
+def _h64(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of conditionIds onto n shards (vnodes points per shard).
+    Going from n to n+1 shards moves only ~1/(n+1) of the markets.
+    """
+
+    def __init__(self, n_shards: int, vnodes: int = 64) -> None:
+        if n_shards < 1:
+            raise ValueError("n_shards must be >= 1")
+        self.n_shards = n_shards
+        points = sorted((_h64(f"shard-{i}#{v}"), i) for i in range(n_shards) for v in range(vnodes))
+        self._keys = [p for p, _ in points]
+        self._shards = [s for _, s in points]
+
+    def shard_for(self, condition_id: str) -> int:
+        if self.n_shards == 1:
+            return 0
+        i = bisect.bisect(self._keys, _h64(condition_id.lower())) % len(self._keys)
+        return self._shards[i]
+
+
+def shard_path(base: Path, shard: int, n_shards: int) -> Path:
+    """
+    LMDB dir of a shard: the configured path itself when unsharded,
+    otherwise a sibling "<name>-shardNN<suffix>" (polymarket-shard03.lmdb).
+    """
+    if n_shards <= 1:
+        return base
+    return base.with_name(f"{base.stem}-shard{shard:02d}{base.suffix}")
+
+
+def shard_markets(markets: Sequence[Dict[str, Any]], ring: HashRing, shard: int) -> List[Dict[str, Any]]:
+    return [m for m in markets if ring.shard_for(m["conditionId"]) == shard]
+
+
+class ShardedReader:
+    """
+    Read layer over every shard's LMDB. Market data is read from the owning shard;
+    wallet stats are merged across shards (counts summed, Welford states combined),
+    so scores and rankings are global.
+    """
+
+    def __init__(
+        self,
+        stores: Sequence[LMDBStore],
+        windows: Sequence[int],
+        weights: Sequence[float] = (),
+        use_ewm: bool = False,
+    ) -> None:
+        self.stores = list(stores)
+        self.ring = HashRing(len(self.stores))
+        self.windows = [int(w) for w in windows]
+        self.weights = list(weights)
+        self.use_ewm = use_ewm
+        self.ids = [wallet_ids(s) for s in self.stores]
+
+    @classmethod
+    def open(
+        cls,
+        base: Path,
+        n_shards: int,
+        windows: Sequence[int],
+        weights: Sequence[float] = (),
+        use_ewm: bool = False,
+        readonly: bool = True,
+        opener: Optional[Callable[[Path], LMDBStore]] = None,
+    ) -> "ShardedReader":
+        """
+        Open every shard read-only, or through opener (a writer's store factory, so its
+        durability and change log settings apply to the shards it writes to).
+        """
+        paths = [shard_path(base, i, n_shards) for i in range(n_shards)]
+        stores = [opener(p) if opener is not None else LMDBStore(p, readonly=readonly) for p in paths]
+        return cls(stores, windows, weights, use_ewm)
+
+    def close(self) -> None:
+        for s in self.stores:
+            s.close()
+
+    def shard_index(self, condition_id: str) -> int:
+        return self.ring.shard_for(condition_id)
+
+    def store_for(self, condition_id: str) -> LMDBStore:
+        return self.stores[self.shard_index(condition_id)]
+
+    def _merge(self, parts: List[WalletStats]) -> WalletStats:
+        ws = parts[0]
+        for p in parts[1:]:
+            ws = merge_wallet_stats(ws, p, self.windows, self.weights, self.use_ewm)
+        return ws
+
+    def wallet_stats(self, wallet: str) -> Optional[WalletStats]:
+        parts = []
+        for s, ids in zip(self.stores, self.ids):
+            wid = ids.lookup(wallet)
+            ws = decode_wallet_stats(wallet, s.get(wallet_key_stats(wid))) if wid is not None else None
+            if ws is not None:
+                parts.append(ws)
+        return self._merge(parts) if parts else None
+
+    def _iter_shard(self, i: int) -> Iterator[Tuple[str, int, int, Optional[WalletStats]]]:
+        # every interned wallet, scored or not: its trades may sit in a shard that holds no stats for it
+        store = self.stores[i]
+        for addr, wid in self.ids[i].iter_addresses():
+            yield addr, i, wid, decode_wallet_stats(addr, store.get(wallet_key_stats(wid)))
+
+    def _iter_merged(self) -> Iterator[Tuple[WalletStats, List[Tuple[int, int]]]]:
+        """
+        (merged stats, [(shard, wallet id in that shard)]) per wallet, in address order.
+        Each shard's "wid:a:" range is sorted by address, so this is a streaming k-way
+        merge with O(shards) memory.
+        """
+        cur: Optional[str] = None
+        parts: List[WalletStats] = []
+        where: List[Tuple[int, int]] = []
+        for addr, i, wid, ws in heapq.merge(*(self._iter_shard(i) for i in range(len(self.stores)))):
+            if addr != cur:
+                if parts:
+                    yield self._merge(parts), where
+                cur, parts, where = addr, [], []
+            if ws is not None:
+                parts.append(ws)
+            where.append((i, wid))
+        if parts:
+            yield self._merge(parts), where
+
+    def iter_wallet_stats(self) -> Iterator[WalletStats]:
+        """
+        All wallets, merged across shards, in address order.
+        """
+        for ws, _ in self._iter_merged():
+            yield ws
+
+    def smart_bitmaps(self, min_trades: int, min_vol_usd: float, score_threshold: float) -> List[WalletBitmap]:
+        """
+        Ids of wallets that are smart on merged stats, as one bitmap per shard
+        (ids are per shard), for smart_flow_multi(smart_wallets=...).
+        """
+        out = [WalletBitmap() for _ in self.stores]
+        for ws, where in self._iter_merged():
+            if is_smart(ws, min_trades, min_vol_usd, score_threshold):
+                for i, wid in where:
+                    out[i].add(wid)
+        return out
+
+    def bitmaps_for(self, wallets: Iterable[str]) -> List[WalletBitmap]:
+        out = [WalletBitmap() for _ in self.stores]
+        for w in wallets:
+            for i, ids in enumerate(self.ids):
+                wid = ids.lookup(w)
+                if wid is not None:
+                    out[i].add(wid)
+        return out
+
+    def top_wallets(
+        self, n: int, min_trades: int = 0, min_vol_usd: float = 0.0, score_threshold: float = float("-inf")
+    ) -> List[WalletStats]:
+        """
+        Global ranking by merged score, keeping only the best n in memory.
+        """
+        eligible = (ws for ws in self.iter_wallet_stats() if is_smart(ws, min_trades, min_vol_usd, score_threshold))
+        return heapq.nlargest(n, eligible, key=lambda ws: ws.score)
+
+    def smart_flow_market(
+        self,
+        condition_id: str,
+        windows: Sequence[int],
+        smart: Sequence[WalletBitmap],
+        now: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        i = self.shard_index(condition_id)
+        return smart_flow_multi(
+            self.stores[i],
+            condition_id,
+            windows,
+            smart_min_trades=0,
+            smart_min_volume_usd=0.0,
+            smart_score_threshold=0.0,
+            now=now,
+            smart_wallets=smart[i],
+        )
+
+
+def _key_cid(key: str, field: int) -> str:
+    parts = key.split(":", field + 1)
+    return parts[field] if len(parts) > field else ""
+
+
+def _reintern_trades(src_ids: WalletIds, dst_ids: WalletIds, items: List[Tuple[str, bytes]]) -> List[Tuple[str, bytes]]:
+    """
+    Rewrite the wallet id of trade records for the destination shard's dictionary.
+    """
+    trades = [orjson.loads(v) for _, v in items]
+    addrs = [(src_ids.address(t["wid"]) if "wid" in t else None) or trade_wallet(t) for t in trades]
+    wids = dst_ids.intern_many(a for a in addrs if a)
+    out = []
+    for (k, _), t, a in zip(items, trades, addrs):
+        if a:
+            t["wid"] = wids[a]
+        out.append((k, orjson.dumps(t)))
+    return out
+
+
+def _reintern_key_wid(
+    src_ids: WalletIds, dst_ids: WalletIds, items: List[Tuple[str, bytes]], field: int
+) -> List[Tuple[str, bytes]]:
+    """
+    Rewrite the wallet id held in key field `field` (keys split on ":") for the destination shard.
+    The key cannot be kept without its wallet, so an id the source can't resolve fails the
+    move (before anything of the batch is written or deleted).
+    """
+    parts = [k.split(":") for k, _ in items]
+    addrs = [src_ids.address(int(p[field], 16)) for p in parts]
+    missing = [k for (k, _), a in zip(items, addrs) if not a]
+    if missing:
+        raise ValueError(f"{len(missing)} key(s) hold a wallet id unknown to the source shard, e.g. {missing[0]}")
+    wids = dst_ids.intern_many(addrs)
+    out = []
+    for p, (_, v), a in zip(parts, items, addrs):
+        p[field] = f"{wids[a]:08x}"
+        out.append((":".join(p), v))
+    return out
+
+
+def _reintern_trade_index(
+    src_ids: WalletIds, dst_ids: WalletIds, items: List[Tuple[str, bytes]]
+) -> List[Tuple[str, bytes]]:
+    """
+    Rewrite the wallet id of global trade index entries for the destination shard.
+    """
+    rows = [(k, unpack_trade_index(v)) for k, v in items]
+    addrs = [src_ids.address(wid) if wid != NO_WID else None for _, (wid, _, _) in rows]
+    wids = dst_ids.intern_many(a for a in addrs if a)
+    return [
+        (k, pack_trade_index(wids[a] if a else NO_WID, signed, usd)) for (k, (_, signed, usd)), a in zip(rows, addrs)
+    ]
+
+
+def rebalance(
+    base: Path,
+    old_shards: int,
+    new_shards: int,
+    windows: Sequence[int],
+    weights: Sequence[float] = (),
+    use_ewm: bool = False,
+    batch: int = 10_000,
+    changelog: bool = False,
+    changelog_keep: int = 0,
+) -> Dict[str, int]:
+    """
+    Move market-owned keys to their shard under a new shard count. Only markets whose
+    ring position changed are copied (then deleted from the source). Shards that no
+    longer exist (shrinking, or leaving the unsharded path) fold their partial wallet
+    stats into shard 0. Run it with the collectors/scorers of all shards stopped, and
+    with their change log setting, so replicas of the shards follow the moves.
+    Returns {"markets_moved", "keys_moved", "wallets_merged"}.
+    """
+    src_paths = [shard_path(base, i, old_shards) for i in range(old_shards)]
+    dst_paths = [shard_path(base, i, new_shards) for i in range(new_shards)]
+    stores: Dict[Path, LMDBStore] = {
+        p: LMDBStore(p, changelog=changelog, changelog_keep=changelog_keep) for p in dict.fromkeys(src_paths + dst_paths)
+    }
+    ring = HashRing(new_shards)
+    moved_markets: Dict[str, Path] = {}  # cid -> source shard
+    keys_moved = 0
+    wallets_merged = 0
+
+    def move(src: LMDBStore, dst: LMDBStore, prefix: str, items: List[Tuple[str, bytes]]) -> int:
+        out = items
+        if prefix == "trade:":
+            out = _reintern_trades(wallet_ids(src), wallet_ids(dst), items)
+        elif prefix in WID_KEY_FIELD:
+            out = _reintern_key_wid(wallet_ids(src), wallet_ids(dst), items, WID_KEY_FIELD[prefix])
+        elif prefix == "tidx:":
+            out = _reintern_trade_index(wallet_ids(src), wallet_ids(dst), items)
+        dst.write_batch(out)
+        src.delete_batch(k for k, _ in items)
+        return len(items)
+
+    try:
+        for sp in src_paths:
+            src = stores[sp]
+            for prefix, field in MARKET_KEY_FAMILIES:
+                pending: Dict[Path, List[Tuple[str, bytes]]] = {}
+                for k, v in src.scan_prefix(prefix):
+                    cid = _key_cid(k, field)
+                    dp = dst_paths[ring.shard_for(cid)]
+                    if dp == sp:
+                        continue
+                    items = pending.setdefault(dp, [])
+                    items.append((k, bytes(v)))
+                    moved_markets[cid] = sp
+                    if len(items) >= batch:
+                        keys_moved += move(src, stores[dp], prefix, items)
+                        pending[dp] = []
+                for dp, items in pending.items():
+                    keys_moved += move(src, stores[dp], prefix, items)
+
+            # the change feed is per store: moved markets show up as changed on their new shard
+            mine = [cid for cid, p in moved_markets.items() if p == sp]
+            with src.write_txn() as txn:
+                last = {cid: forget_market(txn, cid) for cid in mine}
+            for cid in mine:
+                with stores[dst_paths[ring.shard_for(cid)]].write_txn() as txn:
+                    mark_tail_reset(txn, cid, mark_dirty(txn, cid, last[cid] or 0))
+
+            if sp in dst_paths:
+                continue
+            # retired shard: its wallet stats cover trades now living elsewhere; merge them into shard 0
+            migrate_legacy_wallet_stats(src, windows, weights, use_ewm)
+            dst = stores[dst_paths[0]]
+            src_ids, dst_ids = wallet_ids(src), wallet_ids(dst)
+            stats = [(k, bytes(v)) for k, v in src.scan_prefix("wstats:")]
+            for j in range(0, len(stats), batch):
+                chunk = stats[j : j + batch]
+                addrs = [src_ids.address(int(k[len("wstats:") :], 16)) or "" for k, _ in chunk]
+                wids = dst_ids.intern_many(a for a in addrs if a)
+                items = []
+                for (k, v), wallet in zip(chunk, addrs):
+                    ws = decode_wallet_stats(wallet, v)
+                    if not wallet or ws is None:
+                        continue
+                    key = wallet_key_stats(wids[wallet])
+                    cur = decode_wallet_stats(wallet, dst.get(key))
+                    if cur is not None:
+                        ws = merge_wallet_stats(cur, ws, windows, weights, use_ewm)
+                    items.append((key, encode_wallet_stats(ws)))
+                    wallets_merged += 1
+                dst.write_batch(items)
+                src.delete_batch(k for k, _ in chunk)
+    finally:
+        for s in stores.values():
+            s.close()
+    return {"markets_moved": len(moved_markets), "keys_moved": keys_moved, "wallets_merged": wallets_merged}
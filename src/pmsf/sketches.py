@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import struct
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+import lmdb
+import orjson
+
+from .features import trade_usd_abs, trade_wallet
+from .storage_lmdb import LMDBStore, Reader
+
+# Per-market streaming sketches, updated at ingest in the trades' write txn:
+#   qsk:{cid}:size             -> KLL quantile sketch of trade size (shares)
+#   qsk:{cid}:usd              -> KLL quantile sketch of trade notional (USD)
+#   hll:{cid}:{hour:08d}       -> HyperLogLog of the distinct wallets trading in that hour
+# Both are constant size per market (hour buckets older than HLL_RETENTION_SEC are
+# dropped), so "is this trade unusually large" and "how many wallets traded" never need
+# the trades themselves. Sketches are insert-only: a re-ingested trade key is not counted
+# again, and rebuild_sketches replays a market from its stored trades.
+KLL_K = 400  # ~3KB per sketch; p99 lands within about +-0.2% in rank
+HLL_P = 10  # 1024 registers, relative error ~1.04/sqrt(1024) = 3.3%
+HLL_BUCKET_SEC = 3600
+HLL_RETENTION_SEC = 7 * 86400
+
+_KLL_HEAD = struct.Struct("<HHQ")  # k, levels, n
+_U32 = struct.Struct("<I")
+
+
+def k_quantile_sketch(condition_id: str, metric: str) -> str:
+    return f"qsk:{condition_id}:{metric}"
+
+
+def k_hll(condition_id: str, hour: int) -> str:
+    return f"hll:{condition_id}:{hour:08d}"
+
+
+class KLLSketch:
+    """
+    KLL quantile sketch: a stack of compactors, level h holding items of weight 2^h.
+    A full level is sorted and every other item (random offset) is promoted, so size
+    stays O(k) whatever the stream length, with rank error ~1.7/k.
+    """
+
+    def __init__(self, k: int = KLL_K) -> None:
+        self.k = int(k)
+        self.n = 0
+        self.levels: List[List[float]] = [[]]
+
+    def _capacity(self, h: int) -> int:
+        depth = len(self.levels) - 1 - h
+        return max(2, int(math.ceil(self.k * (2.0 / 3.0) ** depth)))
+
+    def update(self, x: float) -> None:
+        self.levels[0].append(float(x))
+        self.n += 1
+        if len(self.levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def _compress(self) -> None:
+        for h in range(len(self.levels)):
+            if len(self.levels[h]) < self._capacity(h):
+                continue
+            if h + 1 == len(self.levels):
+                self.levels.append([])
+            buf = sorted(self.levels[h])
+            keep = [buf.pop()] if len(buf) % 2 else []
+            # pseudo-random offset from the stream position: unbiased, yet reproducible
+            coin = (((self.n + h) * 0x9E3779B1) >> 16) & 1
+            self.levels[h + 1].extend(buf[coin::2])
+            self.levels[h] = keep
+
+    def _weighted(self) -> List[Tuple[float, int]]:
+        return sorted((x, 1 << h) for h, lv in enumerate(self.levels) for x in lv)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Approximate q-quantile (0 <= q <= 1), or None while empty.
+        """
+        if self.n == 0:
+            return None
+        target = max(0.0, min(1.0, q)) * self.n
+        cum = 0
+        items = self._weighted()
+        for x, w in items:
+            # an item of weight w stands for the w ranks around it: compare at its midpoint
+            if cum + w / 2.0 >= target:
+                return x
+            cum += w
+        return items[-1][0]
+
+    def rank(self, x: float) -> float:
+        """
+        Approximate fraction of the stream <= x.
+        """
+        if self.n == 0:
+            return 0.0
+        return sum(w for v, w in self._weighted() if v <= x) / self.n
+
+    def to_bytes(self) -> bytes:
+        head = _KLL_HEAD.pack(self.k, len(self.levels), self.n)
+        sizes = b"".join(_U32.pack(len(lv)) for lv in self.levels)
+        return head + sizes + array("f", [x for lv in self.levels for x in lv]).tobytes()
+
+    @classmethod
+    def from_bytes(cls, b: bytes) -> "KLLSketch":
+        k, n_levels, n = _KLL_HEAD.unpack_from(b)
+        sk = cls(k)
+        sk.n = n
+        off = _KLL_HEAD.size
+        sizes = [_U32.unpack_from(b, off + 4 * i)[0] for i in range(n_levels)]
+        vals = array("f")
+        vals.frombytes(bytes(b[off + 4 * n_levels :]))
+        sk.levels = []
+        i = 0
+        for s in sizes:
+            sk.levels.append(list(vals[i : i + s]))
+            i += s
+        return sk
+
+
+def wallet_hash(address: str) -> int:
+    return int.from_bytes(hashlib.blake2b(address.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class HyperLogLog:
+    """
+    Distinct-count sketch over 64-bit hashes with 2^p one-byte registers. Mergeable
+    (register-wise max), so per-hour sketches union into any window. Stored sparse
+    (index, value pairs) while few registers are set.
+    """
+
+    def __init__(self, p: int = HLL_P) -> None:
+        self.p = int(p)
+        self.m = 1 << self.p
+        self.registers = bytearray(self.m)
+
+    def add(self, h: int) -> None:
+        idx = h >> (64 - self.p)
+        w = (h << self.p) & 0xFFFFFFFFFFFFFFFF
+        rho = min(64 - self.p + 1, 65 - w.bit_length()) if w else 64 - self.p + 1
+        if rho > self.registers[idx]:
+            self.registers[idx] = rho
+
+    def merge(self, other: "HyperLogLog") -> None:
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> float:
+        m = self.m
+        alpha = 0.7213 / (1.0 + 1.079 / m)
+        est = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if est <= 2.5 * m and zeros:
+            est = m * math.log(m / zeros)  # linear counting for small cardinalities
+        return est
+
+    def to_bytes(self) -> bytes:
+        nz = [(i, r) for i, r in enumerate(self.registers) if r]
+        if 3 * len(nz) < self.m:
+            return bytes([self.p, 1]) + b"".join(struct.pack("<HB", i, r) for i, r in nz)
+        return bytes([self.p, 0]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, b: bytes) -> "HyperLogLog":
+        b = bytes(b)
+        h = cls(b[0])
+        if b[1] == 1:
+            for i, r in struct.iter_unpack("<HB", b[2:]):
+                h.registers[i] = r
+        else:
+            h.registers[:] = b[2:]
+        return h
+
+
+class SketchDelta:
+    """
+    New trades of one market over a batch, folded into its sketches in the caller's write txn.
+    """
+
+    def __init__(self) -> None:
+        self.sizes: List[float] = []
+        self.usds: List[float] = []
+        self.hours: Dict[int, List[int]] = {}
+
+    def add(self, trade: Dict[str, Any], ts: int) -> None:
+        try:
+            size = abs(float(trade.get("size")))
+        except (TypeError, ValueError):
+            return
+        self.sizes.append(size)
+        self.usds.append(trade_usd_abs(trade))
+        w = trade_wallet(trade)
+        if w and ts > 0:
+            self.hours.setdefault(ts // HLL_BUCKET_SEC, []).append(wallet_hash(w))
+
+    def apply(self, txn: lmdb.Transaction, condition_id: str) -> None:
+        for metric, vals in (("size", self.sizes), ("usd", self.usds)):
+            if not vals:
+                continue
+            k = k_quantile_sketch(condition_id, metric).encode("utf-8")
+            cur = txn.get(k)
+            sk = KLLSketch.from_bytes(cur) if cur is not None else KLLSketch()
+            for x in vals:
+                sk.update(x)
+            txn.put(k, sk.to_bytes())
+        for hour, hashes in self.hours.items():
+            k = k_hll(condition_id, hour).encode("utf-8")
+            cur = txn.get(k)
+            hll = HyperLogLog.from_bytes(cur) if cur is not None else HyperLogLog()
+            for h in hashes:
+                hll.add(h)
+            txn.put(k, hll.to_bytes())
+        if self.hours:
+            _prune_hll(txn, condition_id, max(self.hours) - HLL_RETENTION_SEC // HLL_BUCKET_SEC)
+        self.sizes, self.usds, self.hours = [], [], {}
+
+
+def _prune_hll(txn: lmdb.Transaction, condition_id: str, before_hour: int) -> None:
+    pref = f"hll:{condition_id}:".encode("utf-8")
+    stop = k_hll(condition_id, max(0, before_hour)).encode("utf-8")
+    cur = txn.cursor()
+    if not cur.set_range(pref):
+        return
+    old = []
+    for k in cur.iternext(keys=True, values=False):
+        if not k.startswith(pref) or k >= stop:
+            break
+        old.append(k)
+    for k in old:
+        txn.delete(k)
+
+
+def load_quantile_sketch(store: Reader, condition_id: str, metric: str = "usd") -> Optional[KLLSketch]:
+    b = store.get(k_quantile_sketch(condition_id, metric))
+    return KLLSketch.from_bytes(b) if b is not None else None
+
+
+def trade_quantile(store: Reader, condition_id: str, q: float, metric: str = "usd") -> Optional[float]:
+    """
+    Approximate q-quantile of the market's trade size ("size") or notional ("usd").
+    """
+    sk = load_quantile_sketch(store, condition_id, metric)
+    return sk.quantile(q) if sk is not None else None
+
+
+def distinct_wallets(store: Reader, condition_id: str, window_sec: int, now: int) -> int:
+    """
+    Approximate number of distinct wallets that traded the market over the last
+    window_sec (hour resolution: the partial oldest hour counts whole).
+    """
+    hll = HyperLogLog()
+    first = (int(now) - int(window_sec)) // HLL_BUCKET_SEC
+    with store.txn() as tx:
+        for k, v in tx.scan(f"hll:{condition_id}:", start=k_hll(condition_id, max(0, first))):
+            hll.merge(HyperLogLog.from_bytes(v))
+    return int(round(hll.count()))
+
+
+def rebuild_sketches(store: LMDBStore, condition_id: str, batch: int = 50_000) -> int:
+    """
+    Recompute a market's sketches from its stored trades. Returns trades replayed.
+    """
+    store.delete_batch(
+        [k for k, _ in store.scan_prefix(f"qsk:{condition_id}:")]
+        + [k for k, _ in store.scan_prefix(f"hll:{condition_id}:")]
+    )
+    delta = SketchDelta()
+    n = 0
+    for k, v in store.scan_prefix(f"trade:{condition_id}:"):
+        delta.add(orjson.loads(v), int(k.split(":")[2]))
+        n += 1
+        if n % batch == 0:
+            with store.write_txn() as txn:
+                delta.apply(txn, condition_id)
+    with store.write_txn() as txn:
+        delta.apply(txn, condition_id)
+    return n
@@ -0,0 +1,296 @@
+from __future__ import annotations
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+import orjson
+from websockets.exceptions import ConnectionClosed, InvalidHandshake
+from websockets.sync.client import connect
+
+from .collector import _to_int_ts, ingest_trades, poll_gap, poll_live_once, poll_market
+from .polymarket_client import PolymarketClient, ReplayMiss
+from .scheduler import AdaptivePollScheduler
+from .storage_lmdb import LMDBStore
+
+# Polymarket real-time data service; the "activity/trades" topic carries Data API shaped trades.
+RTDS_URL = "wss://ws-live-data.polymarket.com"
+RTDS_SUBSCRIBE = {"action": "subscribe", "subscriptions": [{"topic": "activity", "type": "trades"}]}
+
+# Streamed trades use sequence numbers above any REST page position (offset < limit),
+# so a stream batch and a REST page landing on the same second never share a key. They
+# are ingested with dedupe: a trade the REST gap fill already stored is dropped, and the
+# rest take the next free seq of their second, read from the store (so a restarted
+# streamer continues after the stored keys instead of overwriting them).
+STREAM_SEQ_BASE = 100_000
+
+
+class TradeSource(ABC):
+    """
+    Something that feeds trades into LMDB via ingest_trades.
+    Subclasses implement run(); stop() may be called from another thread.
+    """
+
+    def __init__(self, store: LMDBStore, condition_ids: Iterable[str]) -> None:
+        self.store = store
+        self.condition_ids = list(condition_ids)
+        self._stop = threading.Event()
+
+    @abstractmethod
+    def run(self) -> None:
+        """
+        Feed trades until stop() is called.
+        """
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+
+class RestPollSource(TradeSource):
+    """
+    Pull source over the Data API /trades endpoint.
+
+    Adaptive (default): an AdaptivePollScheduler polls each market at a frequency learned
+    from its trade arrival rate, and each poll paginates forward (up to max_pages) until it
+    overlaps stored trades. Fixed (adaptive=False): page 0 of every market every interval_sec.
+    """
+
+    def __init__(
+        self,
+        store: LMDBStore,
+        condition_ids: Iterable[str],
+        limit: int,
+        interval_sec: float = 20.0,
+        client: Optional[PolymarketClient] = None,
+        adaptive: bool = True,
+        min_interval_sec: float = 5.0,
+        max_interval_sec: float = 600.0,
+        max_pages: int = 10,
+    ) -> None:
+        super().__init__(store, condition_ids)
+        self.limit = limit
+        self.interval_sec = interval_sec
+        self.client = client
+        self.adaptive = adaptive
+        self.max_pages = max_pages
+        self.scheduler = AdaptivePollScheduler(
+            self.condition_ids,
+            target_per_poll=max(1.0, limit / 2.0),
+            min_interval_sec=min_interval_sec,
+            max_interval_sec=max_interval_sec,
+            initial_interval_sec=interval_sec,
+        )
+        self.requests = 0
+        self.errors = 0
+        self.truncated = 0  # polls that ran out of pages inside a burst (resumed next time)
+        self.replay_misses = 0  # replay polls of a market with nothing recorded
+        self.failures: Dict[str, int] = defaultdict(int)  # other poll failures, per market
+        self.last_failure: Dict[str, BaseException] = {}
+
+    def poll_once(self) -> None:
+        for cid in self.condition_ids:
+            poll_live_once(self.store, cid, limit=self.limit, client=self.client)
+
+    def poll_due(self) -> int:
+        """
+        Poll every market that is due now. Returns how many were polled.
+        """
+        n = 0
+        while not self.stopped:
+            cid = self.scheduler.pop_due()
+            if cid is None:
+                break
+            n_new = 0
+            try:
+                n_new, _ = poll_market(self.store, cid, self.limit, self.client, max_pages=self.max_pages)
+                if poll_gap(self.store, cid) is not None:
+                    self.truncated += 1
+            except httpx.HTTPError:
+                self.errors += 1
+            except ReplayMiss:
+                # offline replay of a market that was never recorded: skip it, keep the rest going
+                self.replay_misses += 1
+            except Exception as e:
+                # a bad page (or a failed commit) of one market must not stop the others
+                self.errors += 1
+                self.failures[cid] += 1
+                self.last_failure[cid] = e
+            finally:
+                # pop_due removed the market: always put it back on the schedule
+                self.requests += 1
+                self.scheduler.observe(cid, n_new)
+            n += 1
+        return n
+
+    def run(self) -> None:
+        own_client = self.client is None
+        if self.client is None:
+            self.client = PolymarketClient()
+        try:
+            while not self.stopped:
+                if not self.adaptive:
+                    self.poll_once()
+                    self._stop.wait(self.interval_sec)
+                    continue
+                self.poll_due()
+                due = self.scheduler.next_due()
+                if due is not None:
+                    self._stop.wait(max(0.0, due - time.monotonic()))
+        finally:
+            if own_client:
+                self.client.close()
+                self.client = None
+
+
+def extract_trades(raw: Any) -> List[Dict[str, Any]]:
+    """
+    Decode one feed message into a list of trade dicts.
+    Accepts a bare trade, a list of trades, or an envelope {"payload": trade | [trades]}.
+    Anything else (pongs, acks, garbage) yields [].
+    """
+    try:
+        msg = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return []
+    if isinstance(msg, dict) and "payload" in msg:
+        msg = msg["payload"]
+    if isinstance(msg, dict):
+        msg = [msg]
+    if not isinstance(msg, list):
+        return []
+    return [t for t in msg if isinstance(t, dict) and isinstance(t.get("conditionId"), str)]
+
+
+class WebSocketTradeSource(TradeSource):
+    """
+    Push source: stream trades from a WebSocket feed into LMDB in micro-batches.
+
+    - trades are buffered and flushed every flush_sec, or as soon as batch_max are pending
+    - on every (re)connect, a REST poll of each market (paginating up to max_pages) fills
+      whatever was missed while disconnected (gap_fill=False skips it, e.g. against a local fake feed)
+    - reconnects back off exponentially between reconnect_min_sec and reconnect_max_sec
+    """
+
+    def __init__(
+        self,
+        store: LMDBStore,
+        condition_ids: Iterable[str],
+        url: str = RTDS_URL,
+        limit: int = 200,
+        flush_sec: float = 1.0,
+        batch_max: int = 500,
+        gap_fill: bool = True,
+        subscribe: Optional[Dict[str, Any]] = None,
+        reconnect_min_sec: float = 1.0,
+        reconnect_max_sec: float = 60.0,
+        client: Optional[PolymarketClient] = None,
+        max_pages: int = 10,
+    ) -> None:
+        super().__init__(store, condition_ids)
+        self.url = url
+        self.max_pages = max_pages
+        self.limit = limit
+        self.flush_sec = flush_sec
+        self.batch_max = batch_max
+        self.gap_fill = gap_fill
+        self.subscribe = RTDS_SUBSCRIBE if subscribe is None else subscribe
+        self.reconnect_min_sec = reconnect_min_sec
+        self.reconnect_max_sec = reconnect_max_sec
+        self.client = client
+
+        self._wanted = set(self.condition_ids)
+        self._pending: List[Dict[str, Any]] = []
+
+        # counters, handy for monitoring and tests
+        self.trades_ingested = 0
+        self.batches_flushed = 0
+        self.reconnects = 0
+        self.last_flush_ts = 0.0
+
+    def flush(self) -> int:
+        """
+        Ingest pending trades, one write batch per market. Returns trades written.
+        """
+        pending, self._pending = self._pending, []
+        self.last_flush_ts = time.monotonic()
+        if not pending:
+            return 0
+        by_market: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for t in pending:
+            by_market[t["conditionId"]].append(t)
+        writes = [
+            ingest_trades(self.store, cid, trades, seq_start=STREAM_SEQ_BASE, dedupe=True)
+            for cid, trades in by_market.items()
+        ]
+        for w in writes:
+            w.result()  # one group commit for all markets; a failed one raises here
+        self.trades_ingested += len(pending)
+        self.batches_flushed += 1
+        return len(pending)
+
+    def fill_gaps(self) -> None:
+        """
+        Catch up through REST on trades newer than each market's last stored timestamp.
+        """
+        own_client = self.client is None
+        client = self.client or PolymarketClient()
+        try:
+            for cid in self.condition_ids:
+                poll_market(self.store, cid, self.limit, client, max_pages=self.max_pages)
+        finally:
+            if own_client:
+                client.close()
+
+    def _on_message(self, raw: Any) -> None:
+        for t in extract_trades(raw):
+            if self._wanted and t["conditionId"] not in self._wanted:
+                continue
+            try:
+                if _to_int_ts(t.get("timestamp")) <= 0:
+                    continue
+            except (TypeError, ValueError):
+                continue
+            self._pending.append(t)
+
+    def _pump(self, ws: Any) -> None:
+        self.last_flush_ts = time.monotonic()
+        while not self.stopped:
+            wait = max(0.0, self.last_flush_ts + self.flush_sec - time.monotonic())
+            try:
+                raw = ws.recv(timeout=wait)
+            except TimeoutError:
+                self.flush()
+                continue
+            self._on_message(raw)
+            if len(self._pending) >= self.batch_max or time.monotonic() - self.last_flush_ts >= self.flush_sec:
+                self.flush()
+
+    def run(self) -> None:
+        backoff = self.reconnect_min_sec
+        while not self.stopped:
+            try:
+                with connect(self.url, open_timeout=10) as ws:
+                    if self.subscribe:
+                        ws.send(orjson.dumps(self.subscribe).decode("utf-8"))
+                    # Fill after subscribing so trades arriving during the REST catch-up
+                    # are buffered by the socket rather than lost.
+                    if self.gap_fill:
+                        self.fill_gaps()
+                    backoff = self.reconnect_min_sec
+                    self._pump(ws)
+            except (OSError, TimeoutError, ConnectionClosed, InvalidHandshake, httpx.HTTPError):
+                pass
+            finally:
+                self.flush()
+            if self.stopped:
+                break
+            self.reconnects += 1
+            self._stop.wait(backoff)
+            backoff = min(self.reconnect_max_sec, backoff * 2)
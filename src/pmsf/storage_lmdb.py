@@ -1,9 +1,14 @@
 from __future__ import annotations
 
+import queue
+import struct
+import threading
 import time
+from concurrent.futures import Future
+from contextlib import contextmanager
 from dataclasses import asdict
 from pathlib import Path
-from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 import lmdb
 import orjson
@@ -19,6 +24,227 @@ def _dec(b: Optional[bytes]) -> Any:
     return orjson.loads(b)
 
 
+# Durability profiles -> (sync, metasync) env flags.
+#   full:       fsync data and metadata on every commit (LMDB default)
+#   nometasync: fsync data, flush the meta page lazily; a crash may lose the last commit,
+#               never corrupts the database
+#   nosync:     no fsync on commit; a background thread calls env.sync() every
+#               sync_interval_sec, bounding what a crash (of the machine, not the process) loses
+DURABILITY: Dict[str, Tuple[bool, bool]] = {
+    "full": (True, True),
+    "nometasync": (True, False),
+    "nosync": (False, False),
+}
+
+WriteJob = Callable[[lmdb.Transaction], Any]
+
+# Change log (opt-in): every write commit appends one record in the same txn, so the log
+# is exactly the committed history, in commit order.
+#   clog:seq          -> sequence number of the last record (u64 LE)
+#   clog:{seq:016x}   -> committed_at f64, n_ops u32, then per op:
+#                        op u8 (1 put, 2 delete), key len u32, value len u32, key, value
+# Only the newest `keep` records are retained (0 = all). See changefeed.py for consumers.
+CLOG_PREFIX = b"clog:"
+K_CLOG_SEQ = b"clog:seq"
+OP_PUT = 1
+OP_DEL = 2
+_U64 = struct.Struct("<Q")
+_CLOG_HEAD = struct.Struct("<dI")
+_CLOG_OP = struct.Struct("<BII")
+ChangeOp = Tuple[int, bytes, bytes]
+
+
+def k_changelog(seq: int) -> bytes:
+    return b"clog:%016x" % seq
+
+
+def encode_changes(ops: List[ChangeOp], committed_at: float) -> bytes:
+    parts = [_CLOG_HEAD.pack(committed_at, len(ops))]
+    for op, k, v in ops:
+        parts.append(_CLOG_OP.pack(op, len(k), len(v)))
+        parts.append(k)
+        parts.append(v)
+    return b"".join(parts)
+
+
+def decode_changes(b: bytes) -> Tuple[float, List[ChangeOp]]:
+    ts, n = _CLOG_HEAD.unpack_from(b)
+    off = _CLOG_HEAD.size
+    ops: List[ChangeOp] = []
+    for _ in range(n):
+        op, kl, vl = _CLOG_OP.unpack_from(b, off)
+        off += _CLOG_OP.size
+        k = bytes(b[off : off + kl])
+        off += kl
+        ops.append((op, k, bytes(b[off : off + vl])))
+        off += vl
+    return ts, ops
+
+
+def append_changelog(txn: lmdb.Transaction, ops: List[ChangeOp], keep: int = 0) -> int:
+    """
+    Append one record for ops to the log in the committing txn. Returns its sequence
+    number (0 if there was nothing to log).
+    """
+    if not ops:
+        return 0
+    b = txn.get(K_CLOG_SEQ)
+    seq = (_U64.unpack(b)[0] if b is not None else 0) + 1
+    txn.put(K_CLOG_SEQ, _U64.pack(seq))
+    txn.put(k_changelog(seq), encode_changes(ops, time.time()))
+    if keep > 0 and seq > keep:
+        stop = k_changelog(seq - keep + 1)
+        cur = txn.cursor()
+        if cur.set_range(k_changelog(0)):
+            while cur.key() < stop:
+                if not cur.delete():
+                    break
+    return seq
+
+
+class LoggedTxn:
+    """
+    Write txn that records its puts and deletes for the change log. Cursor writes are
+    not recorded: write through put/delete. Everything else is the raw txn's.
+    """
+
+    __slots__ = ("raw", "ops")
+
+    def __init__(self, raw: lmdb.Transaction, ops: List[ChangeOp]) -> None:
+        self.raw = raw
+        self.ops = ops
+
+    def put(self, key: bytes, value: bytes, **kw: Any) -> bool:
+        done = self.raw.put(key, value, **kw)
+        if done and not bytes(key[:5]) == CLOG_PREFIX:
+            self.ops.append((OP_PUT, bytes(key), bytes(value)))
+        return done
+
+    def delete(self, key: bytes, value: bytes = b"") -> bool:
+        done = self.raw.delete(key, value)
+        if done and not bytes(key[:5]) == CLOG_PREFIX:
+            self.ops.append((OP_DEL, bytes(key), b""))
+        return done
+
+    def get(self, key: bytes, default: Any = None) -> Any:
+        return self.raw.get(key, default)
+
+    def cursor(self) -> lmdb.Cursor:
+        return self.raw.cursor()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.raw, name)
+
+
+class GroupCommitter:
+    """
+    Coalesces write jobs from any thread into one LMDB commit per interval.
+
+    A job is a function of a write txn. The committer thread opens the group txn when a
+    job arrives, runs each job in a nested txn (a failing job is rolled back alone), keeps
+    taking jobs until interval_sec after the first one or max_jobs, then commits once.
+    Each job's Future resolves after that commit, so latency is bounded by interval_sec
+    plus one commit. Jobs must only use the txn they are given: opening another write txn
+    from a job deadlocks on the writer lock held by the group.
+    """
+
+    def __init__(
+        self,
+        env: lmdb.Environment,
+        interval_sec: float = 0.05,
+        max_jobs: int = 1000,
+        changelog_keep: Optional[int] = None,
+    ) -> None:
+        self.env = env
+        self.changelog_keep = changelog_keep  # None: no change log
+        self.interval_sec = float(interval_sec)
+        self.max_jobs = int(max_jobs)
+        self._q: "queue.Queue[Optional[Tuple[WriteJob, Future]]]" = queue.Queue()
+        self.commits = 0
+        self.jobs = 0
+        self.failed = 0
+        self.last_error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name="lmdb-group-commit", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: WriteJob) -> Future:
+        fut: Future = Future()
+        self._q.put((fn, fut))
+        return fut
+
+    def flush(self) -> None:
+        """
+        Block until everything submitted before this call is committed.
+        """
+        self.submit(lambda txn: None).result()
+
+    def close(self) -> None:
+        self._q.put(None)
+        self._thread.join()
+
+    def _run_job(
+        self,
+        txn: lmdb.Transaction,
+        job: Tuple[WriteJob, Future],
+        done: List[Tuple[Future, Any, Any]],
+        ops: List[ChangeOp],
+    ) -> None:
+        fn, fut = job
+        child = self.env.begin(write=True, parent=txn)
+        job_ops: List[ChangeOp] = []
+        try:
+            res = fn(child if self.changelog_keep is None else LoggedTxn(child, job_ops))
+        except BaseException as e:
+            child.abort()
+            self.failed += 1
+            self.last_error = e
+            done.append((fut, None, e))
+            return
+        child.commit()
+        ops.extend(job_ops)
+        done.append((fut, res, None))
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            job = self._q.get()
+            if job is None:
+                return
+            deadline = time.monotonic() + self.interval_sec
+            done: List[Tuple[Future, Any, Any]] = []
+            ops: List[ChangeOp] = []
+            txn = self.env.begin(write=True)
+            try:
+                self._run_job(txn, job, done, ops)
+                while len(done) < self.max_jobs:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        job = self._q.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if job is None:
+                        stopping = True
+                        break
+                    self._run_job(txn, job, done, ops)
+                if self.changelog_keep is not None:
+                    append_changelog(txn, ops, self.changelog_keep)
+                txn.commit()
+                self.commits += 1
+            except BaseException as e:
+                txn.abort()
+                self.failed += sum(1 for _, _, err in done if err is None)
+                self.last_error = e
+                done = [(fut, None, err or e) for fut, _, err in done]
+            self.jobs += len(done)
+            for fut, res, err in done:
+                if err is not None:
+                    fut.set_exception(err)
+                else:
+                    fut.set_result(res)
+
+
 class LMDBStore:
     """
     Simple LMDB wrapper:
@@ -26,27 +252,120 @@ class LMDBStore:
       - put/get json
       - prefix scan iterator
       - batch write via write_txn context
+      - multi-operation, zero-copy transactions via txn()
+      - durability profiles and optional group commit (submit())
+      - optional change log of every write commit (changelog=True, see changefeed.py)
     """
 
-    def __init__(self, path: Path, map_size: int = 2 * 1024**3) -> None:
+    def __init__(
+        self,
+        path: Path,
+        map_size: int = 2 * 1024**3,
+        readonly: bool = False,
+        durability: str = "full",
+        sync_interval_sec: float = 1.0,
+        group_commit_sec: float = 0.0,
+        group_commit_max: int = 1000,
+        changelog: bool = False,
+        changelog_keep: int = 0,
+    ) -> None:
         # 2GB by default; adjust later if needed
+        # readonly: reader-only env (query servers, exporters); never takes the writer lock
+        if durability not in DURABILITY:
+            raise ValueError(f"Unknown durability profile: {durability}")
+        self.readonly = readonly
+        self.durability = durability
+        self.changelog = changelog and not readonly
+        self.changelog_keep = int(changelog_keep)
+        sync, metasync = DURABILITY[durability]
         self.env = lmdb.open(
             str(path),
             map_size=map_size,
             subdir=True,
-            create=True,
+            create=not readonly,
+            readonly=readonly,
             lock=True,
             readahead=True,
             writemap=False,
             max_dbs=1,
+            sync=sync,
+            metasync=metasync,
         )
+        self._stop = threading.Event()
+        self._syncer: Optional[threading.Thread] = None
+        if not readonly and not sync:
+            self._syncer = threading.Thread(
+                target=self._sync_loop, args=(float(sync_interval_sec),), name="lmdb-sync", daemon=True
+            )
+            self._syncer.start()
+        self.committer: Optional[GroupCommitter] = None
+        if not readonly and group_commit_sec > 0:
+            self.committer = GroupCommitter(
+                self.env, group_commit_sec, group_commit_max, self.changelog_keep if self.changelog else None
+            )
+
+    def _sync_loop(self, interval_sec: float) -> None:
+        while not self._stop.wait(interval_sec):
+            self.env.sync(True)
+
+    def sync(self) -> None:
+        """
+        Force buffered commits to disk (only meaningful for the nosync / nometasync profiles).
+        """
+        self.env.sync(True)
+
+    def flush(self) -> None:
+        """
+        Wait until every submitted write job is committed.
+        """
+        if self.committer is not None:
+            self.committer.flush()
 
     def close(self) -> None:
+        if self.committer is not None:
+            self.committer.close()
+        self._stop.set()
+        if self._syncer is not None:
+            self._syncer.join()
+        if not self.readonly and self.durability != "full":
+            self.env.sync(True)
         self.env.close()
 
+    def submit(self, fn: WriteJob) -> Future:
+        """
+        Run fn(write_txn) as part of the next group commit and return its Future,
+        without waiting. Without group commit it runs (and commits) right away.
+        """
+        if self.committer is not None:
+            return self.committer.submit(fn)
+        fut: Future = Future()
+        with self._begin_write() as txn:
+            fut.set_result(fn(txn))
+        return fut
+
+    def write(self, fn: WriteJob) -> Any:
+        """
+        Run fn(write_txn) and return its result once committed. With group commit the
+        call shares the next group's commit and waits for it (read-your-writes).
+        """
+        if self.committer is not None:
+            return self.committer.submit(fn).result()
+        with self._begin_write() as txn:
+            return fn(txn)
+
+    @contextmanager
+    def _begin_write(self, buffers: bool = False) -> Iterator[Any]:
+        # every write txn of the store opens here, so the change log sees all of them
+        with self.env.begin(write=True, buffers=buffers) as raw:
+            if not self.changelog:
+                yield raw
+                return
+            ops: List[ChangeOp] = []
+            yield LoggedTxn(raw, ops)
+            append_changelog(raw, ops, self.changelog_keep)
+
     def put(self, key: str, value: bytes) -> None:
-        with self.env.begin(write=True) as txn:
-            txn.put(key.encode("utf-8"), value)
+        self.write(lambda txn: txn.put(key.encode("utf-8"), value))
 
     def get(self, key: str) -> Optional[bytes]:
         with self.env.begin(write=False) as txn:
@@ -59,17 +378,22 @@ class LMDBStore:
         return _dec(self.get(key))
 
     def delete(self, key: str) -> None:
-        with self.env.begin(write=True) as txn:
-            txn.delete(key.encode("utf-8"))
+        self.write(lambda txn: txn.delete(key.encode("utf-8")))
 
     def now_ts(self) -> int:
         return int(time.time())
 
-    def scan_prefix(self, prefix: str, limit: Optional[int] = None) -> Iterator[Tuple[str, bytes]]:
+    def scan_prefix(
+        self, prefix: str, limit: Optional[int] = None, start: Optional[str] = None
+    ) -> Iterator[Tuple[str, bytes]]:
+        """
+        Iterate keys under prefix in key order; start (a full key) seeks past earlier keys.
+        """
         pref = prefix.encode("utf-8")
+        first = start.encode("utf-8") if start is not None and start > prefix else pref
         with self.env.begin(write=False) as txn:
             cur = txn.cursor()
-            if not cur.set_range(pref):
+            if not cur.set_range(first):
                 return
             n = 0
             for k, v in cur:
@@ -80,16 +404,166 @@ class LMDBStore:
                 if limit is not None and n >= limit:
                     break
 
+    @contextmanager
+    def txn(self, write: bool = False) -> Iterator["StoreTxn"]:
+        """
+        One transaction for many operations (see StoreTxn). Values it returns are
+        zero-copy views into the map and are only valid inside the with block.
+        """
+        if write:
+            with self._begin_write(buffers=True) as wtxn:
+                yield StoreTxn(wtxn, True)
+            return
+        with self.env.begin(buffers=True) as txn:
+            yield StoreTxn(txn, False)
+
+    def keys(self, prefix: str, start: Optional[str] = None) -> Iterator[str]:
+        with self.txn() as tx:
+            for k in tx.keys(prefix, start):
+                yield bytes(k).decode("utf-8")
+
+    def count(self, prefix: str, start: Optional[str] = None) -> int:
+        with self.txn() as tx:
+            return tx.count(prefix, start)
+
+    @contextmanager
+    def write_txn(self) -> Iterator[lmdb.Transaction]:
+        """
+        Raw write transaction for read-modify-write sequences that must be atomic.
+        Keys/values are bytes; commits on normal exit, aborts on exception.
+        """
+        with self._begin_write() as txn:
+            yield txn
+
     def write_batch(self, items: Iterable[Tuple[str, bytes]]) -> None:
-        with self.env.begin(write=True) as txn:
+        def job(txn: lmdb.Transaction) -> None:
             for k, v in items:
                 txn.put(k.encode("utf-8"), v)
 
+        self.write(job)
+
+    def delete_batch(self, keys: Iterable[str]) -> None:
+        def job(txn: lmdb.Transaction) -> None:
+            for k in keys:
+                txn.delete(k.encode("utf-8"))
+
+        self.write(job)
+
     # Helpers for common keys
     @staticmethod
     def k_last_trade_ts(condition_id: str) -> str:
         return f"idx:market:{condition_id}:last_trade_ts"
 
+    @staticmethod
+    def k_poll_gap(condition_id: str) -> str:
+        return f"idx:market:{condition_id}:poll_gap"
+
     @staticmethod
     def k_last_price_ts(condition_id: str) -> str:
         return f"idx:market:{condition_id}:last_price_ts"
+
+    @staticmethod
+    def k_last_flow(condition_id: str) -> str:
+        return f"idx:market:{condition_id}:last_flow"
+
+
+class StoreTxn:
+    """
+    A transaction opened with buffers=True. Reads return memoryviews into the map
+    (no copy, no per-row allocation beyond the view); they must not outlive the txn.
+    Keys are passed as str and yielded as memoryviews by the scan helpers.
+    Has the read API of LMDBStore (get/get_json/scan_prefix/txn), so helpers written
+    against a store can run inside a caller's transaction.
+    """
+
+    def __init__(self, txn: lmdb.Transaction, write: bool = False) -> None:
+        self.raw = txn
+        self.write = write
+
+    @contextmanager
+    def txn(self, write: bool = False) -> Iterator["StoreTxn"]:
+        if write and not self.write:
+            raise RuntimeError("read-only transaction")
+        yield self
+
+    def get(self, key: str) -> Optional[memoryview]:
+        return self.raw.get(key.encode("utf-8"))
+
+    def get_json(self, key: str) -> Any:
+        return _dec(self.get(key))
+
+    def put(self, key: str, value: bytes) -> None:
+        self.raw.put(key.encode("utf-8"), value)
+
+    def put_json(self, key: str, obj: Any) -> None:
+        self.put(key, _enc(obj))
+
+    def delete(self, key: str) -> None:
+        self.raw.delete(key.encode("utf-8"))
+
+    def _cursor_at(self, prefix: bytes, start: Optional[str]) -> Optional[lmdb.Cursor]:
+        first = start.encode("utf-8") if start is not None and start.encode("utf-8") > prefix else prefix
+        cur = self.raw.cursor()
+        return cur if cur.set_range(first) else None
+
+    def scan(
+        self, prefix: str, start: Optional[str] = None, limit: Optional[int] = None
+    ) -> Iterator[Tuple[memoryview, memoryview]]:
+        """
+        (key, value) views under prefix in key order.
+        """
+        pref = prefix.encode("utf-8")
+        cur = self._cursor_at(pref, start)
+        if cur is None:
+            return
+        n = 0
+        for k, v in cur:
+            if k[: len(pref)] != pref:
+                break
+            yield k, v
+            n += 1
+            if limit is not None and n >= limit:
+                break
+
+    def scan_prefix(
+        self, prefix: str, limit: Optional[int] = None, start: Optional[str] = None
+    ) -> Iterator[Tuple[str, memoryview]]:
+        for k, v in self.scan(prefix, start, limit):
+            yield bytes(k).decode("utf-8"), v
+
+    def keys(self, prefix: str, start: Optional[str] = None) -> Iterator[memoryview]:
+        """
+        Key views under prefix; values are never fetched.
+        """
+        pref = prefix.encode("utf-8")
+        cur = self._cursor_at(pref, start)
+        if cur is None:
+            return
+        for k in cur.iternext(keys=True, values=False):
+            if k[: len(pref)] != pref:
+                break
+            yield k
+
+    def count(self, prefix: str, start: Optional[str] = None) -> int:
+        n = 0
+        for _ in self.keys(prefix, start):
+            n += 1
+        return n
+
+    def last(self, prefix: str) -> Optional[Tuple[memoryview, memoryview]]:
+        """
+        Greatest (key, value) under prefix, found by seeking past the prefix and stepping back.
+        """
+        pref = prefix.encode("utf-8")
+        cur = self.raw.cursor()
+        if cur.set_range(pref + b"\xff"):
+            ok = cur.prev()
+        else:
+            ok = cur.last()
+        if not ok or cur.key()[: len(pref)] != pref:
+            return None
+        return cur.key(), cur.value()
+
+
+# Anything with the read API: a store (one txn per call) or an open StoreTxn.
+Reader = Union[LMDBStore, StoreTxn]
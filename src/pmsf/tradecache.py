@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import math
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import lmdb
+import orjson
+
+from .dirty import market_gen
+from .features import trade_direction, trade_usd_abs, trade_yes_price
+from .storage_lmdb import LMDBStore, StoreTxn
+
+# Hot tail of each market's trades, decoded once and kept in process memory, in front of
+# the store: pricer (latest trade), trade-sourced smart flow (recent window) and the
+# maturity drain (trades whose horizons just came due) read it instead of LMDB + orjson.
+#   tailreset:{cid} -> generation (u64) at which ingest added or rewrote a trade keyed at
+#                      or before the market's newest trade key (backfill, rebalance)
+# A cached tail holds every trade of the market with ts >= since, in key order, as
+# parallel arrays (~29 bytes a trade), and is valid at the market generation it was read
+# at (dirty.mgen). The ingesting process updates it write-through; another process sees
+# the generation move and reads only the trades keyed after its newest one, or reloads
+# the whole tail when a tailreset marker at a newer generation says older trades changed.
+SEQ_MUL = 1_000_000  # sort key = ts * SEQ_MUL + seq (trade keys are trade:{cid}:{ts:010d}:{seq:06d})
+NO_WID = 0xFFFFFFFF
+_U64 = struct.Struct("<Q")
+
+# sort key, wid (NO_WID if none), yes-space trade price (nan if unknown), abs usd, direction
+TailRow = Tuple[int, int, float, float, int]
+
+
+def k_tail_reset(condition_id: str) -> str:
+    return f"tailreset:{condition_id}"
+
+
+def mark_tail_reset(txn: lmdb.Transaction, condition_id: str, gen: int) -> None:
+    """
+    Tell cached tails that trades before the market's newest changed at generation gen.
+    """
+    txn.put(k_tail_reset(condition_id).encode("utf-8"), _U64.pack(gen))
+
+
+def last_trade_key(txn: lmdb.Transaction, condition_id: str) -> Optional[bytes]:
+    """
+    Key of the market's newest trade, in a caller's raw txn (ingest, before its puts).
+    """
+    prefix = f"trade:{condition_id}:".encode("utf-8")
+    cur = txn.cursor()
+    if cur.set_range(prefix[:-1] + b";"):  # ";" sorts right after ":"
+        if not cur.prev():
+            return None
+    elif not cur.last():
+        return None
+    k = bytes(cur.key())
+    return k if k.startswith(prefix) else None
+
+
+def tail_row(trade: Dict[str, Any], ts: int, seq: int) -> TailRow:
+    wid = trade.get("wid")
+    p0 = trade_yes_price(trade)
+    return (
+        ts * SEQ_MUL + seq,
+        NO_WID if wid is None else int(wid),
+        math.nan if p0 is None else p0,
+        trade_usd_abs(trade),
+        trade_direction(trade),
+    )
+
+
+class TradeTail:
+    """
+    Immutable snapshot of one market's recent trades (column arrays, key order).
+    Writers build a new tail and swap it in, so readers can hold one without locking.
+    """
+
+    __slots__ = ("keys", "wid", "p0", "usd", "dirn", "since", "gen", "span", "no_wid")
+
+    def __init__(self, rows: Sequence[TailRow], since: int, gen: int, span: int) -> None:
+        self.keys = array("q", (r[0] for r in rows))
+        self.wid = array("I", (r[1] for r in rows))
+        self.p0 = array("d", (r[2] for r in rows))
+        self.usd = array("d", (r[3] for r in rows))
+        self.dirn = array("b", (r[4] for r in rows))
+        self.since = since
+        self.gen = gen
+        self.span = span
+        self.no_wid = NO_WID in self.wid
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self.keys, self.wid, self.p0, self.usd, self.dirn))
+
+    def rows(self, lo: int = 0) -> List[TailRow]:
+        return list(zip(self.keys[lo:], self.wid[lo:], self.p0[lo:], self.usd[lo:], self.dirn[lo:]))
+
+    def ts(self, i: int) -> int:
+        return self.keys[i] // SEQ_MUL
+
+    def start(self, ts: int) -> int:
+        """
+        Index of the first trade at or after ts.
+        """
+        return bisect_left(self.keys, ts * SEQ_MUL)
+
+    def find(self, ts: int, seq: int) -> int:
+        """
+        Index of trade (ts, seq), or -1.
+        """
+        k = ts * SEQ_MUL + seq
+        i = bisect_left(self.keys, k)
+        return i if i < len(self.keys) and self.keys[i] == k else -1
+
+    def merged(self, rows: Sequence[TailRow], gen: int, keep_sec: int) -> "TradeTail":
+        """
+        This tail plus rows (a row replaces the cached trade with its key), trimmed to
+        keep_sec (at least the span readers asked for) behind the newest trade.
+        """
+        rows = sorted(rows)
+        if not len(self.keys) or rows[0][0] > self.keys[-1]:
+            out = self.rows() + rows
+        else:
+            by_key = {r[0]: r for r in self.rows()}
+            by_key.update((r[0], r) for r in rows)
+            out = sorted(by_key.values())
+        return _trimmed(out, self.since, gen, max(keep_sec, self.span))
+
+
+def _trimmed(rows: List[TailRow], since: int, gen: int, span: int) -> TradeTail:
+    # keep span seconds behind the newest trade
+    if rows:
+        cut = rows[-1][0] // SEQ_MUL - span
+        if cut > since:
+            rows = rows[bisect_left(rows, (cut * SEQ_MUL,)) :]
+            since = cut
+    return TradeTail(rows, since, gen, span)
+
+
+def _load_rows(tx: StoreTxn, condition_id: str, since: int, after: int = -1) -> List[TailRow]:
+    # trades from ts since on, keyed after sort key `after`
+    prefix = f"trade:{condition_id}:"
+    out: List[TailRow] = []
+    for k, v in tx.scan(prefix, start=f"{prefix}{max(0, since, after // SEQ_MUL):010d}"):
+        ts, seq = bytes(k[len(prefix) :]).split(b":")
+        key = int(ts) * SEQ_MUL + int(seq)
+        if key > after:
+            out.append(tail_row(orjson.loads(v), int(ts), int(seq)))
+    return out
+
+
+class TradeTailCache:
+    """
+    Per-process LRU of market tails under a memory budget (sum of their arrays).
+
+    get() serves a tail from memory when it covers the asked start and the market's
+    generation hasn't moved (one small LMDB get), and otherwise reads what's missing
+    from LMDB and caches the result: a hit costs no scan and no orjson. Tails are kept
+    at least tail_sec deep; least recently used markets are evicted past max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = 64 << 20, tail_sec: int = 6 * 3600) -> None:
+        self.max_bytes = int(max_bytes)
+        self.tail_sec = int(tail_sec)
+        self._tails: "OrderedDict[str, TradeTail]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, tx: StoreTxn, condition_id: str, since: int, load: bool = True) -> Optional[TradeTail]:
+        """
+        Tail holding every trade of the market from since on, as of tx. With load=False
+        only a cached tail is returned (None when it would need an LMDB scan).
+        """
+        mg = market_gen(tx, condition_id)
+        gen, newest = mg if mg is not None else (0, 0)
+        with self._lock:
+            tail = self._tails.get(condition_id)
+            if tail is not None:
+                self._tails.move_to_end(condition_id)
+        if tail is not None and tail.gen == gen and tail.since <= since:
+            self.hits += 1
+            return tail
+        self.misses += 1
+        if not load:
+            return None
+
+        span = max(self.tail_sec, newest - since) if newest else self.tail_sec
+        if tail is not None and tail.since <= since and mg is not None and not self._reset_since(tx, condition_id, tail):
+            # generation moved by appends only: read the trades keyed after the cached ones
+            after = tail.keys[-1] if len(tail) else -1
+            rows = tail.rows() + _load_rows(tx, condition_id, tail.since, after)
+            tail = _trimmed(rows, tail.since, gen, max(tail.span, span))
+        else:
+            start = min(since, newest - self.tail_sec) if newest else since
+            tail = TradeTail(_load_rows(tx, condition_id, start), start, gen, span)
+        self._put(condition_id, tail)
+        return tail
+
+    def _reset_since(self, tx: StoreTxn, condition_id: str, tail: TradeTail) -> bool:
+        b = tx.get(k_tail_reset(condition_id))
+        return b is not None and _U64.unpack(b)[0] > tail.gen
+
+    def _put(self, condition_id: str, tail: TradeTail) -> None:
+        with self._lock:
+            old = self._tails.pop(condition_id, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            if tail.nbytes > self.max_bytes:
+                return
+            self._tails[condition_id] = tail
+            self.nbytes += tail.nbytes
+            while self.nbytes > self.max_bytes:
+                _, ev = self._tails.popitem(last=False)
+                self.nbytes -= ev.nbytes
+                self.evictions += 1
+
+    def ingest(self, condition_id: str, rows: Sequence[TailRow], prev_gen: int, gen: int) -> None:
+        """
+        Write-through from ingest_trades after its commit: fold the batch into the cached
+        tail when that tail was current just before it, else drop the tail.
+        """
+        with self._lock:
+            tail = self._tails.get(condition_id)
+        if tail is None:
+            return
+        rows = [r for r in rows if r[0] >= tail.since * SEQ_MUL]
+        if tail.gen != prev_gen:
+            self.invalidate(condition_id)
+        elif rows:
+            self._put(condition_id, tail.merged(rows, gen, self.tail_sec))
+
+    def invalidate(self, condition_id: str) -> None:
+        with self._lock:
+            tail = self._tails.pop(condition_id, None)
+            if tail is not None:
+                self.nbytes -= tail.nbytes
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "markets": len(self._tails),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def trade_cache(store: Any) -> Optional[TradeTailCache]:
+    """
+    The store's trade tail cache, if one was attached (readers then use it).
+    """
+    return getattr(store, "_trade_cache", None)
+
+
+def attach_trade_cache(store: LMDBStore, max_bytes: int, tail_sec: int) -> TradeTailCache:
+    """
+    Put a TradeTailCache in front of the store (kept on the store object, like wallet_ids).
+    """
+    cache = TradeTailCache(max_bytes, tail_sec)
+    setattr(store, "_trade_cache", cache)
+    return cache
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Literal, Optional
+from typing import Literal, Optional, Tuple
 
 Side = Literal["BUY", "SELL"]
 Outcome = Literal["Yes", "No"]
@@ -27,11 +27,50 @@ class PriceSnap:
     yes_price: float  # proxy yes price in [0,1]
 
 
+@dataclass(frozen=True)
+class HorizonStats:
+    """
+    Online edge statistics for one horizon: Welford count/mean/M2 plus an
+    exponentially decayed mean (equal to mean when decay is disabled).
+    """
+
+    horizon_sec: int
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+    ewm: float = 0.0
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+
 @dataclass(frozen=True)
 class WalletStats:
     wallet: str
     n_trades: int
     volume_usd: float
     score: float
-    score_1h: float
-    score_4h: float
+    horizons: Tuple[HorizonStats, ...] = ()
+
+    def horizon(self, horizon_sec: int) -> Optional[HorizonStats]:
+        for h in self.horizons:
+            if h.horizon_sec == horizon_sec:
+                return h
+        return None
+
+
+@dataclass(frozen=True)
+class Position:
+    """
+    A wallet's net share exposure in one market. cost_usd is net cash paid
+    (buys minus sells, both outcomes), so cost_usd / shares is the average entry.
+    """
+
+    wallet: str
+    condition_id: str
+    net_yes: float
+    net_no: float
+    cost_usd: float
+    volume_usd: float
+    n_trades: int
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 import orjson
 
@@ -15,13 +15,15 @@ def _safe_float(x: Any, default: float = 0.0) -> float:
         return default
 
 
-def select_universe(size: int, out_path: Path) -> List[Dict[str, Any]]:
+def select_universe(size: int, out_path: Path, client: Optional[PolymarketClient] = None) -> List[Dict[str, Any]]:
     """
     Select ~N markets using Gamma /markets list.
     Heuristic: sort by volume (if present) then by liquidity-ish fields if available.
     The field names can vary; we handle common ones.
     """
-    client = PolymarketClient()
+    own_client = client is None
+    if client is None:
+        client = PolymarketClient()
     try:
         markets: List[Dict[str, Any]] = []
         offset = 0
@@ -67,4 +69,5 @@ def select_universe(size: int, out_path: Path) -> List[Dict[str, Any]]:
         out_path.write_bytes(orjson.dumps({"size": size, "markets": uni}, option=orjson.OPT_INDENT_2))
         return uni
     finally:
-        client.close()
+        if own_client:
+            client.close()
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import struct
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+import lmdb
+
+from .storage_lmdb import LMDBStore
+
+# Persistent wallet dictionary: every address seen at ingest gets a dense uint32 id.
+#   wid:a:{address}  -> id (u32 LE)
+#   wid:i:{id:08x}   -> address (utf-8)
+#   wid:next         -> next free id (u32 LE)
+# Ids are per store (per shard) and never reassigned, so they are safe to cache.
+_U32 = struct.Struct("<I")
+K_NEXT = "wid:next"
+
+
+def k_wid_addr(address: str) -> str:
+    return f"wid:a:{address}"
+
+
+def k_wid_id(wid: int) -> str:
+    return f"wid:i:{wid:08x}"
+
+
+def decode_wid(b: bytes) -> int:
+    return _U32.unpack(b)[0]
+
+
+class WalletIds:
+    """
+    Address <-> id mapping of one store, with in-process caches in both directions.
+    Allocation runs in a single write txn that re-checks the dictionary, so concurrent
+    writers (collector and scorer on the same shard) agree on ids. Writers that already
+    hold a txn (group-commit jobs) use intern_in_txn and remember() the ids once committed.
+    """
+
+    def __init__(self, store: LMDBStore) -> None:
+        self.store = store
+        self._by_addr: Dict[str, int] = {}
+        self._by_id: Dict[int, str] = {}
+
+    def _remember(self, address: str, wid: int) -> None:
+        self._by_addr[address] = wid
+        self._by_id[wid] = address
+
+    def remember(self, ids: Dict[str, int]) -> None:
+        """
+        Cache ids allocated by intern_in_txn, after their txn committed.
+        """
+        for a, wid in ids.items():
+            self._remember(a, wid)
+
+    def lookup(self, address: str) -> Optional[int]:
+        wid = self._by_addr.get(address)
+        if wid is None:
+            b = self.store.get(k_wid_addr(address))
+            if b is None:
+                return None
+            wid = decode_wid(b)
+            self._remember(address, wid)
+        return wid
+
+    def address(self, wid: int) -> Optional[str]:
+        addr = self._by_id.get(wid)
+        if addr is None:
+            b = self.store.get(k_wid_id(wid))
+            if b is None:
+                return None
+            addr = bytes(b).decode("utf-8")
+            self._remember(addr, wid)
+        return addr
+
+    def intern_in_txn(self, txn: lmdb.Transaction, addresses: Iterable[str]) -> Dict[str, int]:
+        """
+        Ids for all addresses inside the caller's write txn, allocating the unknown ones.
+        Nothing is cached: the caller passes the result to remember() after its commit.
+        """
+        out: Dict[str, int] = {}
+        nxt: Optional[int] = None
+        for a in dict.fromkeys(addresses):
+            wid = self._by_addr.get(a)
+            if wid is None:
+                ka = k_wid_addr(a).encode("utf-8")
+                cur = txn.get(ka)
+                if cur is not None:
+                    wid = decode_wid(cur)
+                else:
+                    if nxt is None:
+                        b = txn.get(K_NEXT.encode("utf-8"))
+                        nxt = decode_wid(b) if b is not None else 0
+                    wid = nxt
+                    nxt += 1
+                    txn.put(ka, _U32.pack(wid))
+                    txn.put(k_wid_id(wid).encode("utf-8"), a.encode("utf-8"))
+            out[a] = wid
+        if nxt is not None:
+            txn.put(K_NEXT.encode("utf-8"), _U32.pack(nxt))
+        return out
+
+    def intern_many(self, addresses: Iterable[str]) -> Dict[str, int]:
+        """
+        Ids for all addresses, allocating the unknown ones. Returns {address: id}.
+        """
+        out: Dict[str, int] = {}
+        missing = []
+        for a in dict.fromkeys(addresses):
+            wid = self.lookup(a)
+            if wid is None:
+                missing.append(a)
+            else:
+                out[a] = wid
+        if not missing:
+            return out
+        new = self.store.write(lambda txn: self.intern_in_txn(txn, missing))
+        self.remember(new)
+        out.update(new)
+        return out
+
+    def intern(self, address: str) -> int:
+        return self.intern_many([address])[address]
+
+    def iter_addresses(self) -> Iterator[Tuple[str, int]]:
+        """
+        (address, id) for every interned wallet, in address order.
+        """
+        n = len("wid:a:")
+        for k, v in self.store.scan_prefix("wid:a:"):
+            yield k[n:], decode_wid(v)
+
+
+def wallet_ids(store: LMDBStore) -> WalletIds:
+    """
+    Shared WalletIds of a store (kept on the store object), so its caches survive across calls.
+    """
+    ids = getattr(store, "_wallet_ids", None)
+    if ids is None:
+        ids = WalletIds(store)
+        setattr(store, "_wallet_ids", ids)
+    return ids
+
+
+class WalletBitmap:
+    """
+    Set of wallet ids as a bitset: one bit per id, so a smart set of a million-wallet
+    dictionary is 128KB and membership is a shift and a mask.
+    """
+
+    __slots__ = ("_bits", "_n")
+
+    def __init__(self, ids: Iterable[int] = ()) -> None:
+        self._bits = bytearray()
+        self._n = 0
+        for wid in ids:
+            self.add(wid)
+
+    def add(self, wid: int) -> None:
+        i = wid >> 3
+        if i >= len(self._bits):
+            self._bits.extend(bytes(i + 1 - len(self._bits)))
+        m = 1 << (wid & 7)
+        if not self._bits[i] & m:
+            self._bits[i] |= m
+            self._n += 1
+
+    def __contains__(self, wid: object) -> bool:
+        if not isinstance(wid, int) or wid < 0:
+            return False
+        i = wid >> 3
+        return i < len(self._bits) and bool(self._bits[i] & (1 << (wid & 7)))
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __iter__(self) -> Iterator[int]:
+        for i, byte in enumerate(self._bits):
+            if byte:
+                for j in range(8):
+                    if byte & (1 << j):
+                        yield (i << 3) | j
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import struct
+from dataclasses import replace
+from typing import Dict, List, Optional, Sequence
+
+import orjson
+
+from .types import HorizonStats, WalletStats
+
+# Binary layout (little endian):
+#   header : version u8, n_horizons u8, n_trades u32, volume_usd f64, score f64
+#   horizon: horizon_sec u32, count u32, mean f64, m2 f64, ewm f64   (x n_horizons)
+STATS_VERSION = 1
+_HEAD = struct.Struct("<BBIdd")
+_HOR = struct.Struct("<IIddd")
+
+# Horizons implied by the v0 JSON field names.
+_LEGACY_HORIZONS = (("1h", 3600), ("4h", 14400))
+
+
+def encode_wallet_stats(ws: WalletStats) -> bytes:
+    buf = bytearray(_HEAD.size + _HOR.size * len(ws.horizons))
+    _HEAD.pack_into(buf, 0, STATS_VERSION, len(ws.horizons), ws.n_trades, ws.volume_usd, ws.score)
+    off = _HEAD.size
+    for h in ws.horizons:
+        _HOR.pack_into(buf, off, h.horizon_sec, h.count, h.mean, h.m2, h.ewm)
+        off += _HOR.size
+    return bytes(buf)
+
+
+def _decode_legacy_json(wallet: str, b: bytes) -> WalletStats:
+    d = orjson.loads(b)
+    horizons = []
+    for suffix, sec in _LEGACY_HORIZONS:
+        cnt = int(d.get(f"cnt_edge_{suffix}", 0))
+        mean = float(d.get(f"sum_edge_{suffix}", 0.0)) / max(1, cnt)
+        # v0 never tracked dispersion, so variance restarts from zero
+        horizons.append(HorizonStats(sec, cnt, mean, 0.0, mean))
+    return WalletStats(
+        wallet=wallet,
+        n_trades=int(d.get("n_trades", 0)),
+        volume_usd=float(d.get("volume_usd", 0.0)),
+        score=float(d.get("score", 0.0)),
+        horizons=tuple(horizons),
+    )
+
+
+def decode_wallet_stats(wallet: str, b: Optional[bytes]) -> Optional[WalletStats]:
+    """
+    Decode stored stats; also reads the v0 JSON dicts written before the binary format.
+    """
+    if b is None:
+        return None
+    if b[:1] == b"{":
+        return _decode_legacy_json(wallet, bytes(b))
+    version, n, n_trades, volume_usd, score = _HEAD.unpack_from(b, 0)
+    if version != STATS_VERSION:
+        raise ValueError(f"Unsupported wallet stats version {version} for {wallet}")
+    horizons = tuple(HorizonStats(*_HOR.unpack_from(b, _HEAD.size + i * _HOR.size)) for i in range(n))
+    return WalletStats(wallet, n_trades, volume_usd, score, horizons)
+
+
+def empty_wallet_stats(wallet: str, windows: Sequence[int]) -> WalletStats:
+    return WalletStats(wallet, 0, 0.0, 0.0, tuple(HorizonStats(int(w)) for w in windows))
+
+
+def horizon_update(h: HorizonStats, x: float, ewm_alpha: float = 0.0) -> HorizonStats:
+    """
+    O(1) Welford step; the decayed mean uses weight ewm_alpha on the new edge.
+    """
+    count = h.count + 1
+    delta = x - h.mean
+    mean = h.mean + delta / count
+    m2 = h.m2 + delta * (x - mean)
+    if ewm_alpha > 0.0:
+        ewm = x if h.count == 0 else h.ewm + ewm_alpha * (x - h.ewm)
+    else:
+        ewm = mean
+    return HorizonStats(h.horizon_sec, count, mean, m2, ewm)
+
+
+def score_weights(windows: Sequence[int], weights: Sequence[float] = ()) -> List[float]:
+    """
+    Normalized per-horizon weights. Without explicit weights: 0.6/0.4 for two horizons
+    (the original 1h/4h blend), equal weights otherwise.
+    """
+    n = len(windows)
+    if n == 0:
+        return []
+    if len(weights) == n:
+        w = [float(x) for x in weights]
+    elif n == 2:
+        w = [0.6, 0.4]
+    else:
+        w = [1.0] * n
+    total = sum(w) or 1.0
+    return [x / total for x in w]
+
+
+def wallet_score(
+    ws: WalletStats, windows: Sequence[int], weights: Sequence[float] = (), use_ewm: bool = False
+) -> float:
+    by_h: Dict[int, HorizonStats] = {h.horizon_sec: h for h in ws.horizons}
+    score = 0.0
+    for w, wt in zip(windows, score_weights(windows, weights)):
+        h = by_h.get(int(w))
+        if h is None or h.count == 0:
+            continue
+        score += wt * (h.ewm if use_ewm else h.mean)
+    return score
+
+
+def apply_edges(
+    ws: WalletStats,
+    edges: Dict[int, float],
+    windows: Sequence[int],
+    weights: Sequence[float] = (),
+    ewm_alpha: float = 0.0,
+) -> WalletStats:
+    """
+    Fold horizon edges of an already counted trade into the stats (as its horizons mature).
+    Configured horizons missing from older records are added; unknown stored ones are kept.
+    """
+    by_h: Dict[int, HorizonStats] = {h.horizon_sec: h for h in ws.horizons}
+    for w in windows:
+        by_h.setdefault(int(w), HorizonStats(int(w)))
+    for w, e in edges.items():
+        by_h[int(w)] = horizon_update(by_h.get(int(w), HorizonStats(int(w))), float(e), ewm_alpha)
+    out = replace(ws, horizons=tuple(by_h[k] for k in sorted(by_h)))
+    return replace(out, score=wallet_score(out, windows, weights, use_ewm=ewm_alpha > 0.0))
+
+
+def apply_trade(
+    ws: WalletStats,
+    volume_usd: float,
+    edges: Dict[int, float],
+    windows: Sequence[int],
+    weights: Sequence[float] = (),
+    ewm_alpha: float = 0.0,
+) -> WalletStats:
+    """
+    Fold one trade (its USD volume and whatever horizon edges are known) into the stats.
+    """
+    counted = replace(ws, n_trades=ws.n_trades + 1, volume_usd=ws.volume_usd + float(volume_usd))
+    return apply_edges(counted, edges, windows, weights, ewm_alpha)
+
+
+def merge_horizon(a: HorizonStats, b: HorizonStats) -> HorizonStats:
+    """
+    Combine two partial states of the same horizon (Chan et al. parallel Welford).
+    The decayed means have no exact merge; they are blended by count.
+    """
+    if a.count == 0:
+        return b
+    if b.count == 0:
+        return a
+    n = a.count + b.count
+    delta = b.mean - a.mean
+    mean = a.mean + delta * b.count / n
+    m2 = a.m2 + b.m2 + delta * delta * a.count * b.count / n
+    ewm = (a.ewm * a.count + b.ewm * b.count) / n
+    return HorizonStats(a.horizon_sec, n, mean, m2, ewm)
+
+
+def merge_wallet_stats(
+    a: WalletStats,
+    b: WalletStats,
+    windows: Sequence[int],
+    weights: Sequence[float] = (),
+    use_ewm: bool = False,
+) -> WalletStats:
+    """
+    Merge stats of one wallet computed on disjoint sets of trades (e.g. different shards).
+    """
+    by_h: Dict[int, HorizonStats] = {h.horizon_sec: h for h in a.horizons}
+    for h in b.horizons:
+        by_h[h.horizon_sec] = merge_horizon(by_h[h.horizon_sec], h) if h.horizon_sec in by_h else h
+    out = WalletStats(
+        wallet=a.wallet,
+        n_trades=a.n_trades + b.n_trades,
+        volume_usd=a.volume_usd + b.volume_usd,
+        score=0.0,
+        horizons=tuple(by_h[k] for k in sorted(by_h)),
+    )
+    return replace(out, score=wallet_score(out, windows, weights, use_ewm=use_ewm))